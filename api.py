@@ -0,0 +1,314 @@
+"""Versioned JSON API for Warbler, mounted at /api/v1.
+
+Clients log in through the site's /login and use the same session cookie.
+Responses are built straight from row tuples rather than ORM objects, and
+every read takes `?fields=a,b,...` to return only some fields. Lists are
+keyset-paginated like the HTML pages: each carries `prev` / `next` cursors
+to pass back as `?before=` / `?after=`.
+
+Likes and follows are made with PUT and undone with DELETE. Browsers won't
+send those cross-site without a CORS preflight, so they need no CSRF token.
+
+    GET    /api/v1/feed
+    GET    /api/v1/users/<id>
+    GET    /api/v1/users/<id>/messages
+    GET    /api/v1/messages/<id>
+    PUT    /api/v1/messages/<id>/like      DELETE  /api/v1/messages/<id>/like
+    PUT    /api/v1/users/<id>/follow       DELETE  /api/v1/users/<id>/follow
+"""
+
+from datetime import datetime
+
+from flask import Blueprint, abort, current_app, g, jsonify, request
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+
+from models import db, not_deleted, Message, User
+import social
+import timeline
+from pagination import (
+    paginate, decode_cursor, message_key, MESSAGE_CURSOR)
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'user_id': Message.user_id,
+    'like_count': Message.like_count,
+    'username': User.username,
+    'image_url': User.image_url,
+}
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+}
+
+# always selected, since cursors are made from them
+MESSAGE_KEY_FIELDS = ['timestamp', 'id']
+USER_KEY_FIELDS = ['id']
+
+ENCODERS = {
+    'timestamp': datetime.isoformat,
+}
+
+
+@blueprint.before_request
+def require_login():
+    """Every API route needs a logged-in user."""
+
+    if not g.user:
+        abort(401, "Login required.")
+
+
+@blueprint.errorhandler(HTTPException)
+def error_json(error):
+    """Send errors as `{"error": description}`."""
+
+    return jsonify(error=error.description), error.code
+
+
+##############################################################################
+# Serialization
+
+
+def requested_fields(available):
+    """Field names from `?fields=`, or all of `available` if not given."""
+
+    fields = request.args.get('fields')
+
+    if fields is None:
+        return list(available)
+
+    names = list(dict.fromkeys(
+        name.strip() for name in fields.split(',') if name.strip()))
+    unknown = [name for name in names if name not in available]
+
+    if unknown or not names:
+        abort(400, f"Unknown fields: {', '.join(unknown) or fields!r}")
+
+    return names
+
+
+def select_fields(available, key_fields, fields):
+    """Query of rows with the sort key and `fields`, and its column names."""
+
+    names = list(dict.fromkeys(key_fields + fields))
+    query = db.session.query(*(available[name].label(name) for name in names))
+
+    return query, names
+
+
+def serialize(rows, names, fields):
+    """Turn rows of the `names` columns into dicts of just `fields`."""
+
+    getters = [(field, names.index(field), ENCODERS.get(field))
+               for field in fields]
+
+    return [
+        {field: encode(row[i]) if encode else row[i]
+         for field, i, encode in getters}
+        for row in rows]
+
+
+def message_query(fields):
+    """`select_fields` for messages, joining their authors if needed."""
+
+    query, names = select_fields(MESSAGE_FIELDS, MESSAGE_KEY_FIELDS, fields)
+    query = query.select_from(Message)
+
+    if any(MESSAGE_FIELDS[name].class_ is User for name in names):
+        query = query.join(User, User.id == Message.user_id)
+
+    return query, names
+
+
+def page_json(page, names, fields):
+    """JSON response for one page of rows."""
+
+    return jsonify(
+        items=serialize(page, names, fields),
+        prev=page.prev_cursor,
+        next=page.next_cursor)
+
+
+def one_json(query, names, fields):
+    """JSON response for the single row of `query`, or 404."""
+
+    row = query.first()
+
+    if row is None:
+        abort(404)
+
+    return jsonify(serialize([row], names, fields)[0])
+
+
+##############################################################################
+# Reads
+
+
+@blueprint.get('/feed')
+def feed():
+    """Most recent messages of g.user and the users they follow."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    messages, names = message_query(fields)
+    messages = messages.filter(not_deleted(Message.user_id))
+
+    per_page = current_app.config['FEED_PAGE_SIZE']
+    after = decode_cursor(request.args.get('after'), MESSAGE_CURSOR)
+    before = decode_cursor(request.args.get('before'), MESSAGE_CURSOR)
+
+    if timeline.timeline_enabled():
+        page = timeline.get_timeline_page(
+            g.user, per_page, after=after, before=before, messages=messages)
+
+    else:
+        following_ids = list(g.user.get_following_ids()) + [g.user.id]
+
+        page = paginate(
+            messages.filter(Message.user_id.in_(following_ids)),
+            [Message.timestamp, Message.id],
+            message_key,
+            per_page,
+            after=after,
+            before=before)
+
+    return page_json(page, names, fields)
+
+
+@blueprint.get('/users/<int:user_id>')
+def show_user(user_id):
+    """A user's profile."""
+
+    fields = requested_fields(USER_FIELDS)
+    query, names = select_fields(USER_FIELDS, USER_KEY_FIELDS, fields)
+
+    return one_json(
+        query.filter(User.id == user_id).filter(User.deleted_at.is_(None)),
+        names, fields)
+
+
+@blueprint.get('/users/<int:user_id>/messages')
+def list_user_messages(user_id):
+    """A user's messages, newest first."""
+
+    check_user_exists(user_id)
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    messages, names = message_query(fields)
+
+    page = paginate(
+        messages.filter(Message.user_id == user_id),
+        [Message.timestamp, Message.id],
+        message_key,
+        current_app.config['PROFILE_PAGE_SIZE'],
+        after=decode_cursor(request.args.get('after'), MESSAGE_CURSOR),
+        before=decode_cursor(request.args.get('before'), MESSAGE_CURSOR))
+
+    return page_json(page, names, fields)
+
+
+@blueprint.get('/messages/<int:message_id>')
+def show_message(message_id):
+    """A single message."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    query, names = message_query(fields)
+
+    return one_json(
+        query.filter(Message.id == message_id)
+        .filter(not_deleted(Message.user_id)),
+        names, fields)
+
+
+##############################################################################
+# Likes and follows
+
+
+def get_author_id(message_id):
+    """Id of a message's author, or 404 (also if they're deleted)."""
+
+    author_id = db.session.scalar(
+        select(Message.user_id)
+        .where(Message.id == message_id)
+        .where(not_deleted(Message.user_id)))
+
+    if author_id is None:
+        abort(404)
+
+    return author_id
+
+
+def check_user_exists(user_id):
+    """404 unless there's a (not deleted) user with this id."""
+
+    user_id = db.session.scalar(
+        select(User.id)
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_(None)))
+
+    if user_id is None:
+        abort(404)
+
+
+@blueprint.put('/messages/<int:message_id>/like')
+def like_message(message_id):
+    """Like a message that isn't g.user's own."""
+
+    if get_author_id(message_id) == g.user.id:
+        abort(403, "You can't like your own message.")
+
+    social.set_liked(g.user.id, message_id, True)
+    db.session.commit()
+
+    return jsonify(liked=True)
+
+
+@blueprint.delete('/messages/<int:message_id>/like')
+def unlike_message(message_id):
+    """Stop liking a message."""
+
+    get_author_id(message_id)
+
+    social.set_liked(g.user.id, message_id, False)
+    db.session.commit()
+
+    return jsonify(liked=False)
+
+
+@blueprint.put('/users/<int:user_id>/follow')
+def follow_user(user_id):
+    """Follow another user."""
+
+    if user_id == g.user.id:
+        abort(403, "You can't follow yourself.")
+
+    check_user_exists(user_id)
+
+    social.follow(g.user.id, user_id)
+    db.session.commit()
+
+    return jsonify(following=True)
+
+
+@blueprint.delete('/users/<int:user_id>/follow')
+def unfollow_user(user_id):
+    """Stop following a user."""
+
+    check_user_exists(user_id)
+
+    social.unfollow(g.user.id, user_id)
+    db.session.commit()
+
+    return jsonify(following=False)
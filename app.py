@@ -1,50 +1,304 @@
 import os
+from datetime import datetime, time, timedelta
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (
+    Blueprint, Flask, render_template, request, flash, redirect, session, g,
+    abort, current_app)
 #from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
-from forms import UserAddForm, LoginForm, MessageForm, CSRFProtectForm, UserEditForm
-from models import db, connect_db, User, Message, Follow
+from forms import (
+    UserAddForm, LoginForm, MessageForm, MessageSearchForm, CSRFProtectForm,
+    UserEditForm)
+from models import db, connect_db, not_deleted, User, Message, Follow
+import timeline
+import counters
+import migrations
+import bulk_load
+import instrumentation
+import http_caching
+import social
+import api
+import purge
+import replicas
+import recommendations
+import template_cache
+import cache
+import fragments
+import followgraph
+import trending
+import realtime as live_feed
+from followgraph import follow_graph
+from trending import trending_likes, WINDOWS
+from realtime import realtime
+from search import (
+    index_user, search_users, reindex_users_command, index_message,
+    unindex_message, search_messages, reindex_messages_command)
+from cache import user_cache
+from fragments import message_fragments
+from pagination import (
+    paginate, decode_cursor, message_key, user_key, Page, MESSAGE_CURSOR,
+    USER_CURSOR)
 
 load_dotenv()
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
+views = Blueprint('views', __name__)
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = False
-#app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-# toolbar = DebugToolbarExtension(app)
 
-connect_db(app)
+def create_app(config=None):
+    """Build the Warbler app.
+
+    Settings come from the environment; `config` overrides any of them.
+    Nothing connects to the database until a request (or command) needs to.
+    """
+
+    app = Flask(__name__)
+
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
+    app.config['SQLALCHEMY_ECHO'] = False
+
+    # Connection pools (see models.engine_options); the statement timeout is
+    # in milliseconds, 0 for none
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_PRE_PING'] = (
+        os.environ.get('DB_POOL_PRE_PING', 'true') == 'true')
+    app.config['DB_POOL_RECYCLE'] = int(
+        os.environ.get('DB_POOL_RECYCLE', 1800))
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(
+        os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+    # Read replicas for @read_only views, comma separated (see replicas.py)
+    app.config['DATABASE_REPLICA_URLS'] = [
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url]
+    app.config['REPLICA_STICKY_SECONDS'] = int(
+        os.environ.get('REPLICA_STICKY_SECONDS', 10))
+    #app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
+    app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+    # toolbar = DebugToolbarExtension(app)
+
+    # Materialized home timelines (see timeline.py); they're trimmed back to
+    # depth once they're TRIM_SLACK entries over it
+    app.config['TIMELINE_ENABLED'] = (
+        os.environ.get('TIMELINE_ENABLED') == 'true')
+    app.config['TIMELINE_DEPTH'] = int(os.environ.get('TIMELINE_DEPTH', 800))
+    app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = int(
+        os.environ.get('TIMELINE_CELEBRITY_FOLLOWERS', 10000))
+    app.config['TIMELINE_TRIM_SLACK'] = int(
+        os.environ.get('TIMELINE_TRIM_SLACK', 50))
+
+    # Page sizes for keyset-paginated lists (see pagination.py)
+    app.config['FEED_PAGE_SIZE'] = 100
+    app.config['PROFILE_PAGE_SIZE'] = 50
+    app.config['USERS_PAGE_SIZE'] = 48
+    app.config['SEARCH_PAGE_SIZE'] = 50
+
+    # Session-user cache (see cache.py): local, shared or none
+    app.config['USER_CACHE_BACKEND'] = os.environ.get(
+        'USER_CACHE_BACKEND', 'local')
+    app.config['USER_CACHE_SIZE'] = 10000
+    app.config['USER_CACHE_TTL'] = 60
+
+    # Rendered message list items (see fragments.py); size 0 turns it off
+    app.config['FRAGMENT_CACHE_SIZE'] = int(
+        os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+    app.config['FRAGMENT_CACHE_TTL'] = 3600
+
+    # Password hashing (see passwords.py): bcrypt work factor, and the size of
+    # the process pool that hashes off the request's worker (0 = inline)
+    app.config['BCRYPT_LOG_ROUNDS'] = int(
+        os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    app.config['PASSWORD_HASH_WORKERS'] = int(
+        os.environ.get('PASSWORD_HASH_WORKERS', 0))
+
+    # Per-request SQL / timing instrumentation (see instrumentation.py);
+    # the Server-Timing header and /metrics are public, so opt-in
+    app.config['INSTRUMENTATION_ENABLED'] = (
+        os.environ.get('INSTRUMENTATION_ENABLED', 'true') == 'true')
+    app.config['SERVER_TIMING_HEADER'] = (
+        os.environ.get('SERVER_TIMING_HEADER') == 'true')
+    app.config['METRICS_ENDPOINT_ENABLED'] = (
+        os.environ.get('METRICS_ENDPOINT_ENABLED') == 'true')
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+
+    # In-process follow graph (see followgraph.py), rebuilt every TTL seconds
+    app.config['FOLLOW_GRAPH_ENABLED'] = (
+        os.environ.get('FOLLOW_GRAPH_ENABLED') == 'true')
+    app.config['FOLLOW_GRAPH_TTL'] = int(
+        os.environ.get('FOLLOW_GRAPH_TTL', 300))
+
+    # Batch likes/unlikes and write them every this many seconds (see
+    # social.py); 0 writes each one in its own request
+    app.config['LIKE_WRITE_BEHIND_INTERVAL'] = float(
+        os.environ.get('LIKE_WRITE_BEHIND_INTERVAL', 0))
+
+    # Trending messages (see trending.py): likes are counted in buckets of
+    # TRENDING_BUCKET_SECONDS and written to the database every
+    # TRENDING_CHECKPOINT_SECONDS
+    app.config['TRENDING_BUCKET_SECONDS'] = 300
+    app.config['TRENDING_CHECKPOINT_SECONDS'] = int(
+        os.environ.get('TRENDING_CHECKPOINT_SECONDS', 60))
+    app.config['TRENDING_SIZE'] = 50
+
+    # Who-to-follow suggestions (see recommendations.py): how many the batch
+    # job keeps per user, and how many the homepage shows
+    app.config['RECOMMENDATIONS_PER_USER'] = 20
+    app.config['SUGGESTIONS_SHOWN'] = 5
+
+    # Live feed streams (see realtime.py): local or postgres pub/sub, seconds
+    # between keepalives, and streams allowed per process
+    app.config['PUBSUB_BACKEND'] = os.environ.get('PUBSUB_BACKEND', 'local')
+    app.config['STREAM_KEEPALIVE'] = 15
+    app.config['STREAM_MAX_CONNECTIONS'] = int(
+        os.environ.get('STREAM_MAX_CONNECTIONS', 1000))
+
+    # Compiled templates (see template_cache.py): where to keep them across
+    # restarts; unset, every process compiles its own
+    app.config['TEMPLATE_CACHE_DIR'] = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    if config:
+        app.config.update(config)
+
+    connect_db(app)
+    replicas.init_app(app)
+    cache.init_app(app)
+    fragments.init_app(app)
+    instrumentation.init_app(app)
+    http_caching.init_app(app)
+    social.init_app(app)
+    followgraph.init_app(app)
+    trending.init_app(app)
+    live_feed.init_app(app)
+    template_cache.init_app(app)
+    app.register_blueprint(views)
+    app.register_blueprint(api.blueprint)
+
+    app.cli.add_command(timeline.rebuild_timelines_command)
+    app.cli.add_command(counters.reconcile_counters_command)
+    app.cli.add_command(migrations.db_cli)
+    app.cli.add_command(reindex_users_command)
+    app.cli.add_command(reindex_messages_command)
+    app.cli.add_command(bulk_load.load_data_command)
+    app.cli.add_command(purge.purge_deleted_users_command)
+    app.cli.add_command(recommendations.refresh_recommendations_command)
+    app.cli.add_command(template_cache.precompile_templates_command)
+
+    return app
+
+
+def __getattr__(name):
+    """`app`, built from the environment the first time it's imported (by
+    `flask`, gunicorn, the scripts and the tests).
+    """
+
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@views.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
+    # the app context (and so g) can outlive a request; start clean
+    g.pop('following_ids', None)
+    g.pop('liked_message_ids', None)
+
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = user_cache.get_user(session[CURR_USER_KEY])
+
+        # a deleted account stays logged out everywhere
+        if g.user and g.user.deleted_at:
+            g.user = None
 
     else:
         g.user = None
 
 
-@app.before_request
+@views.before_app_request
 def add_csrf_to_user():
     """Add CRSF form to g.user"""
 
     g.csrf_form = CSRFProtectForm()
 
 
+def get_following_ids():
+    """Ids of the users g.user follows, queried at most once per request."""
+
+    if 'following_ids' not in g:
+        g.following_ids = set()
+
+        if g.user and follow_graph.enabled:
+            # the follow graph may not have another process's changes yet;
+            # the user's own version stamp says whether it's caught up. It's
+            # read from the database: the cached user is as stale as the graph
+            version, following = follow_graph.versioned_following(g.user.id)
+            current_version = db.session.scalar(
+                db.select(User.graph_version).where(User.id == g.user.id))
+
+            if version == current_version:
+                g.following_ids = set(following)
+            else:
+                g.following_ids = g.user.get_following_ids()
+
+        elif g.user:
+            g.following_ids = g.user.get_following_ids()
+
+    return g.following_ids
+
+
+def get_liked_message_ids():
+    """Ids of the messages g.user likes, queried at most once per request."""
+
+    if 'liked_message_ids' not in g:
+        g.liked_message_ids = (
+            g.user.get_liked_message_ids() if g.user else set())
+
+        # likes and unlikes this process hasn't written yet
+        if g.user and social.like_queue.enabled:
+            for message_id, liked in social.like_queue.pending_for(
+                    g.user.id).items():
+                if liked:
+                    g.liked_message_ids.add(message_id)
+                else:
+                    g.liked_message_ids.discard(message_id)
+
+    return g.liked_message_ids
+
+
+def get_user_or_404(user_id):
+    """The user with this id, or a 404 if there's none or they're deleted."""
+
+    user = User.query.get_or_404(user_id)
+
+    if user.deleted_at:
+        abort(404)
+
+    return user
+
+
+@views.app_context_processor
+def add_membership_checks():
+    """Let templates check g.user's follows and likes with set lookups."""
+
+    return dict(
+        current_user_follows=lambda user: user.id in get_following_ids(),
+        current_user_likes=lambda msg: msg.id in get_liked_message_ids(),
+    )
+
+
 def do_login(user):
     """Log in user."""
 
@@ -58,7 +312,7 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -82,9 +336,12 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            db.session.flush()
+            index_user(user)
             db.session.commit()
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
@@ -96,7 +353,7 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login and redirect to homepage on success."""
 
@@ -109,6 +366,11 @@ def login():
         )
 
         if user:
+            # authenticate may have upgraded an outdated password hash
+            if db.session.is_modified(user):
+                user_cache.invalidate(user.id)
+                db.session.commit()
+
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -118,7 +380,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@views.post('/logout')
 def logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -136,11 +398,13 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@views.get('/users')
+@replicas.read_only
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations; results are ranked by how well they match.
     """
 
     if not g.user:
@@ -148,16 +412,31 @@ def list_users():
         return redirect("/")
 
     search = request.args.get('q')
+    per_page = current_app.config['USERS_PAGE_SIZE']
 
     if not search:
-        users = User.query.all()
+        users = paginate(
+            User.query.filter(User.deleted_at.is_(None)),
+            [User.id],
+            user_key,
+            per_page,
+            after=decode_cursor(request.args.get('after'), USER_CURSOR),
+            before=decode_cursor(request.args.get('before'), USER_CURSOR),
+            descending=False)
+
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = search_users(
+            search,
+            per_page,
+            after=request.args.get('after'),
+            before=request.args.get('before'))
 
     return render_template('users/index.html', users=users)
 
 
-@app.get('/users/<int:user_id>')
+@views.get('/users/<int:user_id>')
+@replicas.read_only
+@http_caching.conditional(http_caching.user_page_version)
 def show_user(user_id):
     """Show user profile."""
 
@@ -165,12 +444,20 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
 
-    return render_template('users/show.html', user=user)
+    messages = paginate(
+        Message.query.filter(Message.user_id == user.id),
+        [Message.timestamp, Message.id],
+        message_key,
+        current_app.config['PROFILE_PAGE_SIZE'],
+        after=decode_cursor(request.args.get('after'), MESSAGE_CURSOR),
+        before=decode_cursor(request.args.get('before'), MESSAGE_CURSOR))
 
+    return render_template('users/show.html', user=user, messages=messages)
 
-@app.get('/users/<int:user_id>/following/')
+
+@views.get('/users/<int:user_id>/following/')
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -178,11 +465,12 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
     return render_template('users/following.html', user=user)
 
 
-@app.get('/users/<int:user_id>/followers')
+@views.get('/users/<int:user_id>/followers')
+@replicas.read_only
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -190,11 +478,11 @@ def show_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = get_user_or_404(user_id)
     return render_template('users/followers.html', user=user)
 
 
-@app.post('/users/follow/<int:follow_id>')
+@views.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -205,14 +493,14 @@ def start_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = get_user_or_404(follow_id)
+    social.follow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@views.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -224,13 +512,13 @@ def stop_following(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    social.unfollow(g.user.id, followed_user.id)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@views.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -246,12 +534,14 @@ def profile():
             form.password.data)
 
         if user:
-            user.username = form.username.data,
-            user.email = form.email.data,
-            user.image_url = form.image_url.data,
-            user.header_image_url = form.header_image_url.data,
+            user.username = form.username.data
+            user.email = form.email.data
+            user.image_url = form.image_url.data
+            user.header_image_url = form.header_image_url.data
             user.bio = form.bio.data
+            index_user(user)
 
+            user_cache.invalidate(user.id)
             db.session.commit()
 
             flash("Edit successful!", "success")
@@ -263,10 +553,13 @@ def profile():
     return render_template("users/edit.html", form=form)
 
 
-@app.post('/users/delete')
+@views.post('/users/delete')
 def delete_user():
     """Delete user.
 
+    The account is hidden right away; its messages, likes and follows are
+    removed in the background by `flask purge-deleted-users`.
+
     Redirect to signup page.
     """
     #TODO: combine form.validate_on_submit and not g.user
@@ -280,9 +573,7 @@ def delete_user():
 
         do_logout()
 
-        Message.query.filter(Message.user_id == g.user.id).delete()
-
-        db.session.delete(g.user)
+        purge.soft_delete_user(g.user)
         db.session.commit()
 
 
@@ -290,7 +581,7 @@ def delete_user():
     return redirect("/signup")
 
 
-@app.get('/users/<int:user_id>/likes')
+@views.get('/users/<int:user_id>/likes')
 def show_liked_messages(user_id):
     """Display liked messages"""
 
@@ -298,9 +589,9 @@ def show_liked_messages(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get(user_id)
+    user = get_user_or_404(user_id)
 
-    messages = user.liked_messages
+    messages = [msg for msg in user.liked_messages if not msg.user.deleted_at]
     #TODO: can refer to messages via user, don't need to pass through
 
     return render_template('users/likes.html', user=user, messages=messages)
@@ -308,7 +599,7 @@ def show_liked_messages(user_id):
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@views.route('/messages/new', methods=["GET", "POST"])
 def add_message():
     """Add a message:
 
@@ -324,6 +615,15 @@ def add_message():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        counters.message_added(g.user.id)
+
+        db.session.flush()
+        index_message(msg)
+
+        if timeline.timeline_enabled():
+            timeline.fan_out_message(msg)
+
+        realtime.message_posted(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -331,7 +631,85 @@ def add_message():
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@views.get('/messages/search')
+def search_messages_page():
+    """Search messages.
+
+    Takes 'q' in the querystring, plus optional 'author' (a username) and
+    'since' / 'until' dates (inclusive). Results are ranked by how often
+    the search words appear, then newest first.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    form = MessageSearchForm(request.args)
+    messages = None
+
+    if request.args and form.validate():
+        author_id = None
+
+        if form.author.data:
+            author_id = db.session.scalar(
+                db.select(User.id).where(User.username == form.author.data))
+
+        if form.author.data and author_id is None:
+            messages = Page([], message_key, has_prev=False, has_next=False)
+        else:
+            since = form.since.data
+            until = form.until.data
+
+            messages = search_messages(
+                form.q.data,
+                current_app.config['SEARCH_PAGE_SIZE'],
+                author_id=author_id,
+                since=since and datetime.combine(since, time()),
+                until=until and datetime.combine(
+                    until + timedelta(days=1), time()),
+                after=request.args.get('after'),
+                before=request.args.get('before'))
+
+    return render_template(
+        'messages/search.html', form=form, messages=messages)
+
+
+@views.get('/messages/trending')
+@replicas.read_only
+def trending_messages():
+    """Show the messages liked most lately.
+
+    Takes 'window' in the querystring: 'hour' (the default) or 'day'.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    window = request.args.get('window', 'hour')
+
+    if window not in WINDOWS:
+        abort(404)
+
+    message_ids = [message_id
+                   for score, message_id in trending_likes.top(window)]
+
+    found = {msg.id: msg
+             for msg in Message.query.filter(Message.id.in_(message_ids))
+             if not msg.user.deleted_at}
+
+    # deleted messages can stay in the ranking until their buckets expire
+    messages = [found[message_id] for message_id in message_ids
+                if message_id in found]
+
+    return render_template(
+        'messages/trending.html', messages=messages, window=window,
+        windows=WINDOWS)
+
+
+@views.get('/messages/<int:message_id>')
+@replicas.read_only
+@http_caching.conditional(http_caching.message_page_version)
 def show_message(message_id):
     """Show a message."""
 
@@ -340,10 +718,14 @@ def show_message(message_id):
         return redirect("/")
 
     msg = Message.query.get_or_404(message_id)
+
+    if msg.user.deleted_at:
+        abort(404)
+
     return render_template('messages/show.html', message=msg)
 
 
-@app.post('/messages/<int:message_id>/delete')
+@views.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
@@ -353,20 +735,25 @@ def delete_message(message_id):
 
     msg = Message.query.get_or_404(message_id)
 
-    if not g.user or not (msg in g.user.messages):
+    if not g.user or msg.user_id != g.user.id:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     form = g.csrf_form
 
     if form.validate_on_submit():
+        counters.message_deleted(msg)
+        unindex_message(msg)
+
         db.session.delete(msg)
         db.session.commit()
 
+        message_fragments.invalidate_message(msg.id)
+
     return redirect(f"/users/{g.user.id}")
 
 
-@app.post('/messages/<int:message_id>/like')
+@views.post('/messages/<int:message_id>/like')
 def like_message(message_id):
     """Like a message."""
 
@@ -376,18 +763,19 @@ def like_message(message_id):
 
     liked_message = Message.query.get_or_404(message_id)
 
-    form = g.csrf_form
+    if liked_message.user.deleted_at:
+        abort(404)
 
-    if form.validate_on_submit() and (g.user.id != liked_message.user_id)\
-    and not (liked_message in g.user.liked_messages):
+    form = g.csrf_form
 
-        g.user.liked_messages.append(liked_message)
+    if form.validate_on_submit() and (g.user.id != liked_message.user_id):
+        social.set_liked(g.user.id, liked_message.id, True)
         db.session.commit()
 
     return redirect(request.referrer)
 
 
-@app.post('/messages/<int:message_id>/unlike')
+@views.post('/messages/<int:message_id>/unlike')
 def unlike_message(message_id):
     """Unlike a message."""
 
@@ -397,49 +785,75 @@ def unlike_message(message_id):
 
     unliked_message = Message.query.get_or_404(message_id)
 
-    form = g.csrf_form
+    if unliked_message.user.deleted_at:
+        abort(404)
 
-    if form.validate_on_submit() and (g.user.id != unliked_message.user_id)\
-        and (unliked_message in g.user.liked_messages):
+    form = g.csrf_form
 
-        g.user.liked_messages.remove(unliked_message)
+    if form.validate_on_submit() and (g.user.id != unliked_message.user_id):
+        social.set_liked(g.user.id, unliked_message.id, False)
         db.session.commit()
 
     return redirect(request.referrer)
 
 
+@views.get('/stream')
+def stream():
+    """Server-sent events with new messages from the user and everyone
+    they follow."""
+
+    if not g.user:
+        abort(401)
+
+    user_ids = [*get_following_ids(), g.user.id]
+
+    # the stream can stay open for hours; don't hold a connection for it
+    db.session.rollback()
+
+    return realtime.stream(user_ids)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.get('/')
+@views.get('/')
+@replicas.read_only
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of self & followed_users
+    - logged in: most recent messages of self & followed_users, a page of
+      FEED_PAGE_SIZE at a time, and who-to-follow suggestions
     """
 
-    if g.user:
-        following_ids = [following.id for following in g.user.following] + [g.user.id]
+    if not g.user:
+        return render_template('home-anon.html')
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+    per_page = current_app.config['FEED_PAGE_SIZE']
+    after = decode_cursor(request.args.get('after'), MESSAGE_CURSOR)
+    before = decode_cursor(request.args.get('before'), MESSAGE_CURSOR)
 
-        return render_template('home.html', messages=messages)
+    # deleted users' follows and timeline entries stay until the purge
+    visible = Message.query.filter(not_deleted(Message.user_id))
+
+    if timeline.timeline_enabled():
+        messages = timeline.get_timeline_page(
+            g.user, per_page, after=after, before=before, messages=visible)
 
     else:
-        return render_template('home-anon.html')
+        following_ids = list(get_following_ids()) + [g.user.id]
 
+        messages = paginate(
+            visible.filter(Message.user_id.in_(following_ids)),
+            [Message.timestamp, Message.id],
+            message_key,
+            per_page,
+            after=after,
+            before=before)
 
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
+    suggestions = recommendations.suggestions_for(
+        g.user.id, current_app.config['SUGGESTIONS_SHOWN'])
 
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+    return render_template(
+        'home.html', messages=messages, suggestions=suggestions)
@@ -0,0 +1,112 @@
+"""Measure login throughput with inline and pooled password hashing.
+
+Posts to /login from several threads through Flask's test client, first
+with hashing done inline and then in a process pool, and prints logins per
+second and latency for each. Run from the project root against a scratch
+database:
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.login_throughput --threads 8 --pool-workers 4
+
+A throwaway user is created for the run and deleted afterwards.
+"""
+
+import argparse
+import threading
+import time
+
+from app import app
+from models import db, User
+import passwords
+from benchmarks.stats import summarize
+
+USERNAME = "bench_login"
+PASSWORD = "bench-password"
+
+
+def run(num_threads, logins_per_thread):
+    """Log in from `num_threads` threads; return (latencies, elapsed)."""
+
+    latencies = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(num_threads + 1)
+
+    def worker():
+        client = app.test_client()
+        mine = []
+
+        start_line.wait()
+
+        for _ in range(logins_per_thread):
+            started = time.perf_counter()
+            resp = client.post(
+                "/login", data={"username": USERNAME, "password": PASSWORD})
+            mine.append(time.perf_counter() - started)
+
+            assert resp.status_code == 302, resp.status_code
+
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=worker) for _ in range(num_threads)]
+
+    for thread in threads:
+        thread.start()
+
+    start_line.wait()
+    started = time.perf_counter()
+
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - started
+
+
+def report(label, latencies, elapsed):
+    stats = summarize(latencies, elapsed)
+
+    print(f"{label:<24} "
+          f"{stats['requests_per_second']:8.1f} logins/s  "
+          f"p50 {stats['p50_ms']:7.1f} ms  "
+          f"p95 {stats['p95_ms']:7.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=12,
+                        help="bcrypt work factor")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="concurrent clients")
+    parser.add_argument("--logins", type=int, default=10,
+                        help="logins per client")
+    parser.add_argument("--pool-workers", type=int, default=4,
+                        help="process pool size for the pooled run")
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['BCRYPT_LOG_ROUNDS'] = args.rounds
+
+    User.query.filter_by(username=USERNAME).delete()
+    User.signup(USERNAME, f"{USERNAME}@example.com", PASSWORD, None)
+    db.session.commit()
+
+    try:
+        for workers in (0, args.pool_workers):
+            app.config['PASSWORD_HASH_WORKERS'] = workers
+
+            # warm up: starts the pool and the DB connections
+            run(args.threads, 1)
+
+            label = f"pool of {workers}" if workers else "inline"
+            report(label, *run(args.threads, args.logins))
+
+            passwords.shutdown()
+
+    finally:
+        User.query.filter_by(username=USERNAME).delete()
+        db.session.commit()
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        main()
@@ -0,0 +1,344 @@
+"""Benchmark Warbler's core routes.
+
+Drives the homepage, a profile, the user list, a following list, liking
+and posting, logged in as the user who follows the most people, and
+reports requests/s, p50/p95/p99 latency and SQL statements per request for
+each route. Results are also written to a JSON file stamped with the git
+commit so runs can be compared.
+
+Through the Flask test client, in-process (SQL statements are counted):
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.routes --seed-users 100000 --threads 4
+
+Against a running server, e.g. `gunicorn -c gunicorn.conf.py` (SQL statements
+are read from the Server-Timing header, so start it with
+SERVER_TIMING_HEADER=true):
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.routes --url http://127.0.0.1:8000
+
+--seed-users replaces everything in the database with a synthetic dataset
+of that many users (see generator/synthetic.py). The benchmark itself adds
+likes and messages.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import app
+from models import db, Like, Message, User
+from bulk_load import load_data
+from generator.synthetic import generate
+from instrumentation import QueryCounter
+from migrations import stamp
+from benchmarks.stats import summarize
+
+PASSWORD = "password"
+
+CSRF_TOKEN_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+SERVER_TIMING_QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+class ClientDriver:
+    """Sends requests through Flask's test client."""
+
+    counts_queries = True
+
+    def __init__(self):
+        self.client = app.test_client()
+
+    def login(self, username, password):
+        self.client.post(
+            "/login", data={"username": username, "password": password})
+
+    def request(self, method, path, data=None, headers=None):
+        resp = self.client.open(
+            path, method=method, data=data, headers=headers)
+        return resp.status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpDriver:
+    """Sends requests to a running server over HTTP."""
+
+    counts_queries = False
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip("/")
+        self.csrf_token = None
+        self.sql_count = 0
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect())
+
+    def _open(self, method, path, data=None, headers=None):
+        body = None
+
+        if data is not None:
+            data = dict(data, csrf_token=self.csrf_token)
+            body = urllib.parse.urlencode(data).encode()
+
+        req = urllib.request.Request(
+            self.base_url + path, data=body, method=method,
+            headers=headers or {})
+
+        try:
+            with self.opener.open(req) as resp:
+                self._count_queries(resp.headers)
+                return resp.status, resp.read().decode()
+        except urllib.error.HTTPError as err:
+            self._count_queries(err.headers)
+            return err.code, ""
+
+    def _count_queries(self, headers):
+        match = SERVER_TIMING_QUERIES_RE.search(
+            headers.get("Server-Timing", ""))
+
+        if match:
+            self.sql_count += int(match.group(1))
+
+    def _refresh_csrf_token(self, path):
+        status, html = self._open("GET", path)
+        match = CSRF_TOKEN_RE.search(html)
+
+        if match:
+            self.csrf_token = match.group(1)
+
+    def login(self, username, password):
+        self._refresh_csrf_token("/login")
+        self._open("POST", "/login",
+                   data={"username": username, "password": password})
+        self._refresh_csrf_token("/")
+
+    def request(self, method, path, data=None, headers=None):
+        if method == "POST" and data is None:
+            data = {}
+
+        status, html = self._open(method, path, data=data, headers=headers)
+        return status
+
+
+def seed(num_users, echo=print):
+    """Replace the database contents with a synthetic dataset."""
+
+    db.drop_all()
+    db.create_all()
+    stamp()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate(data_dir, num_users=num_users, avg_followers=20,
+                 avg_messages=10, avg_likes=2, echo=echo)
+        load_data(data_dir, echo=echo)
+
+
+def build_scenarios(num_requests):
+    """The routes to benchmark, as (name, method, path(i), data(i)) tuples."""
+
+    reader = User.query.order_by(User.following_count.desc()).first()
+    celebrity = User.query.order_by(User.followers_count.desc()).first()
+
+    # messages the reader can like, one per request
+    likeable = db.session.scalars(
+        select(Message.id)
+        .where(Message.user_id != reader.id)
+        .where(Message.id.not_in(
+            select(Like.liked_message_id)
+            .where(Like.user_liking_id == reader.id)))
+        .order_by(Message.id.desc())
+        .limit(num_requests)).all()
+
+    def like_path(i):
+        return f"/messages/{likeable[i % len(likeable)]}/like"
+
+    return reader, [
+        ("homepage", "GET", lambda i: "/", None),
+        ("show_user", "GET", lambda i: f"/users/{celebrity.id}", None),
+        ("list_users", "GET", lambda i: "/users", None),
+        ("show_following", "GET",
+         lambda i: f"/users/{reader.id}/following/", None),
+        ("like_message", "POST", like_path, lambda i: {}),
+        ("add_message", "POST", lambda i: "/messages/new",
+         lambda i: {"text": f"Benchmark message {i}"}),
+    ]
+
+
+def run_scenario(drivers, method, path, data, num_requests):
+    """Send `num_requests` requests split across the drivers' threads.
+
+    Returns (latencies, elapsed seconds, non-2xx/3xx responses).
+    """
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(len(drivers) + 1)
+    headers = {"Referer": "/"}
+
+    def worker(driver, indexes):
+        mine = []
+        failed = 0
+
+        start_line.wait()
+
+        for i in indexes:
+            started = time.perf_counter()
+            status = driver.request(
+                method, path(i), data=data and data(i), headers=headers)
+            mine.append(time.perf_counter() - started)
+
+            if status >= 400:
+                failed += 1
+
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    threads = [
+        threading.Thread(
+            target=worker,
+            args=(driver, range(n, num_requests, len(drivers))))
+        for n, driver in enumerate(drivers)]
+
+    for thread in threads:
+        thread.start()
+
+    start_line.wait()
+    started = time.perf_counter()
+
+    for thread in threads:
+        thread.join()
+
+    return latencies, time.perf_counter() - started, sum(errors)
+
+
+def git_commit():
+    """Short hash of HEAD, with "-dirty" if there are local changes."""
+
+    def git(*args):
+        return subprocess.run(
+            ["git", *args], capture_output=True, text=True).stdout.strip()
+
+    commit = git("rev-parse", "--short", "HEAD") or "unknown"
+
+    if git("status", "--porcelain", "--untracked-files=no"):
+        commit += "-dirty"
+
+    return commit
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="benchmark a running server instead")
+    parser.add_argument("--seed-users", type=int, default=0,
+                        help="reseed with this many synthetic users first")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests per route")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="concurrent clients")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="untimed requests per route")
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    if args.seed_users:
+        seed(args.seed_users)
+
+    reader, scenarios = build_scenarios(args.requests + args.warmup)
+    username = reader.username
+
+    if args.url:
+        drivers = [HttpDriver(args.url) for _ in range(args.threads)]
+    else:
+        app.config['WTF_CSRF_ENABLED'] = False
+        drivers = [ClientDriver() for _ in range(args.threads)]
+
+    for driver in drivers:
+        driver.login(username, PASSWORD)
+
+    results = {}
+
+    for name, method, path, data in scenarios:
+        # warm-up requests use the indexes after the timed ones
+        def warmup_path(i):
+            return path(args.requests + i)
+
+        def warmup_data(i):
+            return data and data(args.requests + i)
+
+        run_scenario(drivers, method, warmup_path,
+                     data and warmup_data, args.warmup)
+
+        if drivers[0].counts_queries:
+            with QueryCounter() as counter:
+                latencies, elapsed, errors = run_scenario(
+                    drivers, method, path, data, args.requests)
+            sql_count = counter.count
+        else:
+            for driver in drivers:
+                driver.sql_count = 0
+
+            latencies, elapsed, errors = run_scenario(
+                drivers, method, path, data, args.requests)
+            sql_count = sum(driver.sql_count for driver in drivers)
+
+        sql = round(sql_count / args.requests, 2)
+
+        results[name] = dict(
+            summarize(latencies, elapsed), errors=errors,
+            sql_per_request=sql)
+
+        print(f"{name:<16} "
+              f"{results[name]['requests_per_second']:8.1f} req/s  "
+              f"p50 {results[name]['p50_ms']:7.1f} ms  "
+              f"p95 {results[name]['p95_ms']:7.1f} ms  "
+              f"p99 {results[name]['p99_ms']:7.1f} ms  "
+              f"sql {sql}")
+
+    commit = git_commit()
+    now = datetime.now()
+
+    report = dict(
+        commit=commit,
+        run_at=now.isoformat(timespec="seconds"),
+        target=args.url or "test-client",
+        database=db.engine.dialect.name,
+        users=User.query.count(),
+        requests_per_route=args.requests,
+        threads=args.threads,
+        routes=results,
+    )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{now:%Y%m%d-%H%M%S}-{commit}.json")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    with app.app_context():
+        main()
@@ -0,0 +1,132 @@
+"""Measure how long a fresh Warbler process takes to start serving.
+
+Each run starts a new Python process and times, in it, importing app.py
+(with everything it imports), create_app(), and the first response to /
+(logged in) and to /users/<id>, then a second response to each for
+comparison. Runs are repeated with templates compiled on first use and
+then loaded from a precompiled bytecode cache (see template_cache.py), and
+the median of each step is printed:
+
+    DATABASE_URL=postgresql:///warbler_bench \\
+        python -m benchmarks.startup --runs 10
+
+The database needs some users (see seed.py or benchmarks.routes
+--seed-users); the one following the most people is logged in, and their
+own profile is shown.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+STEPS = [
+    ("import", "import app"),
+    ("create_app", "create_app()"),
+    ("home_first", "first GET /"),
+    ("profile_first", "first GET /users/<id>"),
+    ("home_second", "second GET /"),
+    ("profile_second", "second GET /users/<id>"),
+]
+
+
+def measure(user_id):
+    """Time one start of this (fresh) process; returns {step: seconds}."""
+
+    timings = {}
+
+    started = time.perf_counter()
+    import app as warbler
+    timings['import'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    app = warbler.create_app()
+    timings['create_app'] = time.perf_counter() - started
+
+    client = app.test_client()
+
+    with client.session_transaction() as sess:
+        sess[warbler.CURR_USER_KEY] = user_id
+
+    for attempt in ("first", "second"):
+        for step, path in [("home", "/"), ("profile", f"/users/{user_id}")]:
+            started = time.perf_counter()
+            resp = client.get(path)
+            timings[f"{step}_{attempt}"] = time.perf_counter() - started
+
+            assert resp.status_code == 200, (path, resp.status_code)
+
+    return timings
+
+
+def run(user_id, num_runs, cache_dir=None):
+    """Medians (in ms) of `num_runs` fresh processes' timings."""
+
+    env = dict(os.environ)
+    env.pop('TEMPLATE_CACHE_DIR', None)
+
+    if cache_dir:
+        env['TEMPLATE_CACHE_DIR'] = cache_dir
+
+    runs = []
+
+    for _ in range(num_runs):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.startup",
+             "--measure", str(user_id)],
+            env=env, check=True, capture_output=True, text=True).stdout
+
+        runs.append(json.loads(output.splitlines()[-1]))
+
+    return {step: round(statistics.median(run[step] for run in runs) * 1000, 1)
+            for step, label in STEPS}
+
+
+def report(label, medians):
+    print(label)
+
+    for step, step_label in STEPS:
+        print(f"  {step_label:<24} {medians[step]:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5,
+                        help="processes started per configuration")
+    parser.add_argument("--measure", type=int, metavar="USER_ID",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # a run's own process: nothing of the app is imported yet
+    if args.measure:
+        print(json.dumps(measure(args.measure)))
+        return
+
+    from app import create_app
+    from models import User
+    from template_cache import load_templates
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        app = create_app({'TEMPLATE_CACHE_DIR': cache_dir})
+
+        with app.app_context():
+            user = User.query.order_by(User.following_count.desc()).first()
+
+        if user is None:
+            sys.exit("No users to log in as; seed the database first.")
+
+        load_templates(app)
+
+        # one untimed run, so Python's own bytecode is compiled
+        run(user.id, 1)
+
+        report("templates compiled on first use", run(user.id, args.runs))
+        report("templates precompiled", run(user.id, args.runs, cache_dir))
+
+
+if __name__ == "__main__":
+    main()
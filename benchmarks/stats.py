@@ -0,0 +1,24 @@
+"""Summary statistics shared by the benchmark scripts."""
+
+import statistics
+
+
+def percentile(samples, pct):
+    """The `pct`th percentile of a sorted list of samples."""
+
+    index = min(len(samples) - 1, round(pct / 100 * (len(samples) - 1)))
+    return samples[index]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (in ms) for one run."""
+
+    latencies = sorted(latencies)
+
+    return dict(
+        requests=len(latencies),
+        requests_per_second=round(len(latencies) / elapsed, 1),
+        p50_ms=round(statistics.median(latencies) * 1000, 2),
+        p95_ms=round(percentile(latencies, 95) * 1000, 2),
+        p99_ms=round(percentile(latencies, 99) * 1000, 2),
+    )
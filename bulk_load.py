@@ -0,0 +1,143 @@
+"""Bulk loading of generated datasets into Warbler's database.
+
+`flask load-data <dir>` reads the users.csv, messages.csv, follows.csv and
+likes.csv written by generator/synthetic.py into an existing schema. Files
+are read a chunk of rows at a time; on PostgreSQL each chunk goes in with
+COPY, elsewhere with a multi-row INSERT. Afterwards the id sequences are
+moved past the loaded ids and the counters and search indexes are rebuilt.
+"""
+
+import csv
+import io
+import os
+from datetime import datetime
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import text
+
+from models import db, Follow, Like, Message, User
+from counters import reconcile_counters, reconcile_like_counts
+from search import reindex_users, reindex_messages
+import timeline
+
+DEFAULT_CHUNK_SIZE = 50000
+
+PARSERS = {int: int, datetime: datetime.fromisoformat}
+
+# in foreign key order
+LOAD_ORDER = [
+    ('users.csv', User.__table__),
+    ('messages.csv', Message.__table__),
+    ('follows.csv', Follow.__table__),
+    ('likes.csv', Like.__table__),
+]
+
+
+def read_chunks(path, chunk_size):
+    """Yield (header, rows) for `chunk_size` rows of a CSV file at a time."""
+
+    with open(path, newline='') as file:
+        reader = csv.reader(file)
+        header = next(reader)
+
+        while True:
+            rows = list(islice(reader, chunk_size))
+
+            if not rows:
+                return
+
+            yield header, rows
+
+
+def copy_rows(table, header, rows):
+    """Load rows with PostgreSQL's COPY."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    columns = ", ".join(header)
+    cursor = db.session.connection().connection.cursor()
+
+    cursor.copy_expert(
+        f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def insert_rows(table, header, rows):
+    """Load rows with a multi-row INSERT, for databases without COPY."""
+
+    # CSV values are all strings; COPY parses them, here we have to
+    parsers = [PARSERS.get(table.c[name].type.python_type, str)
+               for name in header]
+
+    db.session.execute(
+        table.insert(),
+        [{name: parse(value)
+          for name, parse, value in zip(header, parsers, row)}
+         for row in rows])
+
+
+def load_file(path, table, chunk_size=DEFAULT_CHUNK_SIZE, echo=print):
+    """Load one CSV file into `table`, committing after each chunk."""
+
+    if db.engine.dialect.name == 'postgresql':
+        load_chunk = copy_rows
+    else:
+        load_chunk = insert_rows
+
+    num_done = 0
+
+    for header, rows in read_chunks(path, chunk_size):
+        load_chunk(table, header, rows)
+        db.session.commit()
+
+        num_done += len(rows)
+        echo(f"Loaded {num_done} rows into {table.name}")
+
+
+def reset_sequences():
+    """Move id sequences past the explicitly loaded ids (PostgreSQL only)."""
+
+    if db.engine.dialect.name != 'postgresql':
+        return
+
+    for table in (User.__table__, Message.__table__):
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"))
+
+    db.session.commit()
+
+
+def load_data(data_dir, chunk_size=DEFAULT_CHUNK_SIZE, echo=print):
+    """Load a generated dataset, then rebuild everything derived from it."""
+
+    for filename, table in LOAD_ORDER:
+        path = os.path.join(data_dir, filename)
+
+        if os.path.exists(path):
+            load_file(path, table, chunk_size=chunk_size, echo=echo)
+
+    reset_sequences()
+
+    reconcile_counters(echo=echo)
+    reconcile_like_counts(echo=echo)
+    reindex_users(echo=echo)
+    reindex_messages(echo=echo)
+
+    if current_app.config.get('TIMELINE_ENABLED'):
+        timeline.rebuild_timelines(echo=echo)
+
+
+@click.command('load-data')
+@click.argument('data_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--chunk-size', default=DEFAULT_CHUNK_SIZE,
+              help="Rows per COPY / transaction.")
+@with_appcontext
+def load_data_command(data_dir, chunk_size):
+    """Bulk load CSVs from generator/synthetic.py into the database."""
+
+    load_data(data_dir, chunk_size=chunk_size, echo=click.echo)
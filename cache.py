@@ -0,0 +1,240 @@
+"""Caching for Warbler.
+
+`LRUCache` is a small in-process cache with a time-to-live. `SharedCache`
+is the interface for a cache shared between worker processes (memcached,
+Redis, ...); `InMemorySharedCache` is a local stand-in for it.
+
+`user_cache` keeps the logged-in user's row so `add_user_to_g` doesn't hit
+the database on every request. Each app gets its own (`init_app`, in
+`app.extensions`); `user_cache` is the current app's. Only the columns pages show are cached:
+never the password hash or the email, which a shared cache would keep on
+another server. Entries are invalidated after the transaction that changes
+them commits.
+"""
+
+import pickle
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from werkzeug.local import LocalProxy
+
+from models import db, User
+
+INVALIDATE_KEY = 'user_cache_invalidate'
+
+# anything else (password, email) is loaded from the database if used
+CACHED_COLUMNS = [
+    'id', 'username', 'image_url', 'header_image_url', 'bio', 'location',
+    'deleted_at', 'messages_count', 'following_count', 'followers_count',
+    'likes_count',
+]
+
+
+class LRUCache:
+    """In-process least-recently-used cache with a per-entry time-to-live."""
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value for `key`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+
+            if expires_at <= self.clock():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the oldest entry if full."""
+
+        with self._lock:
+            self._entries[key] = (value, self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove `key` if cached."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove everything."""
+
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache(ABC):
+    """Interface for a cache shared by all workers.
+
+    Values must survive serialization. Implement this over your cache
+    server's client and pass it to `init_app(app, backend=...)`.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Return the cached value for `key`, or None."""
+
+    @abstractmethod
+    def set(self, key, value):
+        """Cache `value` under `key`."""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove `key` if cached."""
+
+    @abstractmethod
+    def clear(self):
+        """Remove everything."""
+
+
+class InMemorySharedCache(SharedCache):
+    """Local stand-in for a shared cache server.
+
+    Pickles values like a network cache would, so anything cached here
+    will also work against a real backend.
+    """
+
+    def __init__(self, ttl=60, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        data, expires_at = entry
+
+        if expires_at <= self.clock():
+            self.delete(key)
+            return None
+
+        return pickle.loads(data)
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (
+                pickle.dumps(value), self.clock() + self.ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class UserCache:
+    """Cache of `users` rows for the session user, keyed by id.
+
+    Rows are cached as plain dicts of the `CACHED_COLUMNS` values and
+    turned back into session-attached `User` objects without a query.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @staticmethod
+    def _key(user_id):
+        return f"user:{user_id}"
+
+    def get_user(self, user_id):
+        """Return the `User` with `user_id`, from the cache if possible."""
+
+        if self.backend is None:
+            return db.session.get(User, user_id)
+
+        data = self.backend.get(self._key(user_id))
+
+        if data is None:
+            user = db.session.get(User, user_id)
+
+            if user is not None:
+                self.backend.set(self._key(user_id), {
+                    column: getattr(user, column)
+                    for column in CACHED_COLUMNS})
+
+            return user
+
+        user = User(**data)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, *user_ids):
+        """Forget these users once the current transaction commits."""
+
+        db.session.info.setdefault(INVALIDATE_KEY, set()).update(user_ids)
+
+    def clear(self):
+        """Forget every cached user."""
+
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def init_app(app, backend=None):
+    """Give `app` a user cache, on `backend` or on the one picked by
+    `USER_CACHE_BACKEND`: local, shared or none.
+    """
+
+    kind = app.config.get('USER_CACHE_BACKEND', 'local')
+    ttl = app.config.get('USER_CACHE_TTL', 60)
+
+    if backend is None and kind == 'local':
+        backend = LRUCache(
+            maxsize=app.config.get('USER_CACHE_SIZE', 10000), ttl=ttl)
+    elif backend is None and kind == 'shared':
+        backend = InMemorySharedCache(ttl=ttl)
+
+    app.extensions['user_cache'] = UserCache(backend)
+
+
+# the current app's `UserCache`
+user_cache = LocalProxy(lambda: current_app.extensions['user_cache'])
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session):
+    """Drop cache entries for users changed by the committed transaction."""
+
+    user_ids = session.info.pop(INVALIDATE_KEY, ())
+
+    if user_ids and user_cache.backend is not None:
+        for user_id in user_ids:
+            user_cache.backend.delete(user_cache._key(user_id))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_invalidations(session, previous_transaction):
+    """Changes that were rolled back don't need invalidating."""
+
+    if not session.in_transaction():
+        session.info.pop(INVALIDATE_KEY, None)
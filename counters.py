@@ -0,0 +1,244 @@
+"""Maintenance of the denormalized counter columns.
+
+`messages_count`, `following_count`, `followers_count` and `likes_count` on
+`User`, and `like_count` on `Message`, are adjusted with single UPDATE
+statements inside the same transaction as the change they count.
+`reconcile_counters` and `reconcile_like_counts` recompute them from the
+`messages`, `follows` and `likes` tables if they ever drift.
+"""
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, update
+
+from models import db, Follow, Like, Message, User
+from cache import user_cache
+
+
+def _update_users(where, **values):
+    """Run one UPDATE on users without syncing the session.
+
+    The changed users are dropped from the user cache on commit.
+    """
+
+    user_ids = db.session.scalars(
+        update(User)
+        .where(where)
+        .values(**values)
+        .returning(User.id)
+        .execution_options(synchronize_session=False)).all()
+
+    user_cache.invalidate(*user_ids)
+
+
+def _update_messages(where, **values):
+    db.session.execute(
+        update(Message)
+        .where(where)
+        .values(**values)
+        .execution_options(synchronize_session=False))
+
+
+def message_added(user_id):
+    """Count a new message by `user_id`."""
+
+    _update_users(
+        User.id == user_id,
+        messages_count=User.messages_count + 1)
+
+
+def message_deleted(msg):
+    """Uncount `msg` for its author and for everyone who liked it.
+
+    Call before deleting the message, while its likes still exist.
+    """
+
+    _update_users(
+        User.id == msg.user_id,
+        messages_count=User.messages_count - 1)
+
+    _update_users(
+        User.id.in_(
+            select(Like.user_liking_id)
+            .where(Like.liked_message_id == msg.id)),
+        likes_count=User.likes_count - 1)
+
+
+def follow_changed(follower_id, followed_id, delta):
+    """Count (delta=1) or uncount (delta=-1) a follow.
+
+    Also bumps the follower's `graph_version`.
+    """
+
+    _update_users(
+        User.id == follower_id,
+        following_count=User.following_count + delta,
+        graph_version=User.graph_version + 1)
+
+    _update_users(
+        User.id == followed_id,
+        followers_count=User.followers_count + delta)
+
+
+def like_changed(user_id, delta):
+    """Count `delta` more likes by `user_id` (0 for likes and unlikes that
+    cancel out) and bump their `likes_version`.
+    """
+
+    _update_users(
+        User.id == user_id,
+        likes_count=User.likes_count + delta,
+        likes_version=User.likes_version + 1)
+
+
+def message_likes_changed(deltas):
+    """Add `{message_id: delta}` to the messages' like counts.
+
+    One UPDATE per distinct delta, so a batch of likes and unlikes is
+    usually two statements however many messages it touches.
+    """
+
+    message_ids_by_delta = {}
+
+    for message_id, delta in deltas.items():
+        if delta:
+            message_ids_by_delta.setdefault(delta, []).append(message_id)
+
+    for delta, message_ids in message_ids_by_delta.items():
+        _update_messages(
+            Message.id.in_(message_ids),
+            like_count=Message.like_count + delta)
+
+
+def message_likes_lost(message_ids):
+    """Uncount one like from each of `message_ids`."""
+
+    _update_messages(
+        Message.id.in_(message_ids),
+        like_count=Message.like_count - 1)
+
+
+def followers_lost(user_ids):
+    """Uncount one follower from each of `user_ids`."""
+
+    _update_users(
+        User.id.in_(user_ids),
+        followers_count=User.followers_count - 1)
+
+
+def following_lost(user_ids):
+    """Uncount one followed user from each of `user_ids`.
+
+    Also bumps their `graph_version`.
+    """
+
+    _update_users(
+        User.id.in_(user_ids),
+        following_count=User.following_count - 1,
+        graph_version=User.graph_version + 1)
+
+
+def messages_purged(message_ids):
+    """Uncount the likes users gave to messages about to be deleted."""
+
+    likes_lost = (select(func.count())
+                  .select_from(Like)
+                  .where(Like.liked_message_id.in_(message_ids))
+                  .where(Like.user_liking_id == User.id)
+                  .scalar_subquery())
+
+    _update_users(
+        User.id.in_(
+            select(Like.user_liking_id)
+            .where(Like.liked_message_id.in_(message_ids))),
+        likes_count=User.likes_count - likes_lost,
+        likes_version=User.likes_version + 1)
+
+
+def reconcile_counters(batch_size=1000, echo=print):
+    """Recompute every user's counters from the underlying tables.
+
+    Works through users in id order, committing after each batch.
+    """
+
+    counts = dict(
+        messages_count=(select(func.count())
+                        .select_from(Message)
+                        .where(Message.user_id == User.id)
+                        .scalar_subquery()),
+        following_count=(select(func.count())
+                         .select_from(Follow)
+                         .where(Follow.user_following_id == User.id)
+                         .scalar_subquery()),
+        followers_count=(select(func.count())
+                         .select_from(Follow)
+                         .where(Follow.user_being_followed_id == User.id)
+                         .scalar_subquery()),
+        likes_count=(select(func.count())
+                     .select_from(Like)
+                     .where(Like.user_liking_id == User.id)
+                     .scalar_subquery()),
+    )
+
+    last_id = 0
+    num_done = 0
+
+    while True:
+        user_ids = db.session.scalars(
+            select(User.id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)).all()
+
+        if not user_ids:
+            break
+
+        _update_users(User.id.in_(user_ids), **counts)
+        db.session.commit()
+
+        last_id = user_ids[-1]
+        num_done += len(user_ids)
+        echo(f"Reconciled counters for {num_done} users")
+
+
+def reconcile_like_counts(batch_size=1000, echo=print):
+    """Recompute every message's like count from the `likes` table.
+
+    Works through messages in id order, committing after each batch.
+    """
+
+    like_count = (select(func.count())
+                  .select_from(Like)
+                  .where(Like.liked_message_id == Message.id)
+                  .scalar_subquery())
+
+    last_id = 0
+    num_done = 0
+
+    while True:
+        message_ids = db.session.scalars(
+            select(Message.id)
+            .where(Message.id > last_id)
+            .order_by(Message.id)
+            .limit(batch_size)).all()
+
+        if not message_ids:
+            break
+
+        _update_messages(Message.id.in_(message_ids), like_count=like_count)
+        db.session.commit()
+
+        last_id = message_ids[-1]
+        num_done += len(message_ids)
+        echo(f"Reconciled like counts for {num_done} messages")
+
+
+@click.command('reconcile-counters')
+@click.option(
+    '--batch-size', default=1000, help="Users or messages per transaction.")
+@with_appcontext
+def reconcile_counters_command(batch_size):
+    """Recompute the counter columns from follows, likes and messages."""
+
+    reconcile_counters(batch_size=batch_size, echo=click.echo)
+    reconcile_like_counts(batch_size=batch_size, echo=click.echo)
@@ -0,0 +1,354 @@
+"""In-process follow graph for Warbler.
+
+`follow_graph` keeps every follow as plain integers: for each direction
+(who a user follows, who follows them) a compressed sparse row layout of
+two arrays, `offsets` indexed by user id and `targets` holding each user's
+neighbours in sorted order. A million follows take about 8 MB, and "does
+A follow B" is a binary search.
+
+Follows and unfollows made by this process are applied once their
+transaction commits; a user changed since the last build keeps their new
+sorted neighbour list in a small overlay. The whole graph is rebuilt from
+the `follows` table every `FOLLOW_GRAPH_TTL` seconds, which is also how
+changes made by other processes arrive: the first use after that starts a
+background thread, and the old graph is served until the new one is
+swapped in. Until then `versioned_following`
+says which `users.graph_version` a user's follows are at, so callers can
+tell them from the user's current row.
+
+Turn it on with `FOLLOW_GRAPH_ENABLED`. The first use builds the graph,
+which reads the whole `follows` table; that one use waits for it. Builds
+run in an app context of their own, so they read from the primary even if
+the request that starts them reads from a replica (see replicas.py). Each app gets its own graph
+(`init_app`, in `app.extensions`); `follow_graph` is the current app's.
+"""
+
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+from werkzeug.local import LocalProxy
+
+from models import db, Follow, User
+
+logger = logging.getLogger('warbler.follow_graph')
+
+CHANGES_KEY = 'follow_graph_changes'
+DEFAULT_TTL = 300
+
+# user ids are 32-bit integer columns
+TYPECODE = 'i'
+
+
+class Adjacency:
+    """Sorted neighbour lists of every user, packed into two arrays."""
+
+    def __init__(self, offsets=None, targets=None):
+        self.offsets = array(TYPECODE, [0]) if offsets is None else offsets
+        self.targets = array(TYPECODE) if targets is None else targets
+        self.changed = {}
+
+    @classmethod
+    def from_sorted_pairs(cls, pairs):
+        """Build from (user_id, neighbour_id) pairs sorted by both."""
+
+        offsets = array(TYPECODE)
+        targets = array(TYPECODE)
+
+        for user_id, neighbour_id in pairs:
+            # users without neighbours get an empty range
+            while len(offsets) <= user_id:
+                offsets.append(len(targets))
+
+            targets.append(neighbour_id)
+
+        offsets.append(len(targets))
+        return cls(offsets, targets)
+
+    def _range(self, user_id):
+        """(array, start, end) of `user_id`'s neighbours."""
+
+        neighbours = self.changed.get(user_id)
+
+        if neighbours is not None:
+            return neighbours, 0, len(neighbours)
+
+        offsets = self.offsets
+
+        if 0 <= user_id < len(offsets) - 1:
+            return self.targets, offsets[user_id], offsets[user_id + 1]
+
+        return self.targets, 0, 0
+
+    def neighbours(self, user_id):
+        """Sorted array of `user_id`'s neighbours."""
+
+        values, start, end = self._range(user_id)
+        return values[start:end]
+
+    def degree(self, user_id):
+        values, start, end = self._range(user_id)
+        return end - start
+
+    def contains(self, user_id, neighbour_id):
+        values, start, end = self._range(user_id)
+        i = bisect_left(values, neighbour_id, start, end)
+
+        return i < end and values[i] == neighbour_id
+
+    def add(self, user_id, neighbour_id):
+        if not self.contains(user_id, neighbour_id):
+            neighbours = self.neighbours(user_id)
+            insort(neighbours, neighbour_id)
+            self.changed[user_id] = neighbours
+
+    def remove(self, user_id, neighbour_id):
+        if self.contains(user_id, neighbour_id):
+            neighbours = self.neighbours(user_id)
+            neighbours.remove(neighbour_id)
+            self.changed[user_id] = neighbours
+
+
+def intersect(small, large):
+    """Sorted values in both sorted arrays, probing the larger one."""
+
+    if len(small) > len(large):
+        small, large = large, small
+
+    found = []
+    start = 0
+
+    for value in small:
+        start = bisect_left(large, value, start)
+
+        if start == len(large):
+            break
+
+        if large[start] == value:
+            found.append(value)
+
+    return found
+
+
+class FollowGraph:
+    """Who follows whom, answered from memory."""
+
+    def __init__(self, app=None, enabled=False, ttl=DEFAULT_TTL):
+        self.app = app
+        self.enabled = enabled
+        self.ttl = ttl
+        self.following_lists = Adjacency()
+        self.follower_lists = Adjacency()
+        self.versions = array(TYPECODE)
+        self.changed_versions = {}
+        self.built_at = None
+        self._build_lock = threading.Lock()
+
+    def build(self):
+        """Load the graph from the `follows` table."""
+
+        def pairs(user_column, neighbour_column):
+            return db.session.execute(
+                select(user_column, neighbour_column)
+                .order_by(user_column, neighbour_column)
+                .execution_options(yield_per=50000))
+
+        # read before the follows: a follow committed in between then makes
+        # the version look older than the follows, never newer
+        versions = array(TYPECODE)
+
+        for user_id, version in pairs(User.id, User.graph_version):
+            if len(versions) <= user_id:
+                versions.extend(
+                    array(TYPECODE, [0]) * (user_id + 1 - len(versions)))
+
+            versions[user_id] = version
+
+        following_lists = Adjacency.from_sorted_pairs(pairs(
+            Follow.user_following_id, Follow.user_being_followed_id))
+        follower_lists = Adjacency.from_sorted_pairs(pairs(
+            Follow.user_being_followed_id, Follow.user_following_id))
+
+        self.following_lists = following_lists
+        self.follower_lists = follower_lists
+        self.versions = versions
+        self.changed_versions = {}
+        self.built_at = time.monotonic()
+
+    def _fresh(self):
+        """Build the graph if it's missing; if it's older than the TTL, start
+        rebuilding it in the background.
+        """
+
+        if self.built_at is None:
+            with self._build_lock:
+                if self.built_at is None:
+                    self._build_apart()
+
+        elif (time.monotonic() - self.built_at >= self.ttl
+                and self._build_lock.acquire(blocking=False)):
+            # released by the thread; until then, the old graph is used
+            threading.Thread(
+                target=self._rebuild, name="follow-graph-build",
+                daemon=True).start()
+
+    def _build_apart(self):
+        """`build` in an app context (and so a session) of its own."""
+
+        if self.app is None:
+            self.build()
+            return
+
+        with self.app.app_context():
+            self.build()
+
+    def _rebuild(self):
+        try:
+            self._build_apart()
+        except Exception:
+            logger.exception("Rebuilding the follow graph failed")
+        finally:
+            self._build_lock.release()
+
+    def apply(self, follower_id, followed_id, following):
+        """Record a committed follow (following=True) or unfollow."""
+
+        if self.built_at is None:
+            return
+
+        if following:
+            self.following_lists.add(follower_id, followed_id)
+            self.follower_lists.add(followed_id, follower_id)
+        else:
+            self.following_lists.remove(follower_id, followed_id)
+            self.follower_lists.remove(followed_id, follower_id)
+
+        # after the lists, so whoever sees the new version sees them too
+        self.changed_versions[follower_id] = self._version(follower_id) + 1
+
+    def changed(self, follower_id, followed_id, following):
+        """Apply a follow or unfollow once the current transaction commits."""
+
+        if self.enabled:
+            db.session.info.setdefault(CHANGES_KEY, []).append(
+                (follower_id, followed_id, following))
+
+    ##########################################################################
+    # Queries
+
+    def follows(self, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`?"""
+
+        self._fresh()
+        return self.following_lists.contains(follower_id, followed_id)
+
+    def following(self, user_id):
+        """Sorted array of the ids `user_id` follows."""
+
+        self._fresh()
+        return self.following_lists.neighbours(user_id)
+
+    def _version(self, user_id):
+        version = self.changed_versions.get(user_id)
+
+        if version is None:
+            versions = self.versions
+            version = versions[user_id] if 0 <= user_id < len(versions) else 0
+
+        return version
+
+    def versioned_following(self, user_id):
+        """(graph_version, sorted ids) of who `user_id` follows.
+
+        The ids are current if the version is the user's `graph_version`;
+        changes by other processes arrive with the next build.
+        """
+
+        self._fresh()
+
+        # the version first: a build in between only makes the ids newer
+        version = self._version(user_id)
+        return version, self.following_lists.neighbours(user_id)
+
+    def followers(self, user_id):
+        """Sorted array of the ids following `user_id`."""
+
+        self._fresh()
+        return self.follower_lists.neighbours(user_id)
+
+    def following_count(self, user_id):
+        self._fresh()
+        return self.following_lists.degree(user_id)
+
+    def followers_count(self, user_id):
+        self._fresh()
+        return self.follower_lists.degree(user_id)
+
+    def mutuals(self, user_id):
+        """Sorted ids that `user_id` follows and that follow them back."""
+
+        self._fresh()
+        return intersect(
+            self.following_lists.neighbours(user_id),
+            self.follower_lists.neighbours(user_id))
+
+    def _two_hops(self, adjacency, user_id):
+        counts = Counter()
+
+        for neighbour_id in adjacency.neighbours(user_id):
+            counts.update(adjacency.neighbours(neighbour_id))
+
+        counts.pop(user_id, None)
+        return counts
+
+    def followers_of_followers(self, user_id):
+        """`{id: n}` of users following `n` of `user_id`'s followers."""
+
+        self._fresh()
+        return self._two_hops(self.follower_lists, user_id)
+
+    def following_of_following(self, user_id):
+        """`{id: n}` of users followed by `n` of the users `user_id` follows.
+
+        Users `user_id` already follows are included; callers filter them.
+        """
+
+        self._fresh()
+        return self._two_hops(self.following_lists, user_id)
+
+
+def init_app(app):
+    """Give `app` a follow graph, set up from `FOLLOW_GRAPH_ENABLED` /
+    `FOLLOW_GRAPH_TTL`.
+    """
+
+    app.extensions['follow_graph'] = FollowGraph(
+        app,
+        enabled=app.config.get('FOLLOW_GRAPH_ENABLED', False),
+        ttl=app.config.get('FOLLOW_GRAPH_TTL', DEFAULT_TTL))
+
+
+# the current app's `FollowGraph`
+follow_graph = LocalProxy(lambda: current_app.extensions['follow_graph'])
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed(session):
+    """Apply the follows and unfollows of the committed transaction."""
+
+    for change in session.info.pop(CHANGES_KEY, ()):
+        follow_graph.apply(*change)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    """Rolled back follows never happened."""
+
+    if not session.in_transaction():
+        session.info.pop(CHANGES_KEY, None)
@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField
+from wtforms import StringField, PasswordField, TextAreaField, DateField
 from wtforms.validators import InputRequired, Email, Length, URL, Optional
 
 
@@ -9,6 +9,21 @@ class MessageForm(FlaskForm):
     text = TextAreaField('text', validators=[InputRequired(), Length(min=1,max=140)])
 
 
+class MessageSearchForm(FlaskForm):
+    """Form for searching messages (submitted by GET, so no CSRF)."""
+
+    class Meta:
+        csrf = False
+
+    q = StringField('Search', validators=[InputRequired(), Length(max=140)])
+
+    author = StringField('Author', validators=[Optional(), Length(max=30)])
+
+    since = DateField('From', validators=[Optional()])
+
+    until = DateField('Until', validators=[Optional()])
+
+
 class UserAddForm(FlaskForm):
     """Form for adding users."""
 
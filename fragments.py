@@ -0,0 +1,94 @@
+"""Cache of rendered message list items.
+
+The part of a message's `<li>` that is the same for every viewer (author
+link and picture, timestamp, text) is rendered once from
+templates/messages/item.html and kept in an in-process LRU cache keyed on
+the message id. Templates output it with `{{ message_fragment(msg) }}`
+and render the viewer's like button around it as usual.
+
+Each entry remembers the author's username and image URL it was rendered
+with, so an author's profile edit makes their cached messages miss and
+re-render. Deleted messages are dropped with `invalidate_message`.
+
+Each app gets its own cache (`init_app`, in `app.extensions`);
+`message_fragments` is the current app's.
+"""
+
+from flask import current_app
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
+
+from cache import LRUCache
+
+ITEM_TEMPLATE = 'messages/item.html'
+
+
+class FragmentCache:
+    """Rendered static HTML of message list items."""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+
+    @staticmethod
+    def _key(message_id):
+        return f"message:{message_id}"
+
+    @staticmethod
+    def _author_version(msg):
+        return (msg.user.username, msg.user.image_url)
+
+    def _render(self, msg):
+        template = current_app.jinja_env.get_template(ITEM_TEMPLATE)
+        return Markup(template.render(msg=msg))
+
+    def render(self, msg):
+        """HTML for the static part of `msg`'s list item."""
+
+        if self.backend is None:
+            return self._render(msg)
+
+        version = self._author_version(msg)
+        entry = self.backend.get(self._key(msg.id))
+
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        html = self._render(msg)
+        self.backend.set(self._key(msg.id), (version, html))
+
+        return html
+
+    def invalidate_message(self, message_id):
+        """Forget a message's fragment, e.g. when it is deleted."""
+
+        if self.backend is not None:
+            self.backend.delete(self._key(message_id))
+
+    def clear(self):
+        """Forget every fragment."""
+
+        if self.backend is not None:
+            self.backend.clear()
+
+
+def init_app(app):
+    """Give `app` a fragment cache, set up from `FRAGMENT_CACHE_SIZE` /
+    `FRAGMENT_CACHE_TTL`.
+
+    A size of 0 turns caching off; fragments are then rendered every time.
+    """
+
+    size = app.config.get('FRAGMENT_CACHE_SIZE', 10000)
+    backend = None
+
+    if size:
+        backend = LRUCache(
+            maxsize=size, ttl=app.config.get('FRAGMENT_CACHE_TTL', 3600))
+
+    fragments = app.extensions['message_fragments'] = FragmentCache(backend)
+    app.add_template_global(fragments.render, 'message_fragment')
+
+
+# the current app's `FragmentCache`
+message_fragments = LocalProxy(
+    lambda: current_app.extensions['message_fragments'])
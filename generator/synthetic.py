@@ -0,0 +1,224 @@
+"""Generate large synthetic Warbler datasets for scale testing.
+
+Unlike create_csvs.py this needs no network access or extra packages, and
+it streams rows straight to disk, so memory use doesn't grow with the size
+of the dataset. Follower counts, messages per user and likes per message
+follow power laws: most users have a handful, a few have a great many.
+
+    python generator/synthetic.py --users 1000000 --out generator/synthetic
+
+writes users.csv, messages.csv, follows.csv and likes.csv (with explicit
+ids) to the output directory. Load them with `flask load-data <dir>`. Every
+user's password is "password". Messages are spread over the --days before
+--until (default: now); the same --seed and --until give the same data.
+"""
+
+import argparse
+import csv
+import os
+from datetime import datetime, timedelta
+from random import Random
+
+import bcrypt
+
+MAX_WARBLER_LENGTH = 140
+
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password',
+                     'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['liked_message_id', 'user_liking_id']
+
+# lower is heavier-tailed; must be above 1 for the averages to hold
+POWER_LAW_ALPHA = 1.5
+
+WORDS = """
+    about after again air all also always animal answer any around ask away
+    back bad ball be bear because bed been before began best better big bird
+    black blue boat body book both box boy bread bring brother build burn
+    busy buy call came can car care carry cat catch change child city class
+    clean clear close cloud coffee cold color come cook cool corn could
+    country cover cut dance dark day deep did dinner dog door down draw dream
+    dress drink drive dry each early earth easy eat egg end even ever every
+    eye face fall family far farm fast father feel few field fight find fine
+    fire first fish five fly follow food foot forest found four free friend
+    from full fun game garden gave get girl give glass go gold good got grass
+    great green ground grow had hair half hand happy hard has hat have head
+    hear heart heavy help here high hill hold home hope horse hot house how
+    idea into island just keep kind king know lake land large last late laugh
+    learn leave left letter life light like line lion listen little live long
+    look love low made make man many map mean meet milk mind money moon more
+    morning mother mountain move much music must name near need never new
+    next nice night north now number ocean off often old once only open other
+    over page paint paper park part party people pick picture place plan
+    plant play point pretty pull push put queen question quick quiet rain
+    read ready red remember rest ride right river road rock room round run
+    said same saw say school sea second see seed sell send serve seven shape
+    ship shoe short show side sing sister sit sky sleep slow small snow soft
+    some song soon sound south space speak spring stand star start stay still
+    stone stop store story street strong summer sun sure swim table take talk
+    tall tea teach tell ten thank then thing think three through time today
+    together told too took town train tree true try turn two under until up
+    use very visit wait walk wall want warm was watch water way wear weather
+    week well went west what wheel when where while white who why wide wild
+    will wind window winter wish with wood word work world write year yellow
+    young
+    """.split()
+
+PLACE_PREFIXES = """
+    North South East West New Port Fort Lake Mount Glen Green Red Stone
+    """.split()
+
+PLACE_SUFFIXES = """
+    ton ville burg field ford haven wood port view dale bury stead mouth
+    """.split()
+
+IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
+
+HEADER_IMAGE_URL = (
+    "https://images.unsplash.com/photo-1519751138087-5bf79df62d5b?ixlib=" +
+    "rb-4.0.3&ixid=MnwxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8&auto=for" +
+    "mat&fit=crop&w=2070&q=80")
+
+
+def power_law(rng, mean, cap):
+    """Random whole number from a Pareto distribution averaging about `mean`.
+
+    Never more than `cap`.
+    """
+
+    scale = mean * (POWER_LAW_ALPHA - 1) / POWER_LAW_ALPHA
+    return int(min(cap, scale * rng.paretovariate(POWER_LAW_ALPHA)))
+
+
+def sentence(rng, min_words, max_words, max_length=MAX_WARBLER_LENGTH):
+    """Random capitalized sentence no longer than `max_length`."""
+
+    words = rng.choices(WORDS, k=rng.randint(min_words, max_words))
+    text = " ".join(words).capitalize() + "."
+
+    return text[:max_length]
+
+
+def place_name(rng):
+    return (rng.choice(PLACE_PREFIXES) + " " +
+            rng.choice(WORDS).capitalize() + rng.choice(PLACE_SUFFIXES))
+
+
+def generate(out_dir, num_users, avg_followers, avg_messages, avg_likes,
+             seed=0, until=None, days=730, password_rounds=12, echo=print):
+    """Write the four CSV files for a dataset of `num_users` users to `out_dir`.
+
+    Each user is written together with their followers, their messages and
+    those messages' likes, so nothing but the current user is held in
+    memory.
+    """
+
+    rng = Random(seed)
+    start = (until or datetime.now()) - timedelta(days=days)
+    span = days * 24 * 60 * 60
+
+    password = bcrypt.hashpw(
+        b"password", bcrypt.gensalt(rounds=password_rounds)).decode('UTF-8')
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    def open_csv(name, headers):
+        file = open(os.path.join(out_dir, name), 'w', newline='')
+        writer = csv.writer(file)
+        writer.writerow(headers)
+        return file, writer
+
+    files = {}
+    files['users'] = open_csv('users.csv', USERS_CSV_HEADERS)
+    files['messages'] = open_csv('messages.csv', MESSAGES_CSV_HEADERS)
+    files['follows'] = open_csv('follows.csv', FOLLOWS_CSV_HEADERS)
+    files['likes'] = open_csv('likes.csv', LIKES_CSV_HEADERS)
+
+    users = files['users'][1]
+    messages = files['messages'][1]
+    follows = files['follows'][1]
+    likes = files['likes'][1]
+
+    all_user_ids = range(1, num_users + 1)
+    message_id = 0
+    totals = dict(follows=0, messages=0, likes=0)
+
+    try:
+        for user_id in all_user_ids:
+            username = f"{rng.choice(WORDS)}{rng.choice(WORDS)}{user_id}"
+
+            users.writerow([
+                user_id,
+                f"{username}@example.com",
+                username,
+                rng.choice(IMAGE_URLS),
+                password,
+                sentence(rng, 3, 12),
+                HEADER_IMAGE_URL,
+                place_name(rng),
+            ])
+
+            # popularity is what's heavy-tailed: most users have a few
+            # followers, a few have a large share of everyone
+            num_followers = power_law(rng, avg_followers, num_users - 1)
+
+            for follower_id in rng.sample(all_user_ids, num_followers):
+                if follower_id != user_id:
+                    follows.writerow([user_id, follower_id])
+                    totals['follows'] += 1
+
+            for _ in range(power_law(rng, avg_messages, 10 * avg_messages)):
+                message_id += 1
+                timestamp = start + timedelta(seconds=rng.uniform(0, span))
+
+                messages.writerow(
+                    [message_id, sentence(rng, 4, 30), timestamp, user_id])
+                totals['messages'] += 1
+
+                num_likes = power_law(rng, avg_likes, num_users - 1)
+
+                for liker_id in rng.sample(all_user_ids, num_likes):
+                    if liker_id != user_id:
+                        likes.writerow([message_id, liker_id])
+                        totals['likes'] += 1
+
+            if user_id % 10000 == 0:
+                echo(f"Generated {user_id} users")
+
+    finally:
+        for file, _ in files.values():
+            file.close()
+
+    echo(f"Generated {num_users} users, {totals['messages']} messages, "
+         f"{totals['follows']} follows and {totals['likes']} likes")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--avg-followers", type=float, default=20)
+    parser.add_argument("--avg-messages", type=float, default=10)
+    parser.add_argument("--avg-likes", type=float, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--until", type=datetime.fromisoformat, default=None)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--out", default="generator/synthetic")
+    args = parser.parse_args()
+
+    generate(args.out,
+             num_users=args.users,
+             avg_followers=args.avg_followers,
+             avg_messages=args.avg_messages,
+             avg_likes=args.avg_likes,
+             seed=args.seed,
+             until=args.until,
+             days=args.days)
+
+
+if __name__ == "__main__":
+    main()
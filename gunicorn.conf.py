@@ -0,0 +1,79 @@
+"""Production gunicorn settings for Warbler.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is loaded once in the master (`preload_app`) and forked into the
+workers, so they share its memory and a broken app fails at startup rather
+than in every worker. Loading it opens no database connection; after the
+fork each worker drops whatever its engines may have pooled anyway
+(`post_fork`), so no connection is ever shared between processes. The
+templates are compiled in the master too, or loaded from
+`TEMPLATE_CACHE_DIR` if precompiled there (`when_ready`; see
+template_cache.py), so no worker compiles them in its first requests.
+
+Workers are gevent by default: each request is a greenlet, so a worker
+serves many requests at once, and idle live-feed streams (see realtime.py)
+cost next to nothing. The standard library and psycopg2 are patched to
+yield to other greenlets while waiting on sockets and queries, before the
+app is loaded. Database connections are still limited per worker by
+`DB_POOL_SIZE` + `DB_MAX_OVERFLOW`; requests beyond that wait up to
+`DB_POOL_TIMEOUT` for one. Password hashing in a process pool
+(`PASSWORD_HASH_WORKERS`) doesn't mix with gevent; leave it at 0.
+
+Environment:
+
+    PORT                    port to listen on (8000)
+    WEB_CONCURRENCY         worker processes (one per CPU)
+    GUNICORN_WORKER_CLASS   gevent, or gthread / sync (no live-feed streams
+                            to speak of)
+    GUNICORN_THREADS        threads per gthread worker (8)
+    WORKER_CONNECTIONS      requests at once per gevent worker (1100: room
+                            for STREAM_MAX_CONNECTIONS streams and then some)
+"""
+
+import multiprocessing
+import os
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+
+if worker_class == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+wsgi_app = 'app:app'
+preload_app = True
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.environ.get(
+    'GUNICORN_THREADS', 8 if worker_class == 'gthread' else 1))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1100))
+
+# for async workers this is only how long a worker may go without checking
+# in; open streams don't count against it
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+
+
+def when_ready(server):
+    """Compile the templates once, in the master, for every worker."""
+
+    from app import app
+    from template_cache import load_templates
+
+    load_templates(app)
+
+
+def post_fork(server, worker):
+    """Don't reuse connections pooled before the fork."""
+
+    from app import app
+    from models import dispose_engines
+
+    dispose_engines(app)
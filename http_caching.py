@@ -0,0 +1,207 @@
+"""HTTP caching policy for Warbler.
+
+Static files are linked with `{{ static_url('path') }}`, which adds a
+fingerprint of the file's contents (`?v=<hash>`). Fingerprinted requests
+are cached by browsers for a year as immutable; a changed file gets a new
+URL.
+
+Views wrapped in `@conditional(version_fn)` answer repeat visits with 304
+Not Modified before doing any work. `version_fn` gets the view's arguments
+and returns the data the page is built from (or None to skip the check);
+the ETag is a hash of that plus everything else that varies the HTML: the
+viewer's own row, their session's CSRF token and a time bucket shorter
+than the token's lifetime. Pages with pending flash messages are always rendered.
+
+Every other response is `no-store`, as before.
+"""
+
+import hashlib
+import os
+import time
+from functools import wraps
+
+from flask import current_app, g, request, session
+from sqlalchemy import select
+
+from models import db, Message, User
+import social
+
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+# data shown for a user on their profile and in the navbar
+USER_VERSION_COLUMNS = [
+    User.id, User.username, User.image_url, User.header_image_url, User.bio,
+    User.location, User.messages_count, User.following_count,
+    User.followers_count, User.likes_count,
+]
+
+# bumped by every follow, unfollow, like and unlike the viewer makes
+VIEWER_STAMP_COLUMNS = [User.graph_version, User.likes_version]
+
+_fingerprints = {}
+
+
+def static_fingerprint(filename):
+    """Short hash of a static file's contents, or None if it's missing."""
+
+    path = os.path.join(current_app.static_folder, filename)
+
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(path)
+
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as file:
+            digest = hashlib.md5(file.read()).hexdigest()[:12]
+
+        cached = (mtime, digest)
+        _fingerprints[path] = cached
+
+    return cached[1]
+
+
+def static_url(filename):
+    """URL of a static file that changes whenever the file does."""
+
+    url = f"{current_app.static_url_path}/{filename}"
+    fingerprint = static_fingerprint(filename)
+
+    return f"{url}?v={fingerprint}" if fingerprint else url
+
+
+def user_version(user):
+    """Everything about a loaded user that pages display."""
+
+    return tuple(getattr(user, column.key) for column in USER_VERSION_COLUMNS)
+
+
+def viewer_version():
+    """`user_version` of g.user, read fresh rather than from the user cache,
+    with their version stamps and their likes and unlikes still queued for
+    writing (see social.py).
+
+    The stamps change whenever a follow or like button on a page would
+    (counts don't: a follow and an unfollow cancel out), except while a
+    like is queued: pages show it already, but it's only stamped once
+    it's written.
+    """
+
+    row = tuple(db.session.execute(
+        select(*USER_VERSION_COLUMNS, *VIEWER_STAMP_COLUMNS)
+        .where(User.id == g.user.id)).one())
+
+    if not social.like_queue.enabled:
+        return row
+
+    pending = social.like_queue.pending_for(g.user.id)
+    return (row, tuple(sorted(pending.items())))
+
+
+def session_version():
+    """What varies a page by session rather than by data.
+
+    Makes sure a cached page never holds a CSRF token its session can't
+    use: a new session or an old enough page gets a new ETag.
+    """
+
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    time_bucket = int(time.time() // (time_limit // 2)) if time_limit else 0
+
+    return (session.get('csrf_token'), time_bucket)
+
+
+def user_page_version(user_id):
+    """Version of a user's profile page."""
+
+    user = db.session.get(User, user_id)
+
+    if user is None or user.deleted_at:
+        return None
+
+    latest_message = db.session.execute(
+        select(Message.timestamp, Message.id)
+        .where(Message.user_id == user_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(1)).first()
+
+    return (user_version(user), latest_message and tuple(latest_message))
+
+
+def message_page_version(message_id):
+    """Version of a message's page."""
+
+    msg = db.session.get(Message, message_id)
+
+    if msg is None or msg.user.deleted_at:
+        return None
+
+    return (message_id, msg.like_count, user_version(msg.user))
+
+
+def make_etag(version, viewer):
+    """ETag for a page built from `version` and shown to `viewer`."""
+
+    key = repr((request.full_path, version, viewer, session_version()))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional(version_fn):
+    """Answer with 304 Not Modified if the page's version hasn't changed."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**view_args):
+            # flashes must be rendered (and consumed) by a full page
+            if not g.user or session.get('_flashes'):
+                return view(**view_args)
+
+            version = version_fn(**view_args)
+
+            if version is None:
+                return view(**view_args)
+
+            viewer = viewer_version()
+            etag = make_etag(version, viewer)
+
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(**view_args))
+
+                # rendering may have started the session's CSRF token
+                etag = make_etag(version, viewer)
+
+            response.set_etag(etag, weak=True)
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def init_app(app):
+    """Apply the caching policy to `app`'s responses."""
+
+    app.add_template_global(static_url)
+
+    @app.after_request
+    def apply_cache_policy(response):
+        if request.endpoint == 'static':
+            if request.args.get('v'):
+                response.cache_control.public = True
+                response.cache_control.max_age = STATIC_MAX_AGE
+                response.cache_control.immutable = True
+            else:
+                response.cache_control.no_cache = True
+
+        elif not response.cache_control.no_cache:
+            # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+            response.cache_control.no_store = True
+
+        return response
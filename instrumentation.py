@@ -0,0 +1,356 @@
+"""Instrumentation helpers for Warbler.
+
+`init_app` records, for every request, the number of SQL statements and
+the time spent in the database, rendering templates and hashing passwords.
+Each request is logged as one JSON line on the `warbler.requests` logger
+and counted in histograms per endpoint.
+
+Anyone could read these, so two outputs are off unless asked for:
+`SERVER_TIMING_HEADER` adds them to each response in a Server-Timing
+header (visible in the browser's network panel), and
+`METRICS_ENDPOINT_ENABLED` serves the histograms at `/metrics` in the
+Prometheus text format, to requests bearing `METRICS_TOKEN` if it's set
+(`Authorization: Bearer <token>`).
+
+Set `INSTRUMENTATION_ENABLED` to False to turn all of it off. Each app
+keeps its own histograms (in `app.extensions`); `registry` is the current
+app's.
+"""
+
+import hmac
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import (
+    abort, before_render_template, current_app, g, has_request_context,
+    request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.local import LocalProxy
+
+logger = logging.getLogger('warbler.requests')
+
+DURATION_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# Server-Timing metric name -> what it measures
+TIMINGS = {
+    'db': "database",
+    'tpl': "template rendering",
+    'bcrypt': "password hashing",
+}
+
+
+class QueryCounter:
+    """Context manager counting SQL statements sent to the database.
+
+    Use it around a request in tests to catch N+1 regressions:
+
+        with QueryCounter() as counter:
+            client.get("/")
+
+        assert counter.count == 6
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        if self.engine is None:
+            self.engine = current_app.extensions['sqlalchemy'].engine
+
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+
+class RequestMetrics:
+    """What one request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.timings = dict.fromkeys(TIMINGS, 0.0)
+
+        # templates rendered from inside another one's render count as part
+        # of the outermost one
+        self.template_depth = 0
+        self.template_started = None
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            if index < len(self.buckets):
+                self.bucket_counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        """(le, cumulative count) pairs, ending with +Inf."""
+
+        with self._lock:
+            counts = list(self.bucket_counts)
+            total = self.count
+
+        running = 0
+
+        for le, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            yield str(le), running
+
+        yield "+Inf", total
+
+
+class MetricsRegistry:
+    """Histograms by (metric name, endpoint)."""
+
+    METRICS = {
+        'warbler_request_duration_seconds':
+            ("Time to handle the request", DURATION_BUCKETS),
+        'warbler_request_sql_statements':
+            ("SQL statements run for the request", COUNT_BUCKETS),
+        'warbler_request_db_seconds':
+            ("Time spent in the database", DURATION_BUCKETS),
+        'warbler_request_template_seconds':
+            ("Time spent rendering templates", DURATION_BUCKETS),
+        'warbler_request_bcrypt_seconds':
+            ("Time spent hashing passwords", DURATION_BUCKETS),
+    }
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, endpoint, value):
+        key = (name, endpoint)
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+
+            if histogram is None:
+                histogram = Histogram(self.METRICS[name][1])
+                self._histograms[key] = histogram
+
+        histogram.observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format."""
+
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+
+        lines = []
+
+        for name, (help_text, buckets) in self.METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+
+            for (hist_name, endpoint), histogram in histograms:
+                if hist_name != name:
+                    continue
+
+                label = f'endpoint="{endpoint}"'
+
+                for le, count in histogram.samples():
+                    lines.append(f'{name}_bucket{{{label},le="{le}"}} {count}')
+
+                lines.append(f"{name}_sum{{{label}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{label}}} {histogram.count}")
+
+        return "\n".join(lines) + "\n"
+
+
+# the current app's `MetricsRegistry`
+registry = LocalProxy(lambda: current_app.extensions['metrics_registry'])
+
+
+def current_metrics():
+    """The `RequestMetrics` of the request being handled, if any."""
+
+    if not has_request_context():
+        return None
+
+    return g.get('request_metrics')
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's `name`."""
+
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        metrics = current_metrics()
+
+        if metrics is not None:
+            metrics.timings[name] += time.perf_counter() - started
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_statement(conn, cursor, statement, parameters, context,
+                   executemany):
+    metrics = current_metrics()
+
+    if metrics is None or context is None:
+        return
+
+    started = getattr(context, '_instrumentation_started', None)
+
+    metrics.sql_count += 1
+
+    if started is not None:
+        metrics.timings['db'] += time.perf_counter() - started
+
+
+def _start_template(sender, template, context, **extra):
+    metrics = current_metrics()
+
+    if metrics is not None:
+        if metrics.template_depth == 0:
+            metrics.template_started = time.perf_counter()
+
+        metrics.template_depth += 1
+
+
+def _end_template(sender, template, context, **extra):
+    metrics = current_metrics()
+
+    if metrics is None or metrics.template_depth == 0:
+        return
+
+    metrics.template_depth -= 1
+
+    if metrics.template_depth == 0:
+        metrics.timings['tpl'] += time.perf_counter() - metrics.template_started
+        metrics.template_started = None
+
+
+def server_timing(metrics, total):
+    """Server-Timing header value for a finished request."""
+
+    parts = [f'db;dur={metrics.timings["db"] * 1000:.2f};'
+             f'desc="{metrics.sql_count} queries"']
+
+    for name, desc in TIMINGS.items():
+        if name != 'db' and metrics.timings[name]:
+            parts.append(
+                f'{name};dur={metrics.timings[name] * 1000:.2f};desc="{desc}"')
+
+    parts.append(f'total;dur={total * 1000:.2f}')
+
+    return ", ".join(parts)
+
+
+def init_app(app):
+    """Instrument every request `app` handles."""
+
+    if not app.config.get('INSTRUMENTATION_ENABLED', True):
+        return
+
+    app.extensions['metrics_registry'] = MetricsRegistry()
+
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_end_template, app)
+
+    @app.before_request
+    def start_request_metrics():
+        g.request_metrics = RequestMetrics()
+
+    @app.after_request
+    def record_request_metrics(response):
+        metrics = g.pop('request_metrics', None)
+
+        if metrics is None:
+            return response
+
+        total = metrics.elapsed
+        endpoint = request.endpoint or "unmatched"
+
+        if app.config.get('SERVER_TIMING_HEADER', False):
+            response.headers['Server-Timing'] = server_timing(metrics, total)
+
+        registry.observe('warbler_request_duration_seconds', endpoint, total)
+        registry.observe(
+            'warbler_request_sql_statements', endpoint, metrics.sql_count)
+        registry.observe(
+            'warbler_request_db_seconds', endpoint, metrics.timings['db'])
+        registry.observe(
+            'warbler_request_template_seconds', endpoint,
+            metrics.timings['tpl'])
+        registry.observe(
+            'warbler_request_bcrypt_seconds', endpoint,
+            metrics.timings['bcrypt'])
+
+        logger.info(json.dumps(dict(
+            method=request.method,
+            path=request.path,
+            endpoint=endpoint,
+            status=response.status_code,
+            duration_ms=round(total * 1000, 2),
+            sql_count=metrics.sql_count,
+            db_ms=round(metrics.timings['db'] * 1000, 2),
+            template_ms=round(metrics.timings['tpl'] * 1000, 2),
+            bcrypt_ms=round(metrics.timings['bcrypt'] * 1000, 2),
+        )))
+
+        return response
+
+    if app.config.get('METRICS_ENDPOINT_ENABLED', False):
+        @app.get('/metrics')
+        def metrics():
+            """Request histograms for Prometheus to scrape."""
+
+            token = app.config.get('METRICS_TOKEN')
+
+            if token and not hmac.compare_digest(
+                    request.headers.get('Authorization', ''),
+                    f"Bearer {token}"):
+                abort(403)
+
+            return registry.render(), 200, {
+                'Content-Type': 'text/plain; version=0.0.4'}
@@ -0,0 +1,333 @@
+"""Schema migrations for Warbler.
+
+`seed.py` builds a fresh schema with `db.drop_all()` / `db.create_all()`.
+Existing databases are upgraded in place instead with:
+
+    flask db upgrade
+
+which applies each pending migration below in order and records it in the
+`schema_migrations` table. Every step checks the live schema before
+changing it, so re-running an interrupted migration is safe. On PostgreSQL,
+indexes are built with CREATE INDEX CONCURRENTLY so writes keep flowing.
+"""
+
+from datetime import datetime
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect, select, text
+from sqlalchemy.schema import CreateColumn
+
+from models import (
+    db, Follow, Like, Message, MessageSearchTerm, Recommendation,
+    StaleRecommendation, TimelineEntry, TrendingBucket, User, UserSearchTerm)
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('description', db.String(200), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register the decorated function as migration number `version`.
+
+    The function is called with the engine; its docstring is recorded as
+    the description.
+    """
+
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda pair: pair[0])
+        return fn
+
+    return register
+
+
+##############################################################################
+# Helpers
+
+
+def create_table_if_missing(engine, table):
+    """Create `table` (and its indexes) unless it already exists."""
+
+    table.create(engine, checkfirst=True)
+
+
+def add_column_if_missing(engine, column):
+    """Add a model column to its existing table unless already there."""
+
+    table = column.table
+    existing = {col['name'] for col in inspect(engine).get_columns(table.name)}
+
+    if column.name in existing:
+        return
+
+    column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}"))
+
+
+def create_index_if_missing(engine, index):
+    """Create a model index unless a usable index with its name exists.
+
+    An interrupted CREATE INDEX CONCURRENTLY leaves an INVALID index
+    behind, which PostgreSQL never uses; that one is dropped and rebuilt.
+    """
+
+    if engine.dialect.name != 'postgresql':
+        existing = {ix['name'] for ix in inspect(engine).get_indexes(
+            index.table.name)}
+
+        if index.name not in existing:
+            index.create(engine)
+
+        return
+
+    # CONCURRENTLY doesn't block writes, but can't run in a transaction
+    options = index.dialect_options['postgresql']
+    options['concurrently'] = True
+
+    try:
+        with engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT") as conn:
+            valid = conn.scalar(
+                text("SELECT indisvalid FROM pg_index"
+                     " WHERE indexrelid = to_regclass(:name)"),
+                {'name': index.name})
+
+            if valid:
+                return
+
+            if valid is not None:
+                index.drop(conn)
+
+            index.create(conn)
+    finally:
+        options['concurrently'] = False
+
+
+def model_index(model, name):
+    """Find the index called `name` declared on `model`."""
+
+    return next(ix for ix in model.__table__.indexes if ix.name == name)
+
+
+##############################################################################
+# Migrations
+
+
+@migration(1)
+def create_base_tables(engine):
+    """Create the users, follows, messages and likes tables"""
+
+    for model in (User, Follow, Message, Like):
+        create_table_if_missing(engine, model.__table__)
+
+
+@migration(2)
+def create_timeline_entries(engine):
+    """Add the materialized timeline_entries table"""
+
+    create_table_if_missing(engine, TimelineEntry.__table__)
+
+
+@migration(3)
+def add_user_counters(engine):
+    """Add counter columns to users (run `flask reconcile-counters` after)"""
+
+    users = User.__table__
+
+    for column in (users.c.messages_count, users.c.following_count,
+                   users.c.followers_count, users.c.likes_count):
+        add_column_if_missing(engine, column)
+
+
+@migration(4)
+def add_hot_path_indexes(engine):
+    """Index the feed, follows, likes and username search query shapes"""
+
+    create_index_if_missing(
+        engine, model_index(Message, 'ix_messages_user_id_timestamp'))
+    create_index_if_missing(
+        engine, model_index(Follow, 'ix_follows_user_following_id'))
+    create_index_if_missing(
+        engine, model_index(Like, 'ix_likes_user_liking_id'))
+    create_index_if_missing(
+        engine, model_index(User, 'ix_users_username_pattern'))
+
+
+@migration(5)
+def create_user_search_terms(engine):
+    """Add the user search index table (run `flask reindex-users` after)"""
+
+    create_table_if_missing(engine, UserSearchTerm.__table__)
+
+
+@migration(6)
+def create_message_search_terms(engine):
+    """Add the message search index table (run `flask reindex-messages` after)"""
+
+    create_table_if_missing(engine, MessageSearchTerm.__table__)
+
+
+@migration(7)
+def add_user_deleted_at(engine):
+    """Add users.deleted_at for soft deletion"""
+
+    add_column_if_missing(engine, User.__table__.c.deleted_at)
+    create_index_if_missing(engine, model_index(User, 'ix_users_deleted_at'))
+
+
+@migration(8)
+def add_message_like_count(engine):
+    """Add messages.like_count (run `flask reconcile-counters` after)"""
+
+    add_column_if_missing(engine, Message.__table__.c.like_count)
+
+
+@migration(9)
+def create_trending_buckets(engine):
+    """Add the trending_buckets table"""
+
+    create_table_if_missing(engine, TrendingBucket.__table__)
+
+
+@migration(10)
+def create_recommendations(engine):
+    """Add recommendations (run `flask refresh-recommendations` after)"""
+
+    create_table_if_missing(engine, Recommendation.__table__)
+    create_table_if_missing(engine, StaleRecommendation.__table__)
+
+
+@migration(11)
+def add_user_graph_version(engine):
+    """Add users.graph_version"""
+
+    add_column_if_missing(engine, User.__table__.c.graph_version)
+
+
+@migration(12)
+def add_user_likes_version(engine):
+    """Add users.likes_version"""
+
+    add_column_if_missing(engine, User.__table__.c.likes_version)
+
+
+@migration(13)
+def add_user_timeline_size(engine):
+    """Add users.timeline_size (run `flask rebuild-timelines` after)"""
+
+    add_column_if_missing(engine, User.__table__.c.timeline_size)
+
+
+##############################################################################
+# Runner
+
+
+def applied_versions(engine):
+    """Versions already recorded in schema_migrations."""
+
+    schema_migrations.create(engine, checkfirst=True)
+
+    with engine.connect() as conn:
+        return set(conn.scalars(select(schema_migrations.c.version)))
+
+
+def record(engine, version, fn):
+    """Mark migration `version` as applied."""
+
+    with engine.begin() as conn:
+        conn.execute(schema_migrations.insert().values(
+            version=version,
+            description=fn.__doc__.strip(),
+            applied_at=datetime.utcnow()))
+
+
+def pending_migrations(engine):
+    """(version, fn) pairs not yet applied, in order."""
+
+    applied = applied_versions(engine)
+
+    return [(version, fn) for version, fn in MIGRATIONS
+            if version not in applied]
+
+
+def upgrade(engine=None, echo=print):
+    """Apply every pending migration, in order."""
+
+    engine = engine or db.engine
+
+    for version, fn in pending_migrations(engine):
+        echo(f"Applying {version}: {fn.__doc__.strip()}")
+        fn(engine)
+        record(engine, version, fn)
+
+
+def stamp(engine=None):
+    """Mark every migration as applied, e.g. after `db.create_all()`."""
+
+    engine = engine or db.engine
+
+    for version, fn in pending_migrations(engine):
+        record(engine, version, fn)
+
+
+def create_trigram_index(engine=None):
+    """Create a pg_trgm index so `username ILIKE '%q%'` can use an index.
+
+    Optional, PostgreSQL only, and needs permission to create the
+    extension.
+    """
+
+    engine = engine or db.engine
+
+    with engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        conn.execute(text(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm "
+            "ON users USING gin (username gin_trgm_ops)"))
+
+
+##############################################################################
+# Commands
+
+db_cli = AppGroup('db', help="Manage the database schema.")
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending schema migrations."""
+
+    upgrade(echo=click.echo)
+
+
+@db_cli.command('status')
+def status_command():
+    """List migrations and whether each has been applied."""
+
+    applied = applied_versions(db.engine)
+
+    for version, fn in MIGRATIONS:
+        mark = "x" if version in applied else " "
+        click.echo(f"[{mark}] {version}: {fn.__doc__.strip()}")
+
+
+@db_cli.command('stamp')
+def stamp_command():
+    """Mark all migrations as applied without running them."""
+
+    stamp()
+
+
+@db_cli.command('trigram-index')
+def trigram_index_command():
+    """Create the optional pg_trgm index for substring user search."""
+
+    create_trigram_index()
@@ -2,11 +2,14 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import passwords
+from replicas import RoutingSession, replica_bind_keys
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
@@ -23,6 +26,12 @@ class Follow(db.Model):
 
     __tablename__ = 'follows'
 
+    # the primary key covers lookups by followed user; this covers
+    # "who does this user follow"
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id'),
+    )
+
     user_being_followed_id = db.Column(
         db.Integer,
         db.ForeignKey('users.id', ondelete="cascade"),
@@ -41,6 +50,19 @@ class User(db.Model):
 
     __tablename__ = 'users'
 
+    # lets `username LIKE 'q%'` use an index whatever the database locale
+    __table_args__ = (
+        db.Index(
+            'ix_users_username_pattern',
+            'username',
+            postgresql_ops={'username': 'varchar_pattern_ops'}),
+        # finds the (few) users waiting to be purged
+        db.Index(
+            'ix_users_deleted_at',
+            'deleted_at',
+            postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -87,7 +109,80 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', backref="user", cascade="all, delete-orphan")
+    # Set when the user deletes their account; they're hidden from then on
+    # and removed with everything they made by purge.py.
+    deleted_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    # Denormalized counts, kept up to date by counters.py so profile pages
+    # don't load whole collections just to take their length.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # bumped with every follow and unfollow the user makes, so a copy of
+    # their follows (see followgraph.py) can tell whether it's current
+
+    graph_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # likewise with every like and unlike, for pages showing like buttons
+    # (see http_caching.py)
+
+    likes_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # entries in the user's materialized timeline, give or take deleted
+    # messages (see timeline.py)
+
+    timeline_size = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # authors are almost always rendered with their messages, so load them
+    # in the same query instead of one lazy SELECT per message
+    messages = db.relationship(
+        'Message',
+        backref=db.backref("user", lazy="joined", innerjoin=True),
+        cascade="all, delete-orphan")
 
     followers = db.relationship(
         "User",
@@ -113,7 +208,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -139,13 +234,19 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        A hash made with an outdated work factor is replaced on the user;
+        the caller commits it.
         """
 
-        user = cls.query.filter_by(username=username).one_or_none()
+        user = cls.query.filter_by(
+            username=username, deleted_at=None).one_or_none()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                if passwords.needs_rehash(user.password):
+                    user.password = passwords.hash_password(password)
                 return user
 
         return False
@@ -175,11 +276,40 @@ class User(db.Model):
         return len(liked_message_list) == 1
 
 
+    def get_following_ids(self):
+        """Set of ids of the users this user is following.
+
+        Uses one query on `follows` instead of loading `self.following`.
+        """
+
+        return set(db.session.scalars(
+            db.select(Follow.user_being_followed_id)
+            .where(Follow.user_following_id == self.id)))
+
+
+    def get_liked_message_ids(self):
+        """Set of ids of the messages this user has liked.
+
+        Uses one query on `likes` instead of loading `self.liked_messages`.
+        """
+
+        return set(db.session.scalars(
+            db.select(Like.liked_message_id)
+            .where(Like.user_liking_id == self.id)))
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # serves the homepage feed and profile lists, newest first
+    __table_args__ = (
+        db.Index(
+            'ix_messages_user_id_timestamp',
+            'user_id', 'timestamp', 'id'),
+    )
+
     id = db.Column(
         db.Integer,
         primary_key=True,
@@ -202,12 +332,24 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized, kept up to date by social.apply_likes and purge.py
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
 
 class Like(db.Model):
     """Connection of a user <-> message."""
 
     __tablename__ = 'likes'
 
+    __table_args__ = (
+        db.Index('ix_likes_user_liking_id', 'user_liking_id'),
+    )
+
     liked_message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete="cascade"),
@@ -221,12 +363,262 @@ class Like(db.Model):
     )
 
 
+class TimelineEntry(db.Model):
+    """Materialized entry in a user's home timeline.
+
+    Rows are written when a message is posted (fan-out-on-write), so the
+    homepage can read a user's feed with one indexed range scan.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    __table_args__ = (
+        db.Index(
+            'ix_timeline_entries_user_timestamp',
+            'user_id', 'timestamp', 'message_id'),
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class UserSearchTerm(db.Model):
+    """Posting in the user search index: `term` found in a user's profile.
+
+    `weight` says how strongly the term matches (a username prefix counts
+    for more than a word in the bio). Maintained by search.py.
+    """
+
+    __tablename__ = 'user_search_terms'
+
+    __table_args__ = (
+        db.Index('ix_user_search_terms_user_id', 'user_id'),
+    )
+
+    term = db.Column(
+        db.String(30),
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    weight = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class MessageSearchTerm(db.Model):
+    """Posting in the message search index: `term` appears in a message.
+
+    The author and timestamp are copied from the message so author and
+    date filters can be applied to the postings without a join.
+    Maintained by search.py.
+    """
+
+    __tablename__ = 'message_search_terms'
+
+    __table_args__ = (
+        db.Index('ix_message_search_terms_message_id', 'message_id'),
+    )
+
+    term = db.Column(
+        db.String(30),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    # no foreign key: postings go away with their message
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class TrendingBucket(db.Model):
+    """Net likes a message got in one time bucket. Maintained by trending.py.
+
+    `bucket` is the bucket's start in seconds since the epoch; rows older
+    than the longest trending window are deleted.
+    """
+
+    __tablename__ = 'trending_buckets'
+
+    bucket = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # no foreign key: buckets of deleted messages just expire
+    message_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    likes = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Recommendation(db.Model):
+    """An account suggested for a user to follow.
+
+    Precomputed by recommendations.py; higher `score` is a better match.
+    """
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    recommended_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+
+class StaleRecommendation(db.Model):
+    """A user whose follows or likes changed since their recommendations
+    were computed. Maintained by recommendations.py.
+    """
+
+    __tablename__ = 'stale_recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+
+# dialects with INSERT ... ON CONFLICT
+INSERTS = {
+    'postgresql': postgresql.insert,
+    'sqlite': sqlite.insert,
+}
+
+
+def dialect_insert(model):
+    """INSERT into `model` that can take an ON CONFLICT clause."""
+
+    return INSERTS[db.engine.dialect.name](model)
+
+
+def not_deleted(user_id):
+    """Condition that the `user_id` column isn't a soft-deleted user's.
+
+    Their rows stay until purge.py gets to them. The (few) deleted ids are
+    read from the partial index on `users.deleted_at`.
+    """
+
+    return user_id.not_in(
+        db.select(User.id).where(User.deleted_at.is_not(None)))
+
+
+def engine_options(config, url):
+    """Engine options for the database at `url` from the `DB_*` settings."""
+
+    options = dict(
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', True),
+        pool_recycle=config.get('DB_POOL_RECYCLE', -1),
+    )
+
+    # SQLite (used for local runs) has no server to pool connections to
+    if make_url(url).get_backend_name() == 'postgresql':
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        )
+
+        timeout = config.get('DB_STATEMENT_TIMEOUT_MS')
+
+        if timeout:
+            options['connect_args'] = {
+                'options': f"-c statement_timeout={int(timeout)}"}
+
+    return options
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
+    Sets up the primary from `SQLALCHEMY_DATABASE_URI` and a bind for each
+    of `DATABASE_REPLICA_URLS` (see replicas.py), all with the pool
+    settings from `engine_options`. No connection is opened until one is
+    needed, and sessions last one app context (a request, a CLI command).
+
     You should call this in your Flask app.
     """
 
-    app.app_context().push()
-    db.app = app
+    config = app.config
+    replica_urls = config.get('DATABASE_REPLICA_URLS', [])
+
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+        config, config['SQLALCHEMY_DATABASE_URI'])
+    config.setdefault('SQLALCHEMY_BINDS', {}).update({
+        key: dict(engine_options(config, url), url=url)
+        for key, url in zip(replica_bind_keys(replica_urls), replica_urls)})
+
     db.init_app(app)
+
+
+def dispose_engines(app):
+    """Drop the connections `app`'s engines pooled in the parent process.
+
+    Call in a child right after fork(): the pooled connections' sockets are
+    shared with the parent, so they're left open for it rather than closed.
+    """
+
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
@@ -0,0 +1,146 @@
+"""Keyset (cursor) pagination for Warbler lists.
+
+Pages are addressed by the sort key of an item on the page instead of an
+offset, so fetching a deep page costs the same as fetching the first one.
+Messages are keyed on `(timestamp, id)`, users on `id`.
+
+Cursors travel in the querystring as `?after=<cursor>` (the page after the
+current one, in display order) and `?before=<cursor>` (the page before it).
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+CURSOR_SEPARATOR = "~"
+
+MESSAGE_CURSOR = (datetime.fromisoformat, int)
+USER_CURSOR = (int,)
+
+
+def message_key(msg):
+    """Sort key for a message in a feed."""
+
+    return (msg.timestamp, msg.id)
+
+
+def user_key(user):
+    """Sort key for a user in a listing."""
+
+    return (user.id,)
+
+
+def encode_cursor(key):
+    """Turn a sort key tuple into a querystring-safe cursor."""
+
+    return CURSOR_SEPARATOR.join(
+        value.isoformat() if isinstance(value, datetime) else str(value)
+        for value in key)
+
+
+def decode_cursor(cursor, parsers):
+    """Turn a cursor back into a sort key tuple.
+
+    Returns None if the cursor is missing or malformed.
+    """
+
+    if not cursor:
+        return None
+
+    values = cursor.split(CURSOR_SEPARATOR)
+
+    if len(values) != len(parsers):
+        return None
+
+    try:
+        return tuple(parse(value) for parse, value in zip(parsers, values))
+    except ValueError:
+        return None
+
+
+class Page:
+    """One page of a keyset-paginated list."""
+
+    def __init__(self, items, key, has_prev, has_next):
+        self.items = items
+        self.key = key
+        self.has_prev = has_prev and bool(items)
+        self.has_next = has_next and bool(items)
+
+        # worked out now so `items` can be swapped for display objects
+        self.prev_cursor = (
+            encode_cursor(key(items[0])) if self.has_prev else None)
+        self.next_cursor = (
+            encode_cursor(key(items[-1])) if self.has_next else None)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def paginate(query, columns, key, per_page, after=None, before=None,
+             descending=True):
+    """Return one `Page` of `query`, ordered by `columns`.
+
+    `columns` are the sort key columns and `key` computes the same key from
+    a result row. `after` / `before` are decoded cursors; with neither, the
+    first page is returned.
+    """
+
+    key_expr = tuple_(*columns)
+
+    # walking backwards means flipping the sort and reversing the rows
+    backwards = before is not None
+    ascending = descending == backwards
+
+    if backwards:
+        query = query.filter(key_expr > before if descending
+                             else key_expr < before)
+    elif after is not None:
+        query = query.filter(key_expr < after if descending
+                             else key_expr > after)
+
+    order = [col.asc() if ascending else col.desc() for col in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+        return Page(rows, key, has_prev=has_more, has_next=True)
+
+    return Page(rows, key, has_prev=after is not None, has_next=has_more)
+
+
+def merge_pages(pages, per_page, backwards=False):
+    """Merge pages of the same descending list into a single page.
+
+    Items appearing in more than one page are kept once. When walking
+    backwards, the items closest to the cursor are at the end of the list.
+    """
+
+    key = pages[0].key
+    seen = set()
+    items = []
+
+    for item in sorted((item for page in pages for item in page),
+                       key=key, reverse=True):
+        if key(item) not in seen:
+            seen.add(key(item))
+            items.append(item)
+
+    truncated = len(items) > per_page
+
+    if backwards:
+        items = items[-per_page:]
+        has_prev = truncated or any(page.has_prev for page in pages)
+        has_next = True
+    else:
+        items = items[:per_page]
+        has_prev = any(page.has_prev for page in pages)
+        has_next = truncated or any(page.has_next for page in pages)
+
+    return Page(items, key, has_prev=has_prev, has_next=has_next)
@@ -0,0 +1,124 @@
+"""Password hashing for Warbler.
+
+bcrypt is slow on purpose, and a hash or check holds a worker's CPU for as
+long as it runs. `BCRYPT_LOG_ROUNDS` sets the work factor for new hashes.
+With `PASSWORD_HASH_WORKERS` above zero, hashing runs in a process pool of
+that size instead of in the request's own process; at most
+`PASSWORD_HASH_QUEUE` jobs are handed to the pool at once and further
+callers wait for room, so a burst of logins can't queue unbounded work.
+
+Hashes made with a different work factor are replaced with a fresh one the
+next time their owner logs in (see `User.authenticate`).
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+from flask import current_app
+
+from instrumentation import timed
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_QUEUE_PER_WORKER = 4
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def log_rounds():
+    """Work factor for new password hashes."""
+
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _get_pool():
+    """The process pool for this process, or None to hash inline."""
+
+    global _pool, _pool_pid, _pool_slots
+
+    num_workers = current_app.config.get('PASSWORD_HASH_WORKERS', 0)
+
+    if not num_workers:
+        return None
+
+    with _pool_lock:
+        # a pool inherited over fork() has no live workers in this process
+        if _pool is None or _pool_pid != os.getpid():
+            queue_size = current_app.config.get(
+                'PASSWORD_HASH_QUEUE', num_workers * DEFAULT_QUEUE_PER_WORKER)
+
+            _pool = ProcessPoolExecutor(
+                max_workers=num_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            _pool_pid = os.getpid()
+            _pool_slots = threading.BoundedSemaphore(queue_size)
+
+        return _pool
+
+
+def _run(fn, *args):
+    """Call `fn(*args)` in the pool if there is one, else right here."""
+
+    pool = _get_pool()
+
+    with timed('bcrypt'):
+        if pool is None:
+            return fn(*args)
+
+        with _pool_slots:
+            return pool.submit(fn, *args).result()
+
+
+def shutdown():
+    """Stop this process's hashing pool, if it has one."""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.shutdown()
+        _pool = None
+
+
+def hash_password(password):
+    """Hash `password` at the configured work factor."""
+
+    if not password:
+        raise ValueError("Password must be non-empty.")
+
+    return _run(_hash, password.encode('UTF-8'), log_rounds()).decode('UTF-8')
+
+
+def check_password(hashed, password):
+    """Does `password` match the stored hash `hashed`?"""
+
+    try:
+        return _run(_check, password.encode('UTF-8'), hashed.encode('UTF-8'))
+    except ValueError:
+        # not a bcrypt hash
+        return False
+
+
+def needs_rehash(hashed):
+    """Was `hashed` made with a different work factor than configured?"""
+
+    # bcrypt hashes look like $2b$<rounds>$<salt and hash>
+    try:
+        rounds = int(hashed.split('$')[2])
+    except (IndexError, ValueError):
+        return True
+
+    return rounds != log_rounds()
@@ -0,0 +1,166 @@
+"""Account deletion for Warbler.
+
+Deleting an account only marks the user (`soft_delete_user`): from then on
+they can't log in and are hidden from profiles and user lists. Their rows
+are removed afterwards by
+
+    flask purge-deleted-users
+
+(run it from cron, say every minute), a bounded batch per transaction so a
+heavy user never holds locks for long. Messages go first, since they're
+what other people see, then the user's likes and follows, then the user
+row itself. Counters on the other side of each removed row are kept right
+as it goes, and likes, timeline entries and search terms of the purged
+messages go with them through their `ondelete="cascade"` foreign keys.
+
+Nothing is loaded into the ORM and every batch commits, so the job can be
+stopped at any point; running it again carries on from what's left.
+"""
+
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, select
+
+from models import db, Follow, Like, Message, User
+from cache import user_cache
+from search import unindex_user
+import counters
+
+
+def soft_delete_user(user):
+    """Hide `user` now and leave their rows to `purge_deleted_users`.
+
+    Runs inside the caller's transaction.
+    """
+
+    user.deleted_at = datetime.utcnow()
+    unindex_user(user.id)
+    user_cache.invalidate(user.id)
+
+
+def _delete_where(model, condition):
+    db.session.execute(
+        delete(model)
+        .where(condition)
+        .execution_options(synchronize_session=False))
+
+
+def _purge_messages(user_id, batch_size):
+    message_ids = db.session.scalars(
+        select(Message.id)
+        .where(Message.user_id == user_id)
+        .limit(batch_size)).all()
+
+    if message_ids:
+        counters.messages_purged(message_ids)
+        _delete_where(Message, Message.id.in_(message_ids))
+
+    return len(message_ids)
+
+
+def _purge_likes(user_id, batch_size):
+    message_ids = db.session.scalars(
+        select(Like.liked_message_id)
+        .where(Like.user_liking_id == user_id)
+        .limit(batch_size)).all()
+
+    if message_ids:
+        counters.message_likes_lost(message_ids)
+        _delete_where(
+            Like,
+            (Like.user_liking_id == user_id)
+            & Like.liked_message_id.in_(message_ids))
+
+    return len(message_ids)
+
+
+def _purge_following(user_id, batch_size):
+    followed_ids = db.session.scalars(
+        select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == user_id)
+        .limit(batch_size)).all()
+
+    if followed_ids:
+        counters.followers_lost(followed_ids)
+        _delete_where(
+            Follow,
+            (Follow.user_following_id == user_id)
+            & Follow.user_being_followed_id.in_(followed_ids))
+
+    return len(followed_ids)
+
+
+def _purge_followers(user_id, batch_size):
+    follower_ids = db.session.scalars(
+        select(Follow.user_following_id)
+        .where(Follow.user_being_followed_id == user_id)
+        .limit(batch_size)).all()
+
+    if follower_ids:
+        counters.following_lost(follower_ids)
+        _delete_where(
+            Follow,
+            (Follow.user_being_followed_id == user_id)
+            & Follow.user_following_id.in_(follower_ids))
+
+    return len(follower_ids)
+
+
+# (what, delete one batch of it) in the order they're purged
+PURGE_STEPS = [
+    ("messages", _purge_messages),
+    ("likes", _purge_likes),
+    ("follows", _purge_following),
+    ("followers", _purge_followers),
+]
+
+
+def purge_user(user_id, batch_size=1000, echo=print):
+    """Delete a soft-deleted user's rows, then the user."""
+
+    for what, purge_batch in PURGE_STEPS:
+        num_done = 0
+
+        while True:
+            num_purged = purge_batch(user_id, batch_size)
+            db.session.commit()
+
+            if not num_purged:
+                break
+
+            num_done += num_purged
+            echo(f"User {user_id}: purged {num_done} {what}")
+
+    _delete_where(User, User.id == user_id)
+    db.session.commit()
+
+    echo(f"User {user_id}: purged")
+
+
+def purge_deleted_users(batch_size=1000, echo=print):
+    """Purge every soft-deleted user, oldest deletion first.
+
+    Returns the number of users purged.
+    """
+
+    user_ids = db.session.scalars(
+        select(User.id)
+        .where(User.deleted_at.is_not(None))
+        .order_by(User.deleted_at, User.id)).all()
+
+    for user_id in user_ids:
+        purge_user(user_id, batch_size=batch_size, echo=echo)
+
+    return len(user_ids)
+
+
+@click.command('purge-deleted-users')
+@click.option('--batch-size', default=1000, help="Rows per transaction.")
+@with_appcontext
+def purge_deleted_users_command(batch_size):
+    """Remove deleted accounts and everything they made."""
+
+    num_purged = purge_deleted_users(batch_size=batch_size, echo=click.echo)
+    click.echo(f"Purged {num_purged} users")
@@ -0,0 +1,317 @@
+"""Live feed updates for Warbler, over Server-Sent Events.
+
+Once the transaction adding a message commits, `message_posted` publishes
+it on its author's channel (`user:<id>`). GET /stream keeps a
+`text/event-stream` response open and forwards everything published on
+the channels of the user and the accounts they follow, as `message`
+events carrying the rendered list item (see fragments.py); the homepage
+prepends them to the feed. A comment goes out every `STREAM_KEEPALIVE`
+seconds so connections closed by the client are noticed. The channels are
+fixed when the stream opens; a newly followed account's messages show up
+from the next page load.
+
+Publishing goes through a `Broker`, picked with `PUBSUB_BACKEND`:
+
+    local       delivers to the streams of this process only
+    postgres    relays through PostgreSQL LISTEN/NOTIFY, so a message
+                posted on any worker reaches the streams on every worker
+
+Anything else (Redis, ...) can implement `Broker` and be passed to
+`init_app`. Each app gets its own broker and streams (`init_app`, in
+`app.extensions`); `realtime` is the current app's.
+
+A stream holds its worker for as long as the client stays connected, so
+run the app under an async worker class (gevent, as gunicorn.conf.py
+does): an idle stream is then a greenlet waiting on its queue, and
+thousands of them fit in one worker. `STREAM_MAX_CONNECTIONS` caps the streams per process;
+beyond it clients get a 503, and EventSource retries by itself.
+"""
+
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from flask import Response, current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import Session
+from werkzeug.local import LocalProxy
+
+from models import db
+from fragments import message_fragments
+
+logger = logging.getLogger('warbler.realtime')
+
+PUBLISH_KEY = 'realtime_publish'
+NOTIFY_CHANNEL = 'warbler_events'
+DEFAULT_KEEPALIVE = 15
+DEFAULT_MAX_CONNECTIONS = 1000
+DEFAULT_QUEUE_SIZE = 100
+
+# milliseconds EventSource waits before reconnecting
+RETRY_MS = 5000
+
+
+def user_channel(user_id):
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """Events published on some channels, queued for one reader."""
+
+    def __init__(self, broker, channels, maxsize=DEFAULT_QUEUE_SIZE):
+        self.broker = broker
+        self.channels = frozenset(channels)
+        self._queue = queue.Queue(maxsize)
+
+    def deliver(self, data):
+        """Queue `data`; a reader that has fallen this far behind loses it."""
+
+        try:
+            self._queue.put_nowait(data)
+        except queue.Full:
+            pass
+
+    def get(self, timeout):
+        """Next event, or None if none arrives within `timeout` seconds."""
+
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class Broker(ABC):
+    """Interface for publishing events to subscribed streams."""
+
+    @abstractmethod
+    def subscribe(self, channels):
+        """A `Subscription` to `channels`."""
+
+    @abstractmethod
+    def unsubscribe(self, subscription):
+        """Stop delivering to `subscription`."""
+
+    @abstractmethod
+    def publish(self, channel, data):
+        """Send `data` (anything JSON can encode) to `channel`."""
+
+    @property
+    @abstractmethod
+    def num_subscriptions(self):
+        """Number of open subscriptions."""
+
+
+class LocalBroker(Broker):
+    """Delivers events to the subscriptions of this process."""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions.setdefault(channel, set()).add(
+                    subscription)
+
+            self._count += 1
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscriptions = self._subscriptions.get(channel, set())
+                subscriptions.discard(subscription)
+
+                if not subscriptions:
+                    self._subscriptions.pop(channel, None)
+
+            self._count -= 1
+
+    def publish(self, channel, data):
+        self._deliver(channel, data)
+
+    def _deliver(self, channel, data):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+
+        for subscription in subscriptions:
+            subscription.deliver(data)
+
+    @property
+    def num_subscriptions(self):
+        return self._count
+
+
+class PostgresBroker(LocalBroker):
+    """Relays events between processes with LISTEN/NOTIFY.
+
+    Publishing sends a NOTIFY; each process runs a thread that LISTENs on
+    its own connection and hands what arrives to its local subscriptions.
+    Payloads are limited to 8000 bytes.
+    """
+
+    def __init__(self, engine):
+        super().__init__()
+        self.engine = engine
+        self._listener_pid = None
+
+    def subscribe(self, channels):
+        self._start()
+        return super().subscribe(channels)
+
+    def publish(self, channel, data):
+        payload = json.dumps({'channel': channel, 'data': data})
+
+        with self.engine.connect() as conn:
+            conn.execute(func.pg_notify(NOTIFY_CHANNEL, payload).select())
+            conn.commit()
+
+    def _start(self):
+        """Start this process's listener thread if it isn't running."""
+
+        # a thread doesn't survive fork(); each worker starts its own
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                threading.Thread(
+                    target=self._run, name="pubsub-listener",
+                    daemon=True).start()
+                self._listener_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("LISTEN connection failed; reconnecting")
+                time.sleep(1)
+
+    def _listen(self):
+        conn = self.engine.raw_connection()
+
+        try:
+            dbapi_conn = conn.driver_connection
+            dbapi_conn.autocommit = True
+            dbapi_conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+
+            while True:
+                if not select.select([dbapi_conn], [], [], 60)[0]:
+                    continue
+
+                dbapi_conn.poll()
+
+                while dbapi_conn.notifies:
+                    notify = dbapi_conn.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    self._deliver(message['channel'], message['data'])
+        finally:
+            conn.invalidate()
+
+
+class Realtime:
+    """The app's broker and its live streams."""
+
+    def __init__(self, broker, keepalive=DEFAULT_KEEPALIVE,
+                 max_connections=DEFAULT_MAX_CONNECTIONS):
+        self.broker = broker
+        self.keepalive = keepalive
+        self.max_connections = max_connections
+
+    def message_posted(self, msg):
+        """Publish `msg` once the current transaction commits.
+
+        Call after it's flushed, so it has an id and a timestamp.
+        """
+
+        data = {'id': msg.id, 'html': str(message_fragments.render(msg))}
+
+        db.session.info.setdefault(PUBLISH_KEY, []).append(
+            (user_channel(msg.user_id), data))
+
+    def stream(self, user_ids):
+        """Response streaming what's published on `user_ids`' channels."""
+
+        if self.broker.num_subscriptions >= self.max_connections:
+            return Response(
+                "Too many live streams", status=503,
+                headers={'Retry-After': str(RETRY_MS // 1000)})
+
+        subscription = self.broker.subscribe(
+            user_channel(user_id) for user_id in user_ids)
+        keepalive = self.keepalive
+
+        def events():
+            try:
+                yield f"retry: {RETRY_MS}\n\n"
+
+                while True:
+                    data = subscription.get(timeout=keepalive)
+
+                    if data is None:
+                        yield ": keepalive\n\n"
+                    else:
+                        yield f"event: message\ndata: {json.dumps(data)}\n\n"
+            finally:
+                subscription.close()
+
+        return Response(
+            events(),
+            mimetype='text/event-stream',
+            # tell proxies such as nginx not to buffer the stream
+            headers={'X-Accel-Buffering': 'no'})
+
+
+def init_app(app, broker=None):
+    """Give `app` live streams, on `broker` or on the one picked by
+    `PUBSUB_BACKEND`: local or postgres.
+    """
+
+    if broker is None and app.config.get('PUBSUB_BACKEND') == 'postgres':
+        with app.app_context():
+            broker = PostgresBroker(db.engine)
+    elif broker is None:
+        broker = LocalBroker()
+
+    app.extensions['realtime'] = Realtime(
+        broker,
+        keepalive=app.config.get('STREAM_KEEPALIVE', DEFAULT_KEEPALIVE),
+        max_connections=app.config.get(
+            'STREAM_MAX_CONNECTIONS', DEFAULT_MAX_CONNECTIONS))
+
+
+# the current app's `Realtime`
+realtime = LocalProxy(lambda: current_app.extensions['realtime'])
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_committed(session):
+    """Publish what the committed transaction queued."""
+
+    for channel, data in session.info.pop(PUBLISH_KEY, ()):
+        try:
+            realtime.broker.publish(channel, data)
+        except Exception:
+            logger.exception("Publishing on %s failed", channel)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_published(session, previous_transaction):
+    """Rolled back messages were never posted."""
+
+    if not session.in_transaction():
+        session.info.pop(PUBLISH_KEY, None)
@@ -0,0 +1,272 @@
+"""Who-to-follow recommendations for Warbler.
+
+Suggestions are precomputed offline by
+
+    flask refresh-recommendations [--incremental]
+
+into the `recommendations` table, up to `RECOMMENDATIONS_PER_USER` per
+user, from two sources:
+
+- friends of friends: accounts followed by the accounts a user follows,
+  scored by how many of them do;
+- co-liked authors: authors liked by people who like the same authors as
+  the user, counting for `CO_LIKE_WEIGHT` each.
+
+Each batch of users is scored by a single INSERT ... SELECT, one
+transaction per batch: the candidates of both sources are joined out of
+`follows` and `likes`, summed per user and candidate with GROUP BY, and
+the best few per user kept with a window function. The work stays in the
+database, which uses the follows and likes indexes for every hop; nothing
+loops over users in Python. Each hop looks at no more than `FANOUT`
+neighbours, so popular accounts don't blow up the work: along likes, those
+behind the most recently posted liked messages; along follows, which
+aren't timestamped, a random sample.
+
+A full run redoes every user. Following, unfollowing, liking or unliking
+marks a user stale (social.py calls `mark_stale`), and `--incremental`
+redoes only those users, e.g. every few minutes between nightly full runs.
+
+`suggestions_for` reads a user's suggestions in one query, leaving out
+anyone they've followed since the job ran.
+"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, exists, func, literal, select, union_all
+
+from models import (
+    db, dialect_insert, not_deleted, Follow, Like, Message, Recommendation,
+    StaleRecommendation, User)
+
+DEFAULT_PER_USER = 20
+FANOUT = 100
+CO_LIKE_WEIGHT = 0.25
+
+
+def mark_stale(user_ids):
+    """Have the next incremental refresh redo `user_ids`.
+
+    Runs inside the caller's transaction.
+    """
+
+    if user_ids:
+        db.session.execute(
+            dialect_insert(StaleRecommendation)
+            .values([{'user_id': user_id} for user_id in sorted(user_ids)])
+            .on_conflict_do_nothing())
+
+
+def suggestions_for(user_id, limit):
+    """Up to `limit` users suggested to `user_id`, best first."""
+
+    already_followed = exists().where(
+        (Follow.user_following_id == user_id)
+        & (Follow.user_being_followed_id == Recommendation.recommended_id))
+
+    return db.session.scalars(
+        select(User)
+        .join(Recommendation, Recommendation.recommended_id == User.id)
+        .where(Recommendation.user_id == user_id)
+        .where(User.deleted_at.is_(None))
+        .where(~already_followed)
+        .order_by(Recommendation.score.desc(), User.id)
+        .limit(limit)).all()
+
+
+##############################################################################
+# Batch job
+
+
+def _neighbours(name, user_column, neighbour_column, user_ids, *joins,
+                recency=None):
+    """CTE of (user_id, neighbour_id) pairs of `user_ids` (a list or a
+    subquery), keeping each user's `FANOUT` neighbours with the newest
+    `recency` (the latest over the rows joining the pair), or a random
+    `FANOUT` of them if there's no `recency` to go by.
+    """
+
+    query = select(user_column.label('user_id'),
+                   neighbour_column.label('neighbour_id'))
+
+    if recency is None:
+        query = query.distinct()
+        order_by = func.random()
+    else:
+        query = (query.add_columns(func.max(recency).label('recency'))
+                 .group_by(user_column, neighbour_column))
+
+    query = query.where(user_column.in_(user_ids))
+
+    for target, on in joins:
+        query = query.join(target, on)
+
+    pairs = query.subquery()
+
+    if recency is not None:
+        order_by = (pairs.c.recency.desc(), pairs.c.neighbour_id.desc())
+
+    ranked = select(
+        pairs.c.user_id,
+        pairs.c.neighbour_id,
+        func.row_number().over(
+            partition_by=pairs.c.user_id,
+            order_by=order_by).label('rank'),
+    ).subquery()
+
+    return (select(ranked.c.user_id, ranked.c.neighbour_id)
+            .where(ranked.c.rank <= FANOUT)
+            .cte(name))
+
+
+def _scored(user_ids):
+    """Query of (user_id, candidate_id, score) rows for `user_ids`, one per
+    way of reaching the candidate; scores are summed by the caller.
+    """
+
+    author = (Message, Like.liked_message_id == Message.id)
+
+    # friends of friends count 1 each; follows aren't timestamped, so
+    # these hops are sampled at random
+    followed = _neighbours(
+        'followed',
+        Follow.user_following_id, Follow.user_being_followed_id, user_ids)
+    followed_twice = _neighbours(
+        'followed_twice',
+        Follow.user_following_id, Follow.user_being_followed_id,
+        select(followed.c.neighbour_id))
+
+    friends_of_friends = (
+        select(followed.c.user_id,
+               followed_twice.c.neighbour_id.label('candidate_id'),
+               literal(1.0).label('score'))
+        .join(followed_twice,
+              followed_twice.c.user_id == followed.c.neighbour_id))
+
+    # authors liked by the other likers of the authors the user likes
+    liked = _neighbours(
+        'liked',
+        Like.user_liking_id, Message.user_id, user_ids, author,
+        recency=Message.timestamp)
+    co_likers = _neighbours(
+        'co_likers',
+        Message.user_id, Like.user_liking_id,
+        select(liked.c.neighbour_id), author,
+        recency=Message.timestamp)
+    co_liked = _neighbours(
+        'co_liked',
+        Like.user_liking_id, Message.user_id,
+        select(co_likers.c.neighbour_id), author,
+        recency=Message.timestamp)
+
+    co_liked_authors = (
+        select(liked.c.user_id,
+               co_liked.c.neighbour_id.label('candidate_id'),
+               literal(CO_LIKE_WEIGHT).label('score'))
+        .join(co_likers, co_likers.c.user_id == liked.c.neighbour_id)
+        .join(co_liked, co_liked.c.user_id == co_likers.c.neighbour_id)
+        .where(co_likers.c.neighbour_id != liked.c.user_id))
+
+    return union_all(friends_of_friends, co_liked_authors)
+
+
+def suggestions_query(user_ids, per_user):
+    """Query of the best `per_user` (user_id, recommended_id, score) rows
+    for each of `user_ids`.
+    """
+
+    scored = _scored(user_ids).subquery()
+
+    already_followed = exists().where(
+        (Follow.user_following_id == scored.c.user_id)
+        & (Follow.user_being_followed_id == scored.c.candidate_id))
+
+    totals = (
+        select(scored.c.user_id,
+               scored.c.candidate_id,
+               func.sum(scored.c.score).label('score'))
+        .where(scored.c.candidate_id != scored.c.user_id)
+        .where(not_deleted(scored.c.candidate_id))
+        .where(~already_followed)
+        .group_by(scored.c.user_id, scored.c.candidate_id)
+        .subquery())
+
+    ranked = select(
+        totals,
+        func.row_number().over(
+            partition_by=totals.c.user_id,
+            order_by=(totals.c.score.desc(), totals.c.candidate_id),
+        ).label('rank'),
+    ).subquery()
+
+    return (select(ranked.c.user_id, ranked.c.candidate_id, ranked.c.score)
+            .where(ranked.c.rank <= per_user))
+
+
+def _write(user_ids, per_user):
+    """Replace the suggestions of `user_ids`."""
+
+    db.session.execute(
+        delete(Recommendation)
+        .where(Recommendation.user_id.in_(user_ids))
+        .execution_options(synchronize_session=False))
+
+    db.session.execute(
+        Recommendation.__table__.insert().from_select(
+            ['user_id', 'recommended_id', 'score'],
+            suggestions_query(user_ids, per_user)))
+
+    db.session.commit()
+
+
+def refresh_recommendations(
+        incremental=False, batch_size=1000, echo=print):
+    """Recompute suggestions for every user, or only the stale ones.
+
+    Returns the number of users done.
+    """
+
+    per_user = current_app.config.get(
+        'RECOMMENDATIONS_PER_USER', DEFAULT_PER_USER)
+
+    clear_marks = (delete(StaleRecommendation)
+                   .execution_options(synchronize_session=False))
+
+    if incremental:
+        user_ids = db.session.scalars(
+            clear_marks.returning(StaleRecommendation.user_id)).all()
+    else:
+        db.session.execute(clear_marks)
+        user_ids = db.session.scalars(
+            select(User.id).where(User.deleted_at.is_(None))).all()
+
+    # marks are cleared before the batches are read, so users who change
+    # something while the job runs are redone by the next run
+    db.session.commit()
+    user_ids.sort()
+
+    if not user_ids:
+        return 0
+
+    num_done = 0
+
+    for start in range(0, len(user_ids), batch_size):
+        batch = user_ids[start:start + batch_size]
+        _write(batch, per_user)
+
+        num_done += len(batch)
+        echo(f"Refreshed recommendations for {num_done} users")
+
+    return num_done
+
+
+@click.command('refresh-recommendations')
+@click.option('--incremental', is_flag=True,
+              help="Only users whose follows or likes changed.")
+@click.option('--batch-size', default=1000, help="Users per transaction.")
+@with_appcontext
+def refresh_recommendations_command(incremental, batch_size):
+    """Precompute who-to-follow suggestions."""
+
+    refresh_recommendations(
+        incremental=incremental, batch_size=batch_size, echo=click.echo)
@@ -0,0 +1,83 @@
+"""Read-replica routing for Warbler.
+
+Each URL in `DATABASE_REPLICA_URLS` becomes a Flask-SQLAlchemy bind
+(`replica_0`, `replica_1`, ...; see `models.connect_db`). Views marked
+`@read_only` run every query of their request on one of the replicas,
+picked at random per request; everything else, and any write or flush
+even inside a read-only view, goes to the primary.
+
+Replicas lag the primary, so after a browser makes a change (any request
+that isn't GET/HEAD/OPTIONS) its session is pinned to the primary for
+`REPLICA_STICKY_SECONDS`, and it reads its own writes.
+
+With no replicas configured, nothing changes.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+
+REPLICA_BIND_PREFIX = 'replica_'
+DEFAULT_STICKY_SECONDS = 10
+STICKY_KEY = 'primary_until'
+SAFE_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+def replica_bind_keys(urls):
+    """Bind keys for the replica URLs, in order."""
+
+    return [f"{REPLICA_BIND_PREFIX}{n}" for n in range(len(urls))]
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica."""
+
+    view.reads_from_replica = True
+    return view
+
+
+class RoutingSession(Session):
+    """Session that sends reads to this request's replica, if it has one."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = has_app_context() and g.get('read_replica')
+
+        if (replica and bind is None and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            return self._db.engines[replica]
+
+        return super().get_bind(
+            mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_app(app):
+    """Route `@read_only` views of `app` to its replicas."""
+
+    def sticky_seconds():
+        return app.config.get('REPLICA_STICKY_SECONDS', DEFAULT_STICKY_SECONDS)
+
+    @app.before_request
+    def choose_database():
+        # the app context (and so g) can outlive a request; start clean
+        g.pop('read_replica', None)
+
+        bind_keys = replica_bind_keys(
+            current_app.config.get('DATABASE_REPLICA_URLS', []))
+        view = app.view_functions.get(request.endpoint)
+
+        if (bind_keys and getattr(view, 'reads_from_replica', False)
+                and session.get(STICKY_KEY, 0) <= time.time()):
+            g.read_replica = random.choice(bind_keys)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if request.method not in SAFE_METHODS and sticky_seconds():
+            session[STICKY_KEY] = time.time() + sticky_seconds()
+
+        return response
+
+    @app.teardown_request
+    def forget_replica(exc):
+        g.pop('read_replica', None)
@@ -0,0 +1,322 @@
+"""Search for Warbler.
+
+Users are found through an inverted index in the `user_search_terms`
+table: one row per (term, user), where the terms are the words of the
+username, location and bio plus prefixes of the username and location
+words. A search looks up each query term by primary key, keeps users that
+match every term and ranks them by the summed term weights, so the cost
+depends on how many users match rather than on the size of `users`.
+
+Messages work the same way through `message_search_terms`, which also
+carries each message's author and timestamp for filtering; results are
+ranked by how often the query words occur, then by recency.
+
+The user index is updated on signup and profile edit, the message index
+when messages are added or deleted. `flask reindex-users` and
+`flask reindex-messages` rebuild them.
+"""
+
+import re
+from collections import Counter
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, select
+
+from models import (
+    db, not_deleted, Message, MessageSearchTerm, User, UserSearchTerm)
+from pagination import (
+    paginate, decode_cursor, message_key, user_key, Page, USER_CURSOR)
+
+WORD_RE = re.compile(r"\w+")
+
+MAX_TERM_LENGTH = 30
+MIN_PREFIX_LENGTH = 2
+MAX_QUERY_TERMS = 5
+
+USERNAME_WEIGHT = 8
+USERNAME_PREFIX_WEIGHT = 4
+LOCATION_WEIGHT = 2
+LOCATION_PREFIX_WEIGHT = 1
+BIO_WEIGHT = 1
+
+# words too common in messages to be worth indexing
+STOP_WORDS = frozenset("""
+    a an and are as at be but by for from has have i in is it its me my of on
+    or so that the this to was we were will with you your
+    """.split())
+
+# (negated score, user id)
+SEARCH_CURSOR = (int, int)
+
+# (score, timestamp, message id)
+MESSAGE_SEARCH_CURSOR = (int, datetime.fromisoformat, int)
+
+
+def tokenize(text):
+    """Lowercased words of `text`, truncated to fit in the index."""
+
+    return [word[:MAX_TERM_LENGTH] for word in WORD_RE.findall(text.lower())]
+
+
+def prefixes(word):
+    """Proper prefixes of `word` long enough to be worth indexing."""
+
+    return [word[:end] for end in range(MIN_PREFIX_LENGTH, len(word))]
+
+
+def user_terms(user):
+    """Map of term -> weight for everything searchable about `user`."""
+
+    terms = Counter()
+
+    for word in tokenize(user.username):
+        terms[word] += USERNAME_WEIGHT
+        for prefix in prefixes(word):
+            terms[prefix] += USERNAME_PREFIX_WEIGHT
+
+    for word in tokenize(user.location or ""):
+        terms[word] += LOCATION_WEIGHT
+        for prefix in prefixes(word):
+            terms[prefix] += LOCATION_PREFIX_WEIGHT
+
+    for word in set(tokenize(user.bio or "")):
+        terms[word] += BIO_WEIGHT
+
+    return terms
+
+
+def _postings(user):
+    return [dict(term=term, user_id=user.id, weight=weight)
+            for term, weight in user_terms(user).items()]
+
+
+def index_user(user):
+    """(Re)index a flushed user. Runs inside the caller's transaction."""
+
+    db.session.execute(
+        delete(UserSearchTerm).where(UserSearchTerm.user_id == user.id))
+
+    postings = _postings(user)
+
+    if postings:
+        db.session.execute(insert(UserSearchTerm), postings)
+
+
+def unindex_user(user_id):
+    """Remove a user from the index. Runs inside the caller's transaction."""
+
+    db.session.execute(
+        delete(UserSearchTerm).where(UserSearchTerm.user_id == user_id))
+
+
+def search_users(q, per_page, after=None, before=None):
+    """Return a `Page` of users matching every word of `q`, best first.
+
+    `after` / `before` are cursors from a previous page of the same search.
+    Queries too short to use the index fall back to a username prefix scan.
+    """
+
+    terms = [term for term in dict.fromkeys(tokenize(q))
+             if len(term) >= MIN_PREFIX_LENGTH][:MAX_QUERY_TERMS]
+
+    if not terms:
+        return paginate(
+            User.query
+            .filter(User.username.startswith(q, autoescape=True))
+            .filter(User.deleted_at.is_(None)),
+            [User.id],
+            user_key,
+            per_page,
+            after=decode_cursor(after, USER_CURSOR),
+            before=decode_cursor(before, USER_CURSOR),
+            descending=False)
+
+    # negate the score so rank and id both sort ascending
+    ranked = (select(
+                UserSearchTerm.user_id,
+                (-func.sum(UserSearchTerm.weight)).label('rank'))
+              .where(UserSearchTerm.term.in_(terms))
+              .group_by(UserSearchTerm.user_id)
+              .having(func.count() == len(terms))
+              .subquery())
+
+    page = paginate(
+        db.session.query(User, ranked.c.rank)
+        .join(ranked, ranked.c.user_id == User.id),
+        [ranked.c.rank, User.id],
+        lambda row: (row.rank, row.User.id),
+        per_page,
+        after=decode_cursor(after, SEARCH_CURSOR),
+        before=decode_cursor(before, SEARCH_CURSOR),
+        descending=False)
+
+    page.items = [row.User for row in page.items]
+    return page
+
+
+def reindex_users(batch_size=1000, echo=print):
+    """Rebuild the user search index, committing after each batch."""
+
+    last_id = 0
+    num_done = 0
+
+    while True:
+        users = (User.query
+                 .filter(User.id > last_id)
+                 .order_by(User.id)
+                 .limit(batch_size)
+                 .all())
+
+        if not users:
+            break
+
+        user_ids = [user.id for user in users]
+
+        db.session.execute(
+            delete(UserSearchTerm).where(UserSearchTerm.user_id.in_(user_ids)))
+
+        postings = [posting for user in users if user.deleted_at is None
+                    for posting in _postings(user)]
+
+        if postings:
+            db.session.execute(insert(UserSearchTerm), postings)
+
+        db.session.commit()
+
+        last_id = user_ids[-1]
+        num_done += len(users)
+        echo(f"Indexed {num_done} users")
+
+
+def message_terms(text):
+    """Map of term -> number of occurrences in a message's text."""
+
+    return Counter(word for word in tokenize(text) if word not in STOP_WORDS)
+
+
+def _message_postings(msg):
+    return [dict(term=term,
+                 message_id=msg.id,
+                 user_id=msg.user_id,
+                 timestamp=msg.timestamp,
+                 count=count)
+            for term, count in message_terms(msg.text).items()]
+
+
+def index_message(msg):
+    """Index a newly flushed message. Runs inside the caller's transaction."""
+
+    postings = _message_postings(msg)
+
+    if postings:
+        db.session.execute(insert(MessageSearchTerm), postings)
+
+
+def unindex_message(msg):
+    """Remove a message from the index before it is deleted."""
+
+    db.session.execute(
+        delete(MessageSearchTerm)
+        .where(MessageSearchTerm.message_id == msg.id))
+
+
+def search_messages(q, per_page, author_id=None, since=None, until=None,
+                    after=None, before=None):
+    """Return a `Page` of messages containing every word of `q`, best first.
+
+    Optionally only messages by `author_id`, or posted at or after `since`
+    and before `until` (datetimes). `after` / `before` are cursors from a
+    previous page of the same search.
+    """
+
+    terms = [term for term in dict.fromkeys(tokenize(q))
+             if term not in STOP_WORDS][:MAX_QUERY_TERMS]
+
+    if not terms:
+        return Page([], message_key, has_prev=False, has_next=False)
+
+    postings = (select(
+                  MessageSearchTerm.message_id,
+                  func.sum(MessageSearchTerm.count).label('score'))
+                .where(MessageSearchTerm.term.in_(terms))
+                .where(not_deleted(MessageSearchTerm.user_id)))
+
+    if author_id is not None:
+        postings = postings.where(MessageSearchTerm.user_id == author_id)
+    if since is not None:
+        postings = postings.where(MessageSearchTerm.timestamp >= since)
+    if until is not None:
+        postings = postings.where(MessageSearchTerm.timestamp < until)
+
+    ranked = (postings
+              .group_by(MessageSearchTerm.message_id)
+              .having(func.count() == len(terms))
+              .subquery())
+
+    page = paginate(
+        db.session.query(Message, ranked.c.score)
+        .join(ranked, ranked.c.message_id == Message.id),
+        [ranked.c.score, Message.timestamp, Message.id],
+        lambda row: (row.score, row.Message.timestamp, row.Message.id),
+        per_page,
+        after=decode_cursor(after, MESSAGE_SEARCH_CURSOR),
+        before=decode_cursor(before, MESSAGE_SEARCH_CURSOR))
+
+    page.items = [row.Message for row in page.items]
+    return page
+
+
+def reindex_messages(batch_size=5000, echo=print):
+    """Rebuild the message search index, committing after each batch."""
+
+    last_id = 0
+    num_done = 0
+
+    while True:
+        messages = db.session.execute(
+            select(Message.id, Message.user_id, Message.timestamp, Message.text)
+            .where(Message.id > last_id)
+            .order_by(Message.id)
+            .limit(batch_size)).all()
+
+        if not messages:
+            break
+
+        message_ids = [msg.id for msg in messages]
+
+        db.session.execute(
+            delete(MessageSearchTerm)
+            .where(MessageSearchTerm.message_id.in_(message_ids)))
+
+        postings = [posting
+                    for msg in messages
+                    for posting in _message_postings(msg)]
+
+        if postings:
+            db.session.execute(insert(MessageSearchTerm), postings)
+
+        db.session.commit()
+
+        last_id = message_ids[-1]
+        num_done += len(messages)
+        echo(f"Indexed {num_done} messages")
+
+
+@click.command('reindex-users')
+@click.option('--batch-size', default=1000, help="Users per transaction.")
+@with_appcontext
+def reindex_users_command(batch_size):
+    """Rebuild the user search index from the users table."""
+
+    reindex_users(batch_size=batch_size, echo=click.echo)
+
+
+@click.command('reindex-messages')
+@click.option('--batch-size', default=5000, help="Messages per transaction.")
+@with_appcontext
+def reindex_messages_command(batch_size):
+    """Rebuild the message search index from the messages table."""
+
+    reindex_messages(batch_size=batch_size, echo=click.echo)
@@ -1,11 +1,17 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Message, Follow
+from app import app
+from models import db, User, Message, Follow
+from counters import reconcile_counters
+from migrations import stamp
+from search import reindex_users, reindex_messages
+
+app.app_context().push()
 
 db.drop_all()
 db.create_all()
+stamp()
 
 with open('generator/users.csv') as users:
     db.session.bulk_insert_mappings(User, DictReader(users))
@@ -17,3 +23,7 @@ with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follow, DictReader(follows))
 
 db.session.commit()
+
+reconcile_counters()
+reindex_users()
+reindex_messages()
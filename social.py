@@ -0,0 +1,277 @@
+"""Follows and likes, shared by the HTML views and the JSON API.
+
+Each change is a single idempotent statement on `follows` / `likes`
+(`INSERT ... ON CONFLICT DO NOTHING`, or a `DELETE`) and only touches the
+denormalized counters (see counters.py), the trending counts (see
+trending.py), the stale marks of recommendations.py and, when enabled, the
+materialized timelines (see timeline.py) if a row actually changed. All
+of it runs in the caller's transaction; the caller commits.
+
+With `LIKE_WRITE_BEHIND_INTERVAL` above zero, `set_liked` hands likes and
+unlikes to `like_queue` (the current app's queue; `init_app` gives each
+app its own in `app.extensions`) instead. It keeps only the latest state of each
+(user, message) pair, so a burst of toggles becomes at most one change,
+and a background thread writes everything queued in one transaction every
+interval (or sooner once `LIKE_WRITE_BEHIND_MAX_PENDING` pairs are
+waiting). Until then a like is only visible to requests served by the same
+process, and one still queued when the process is killed is lost.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import delete, tuple_
+from sqlalchemy.exc import IntegrityError
+from werkzeug.local import LocalProxy
+
+from models import db, dialect_insert, Follow, Like
+from followgraph import follow_graph
+from trending import trending_likes
+import counters
+import recommendations
+import timeline
+
+logger = logging.getLogger('warbler.likes')
+
+DEFAULT_MAX_PENDING = 10000
+
+def _insert_new(model, rows):
+    """INSERT statement for `rows` that skips those already present."""
+
+    return dialect_insert(model).values(rows).on_conflict_do_nothing()
+
+
+def _delete_where(model, condition):
+    return (delete(model)
+            .where(condition)
+            .execution_options(synchronize_session=False))
+
+
+def follow(user_id, followed_id):
+    """Make `user_id` follow `followed_id`.
+
+    Returns False if they already did.
+    """
+
+    result = db.session.execute(_insert_new(Follow, [{
+        'user_following_id': user_id,
+        'user_being_followed_id': followed_id,
+    }]))
+
+    if result.rowcount != 1:
+        return False
+
+    counters.follow_changed(user_id, followed_id, 1)
+    follow_graph.changed(user_id, followed_id, True)
+    recommendations.mark_stale([user_id])
+
+    if timeline.timeline_enabled():
+        timeline.add_author_to_timeline(user_id, followed_id)
+
+    return True
+
+
+def unfollow(user_id, followed_id):
+    """Make `user_id` stop following `followed_id`.
+
+    Returns False if they weren't.
+    """
+
+    result = db.session.execute(_delete_where(
+        Follow,
+        (Follow.user_following_id == user_id)
+        & (Follow.user_being_followed_id == followed_id)))
+
+    if result.rowcount != 1:
+        return False
+
+    counters.follow_changed(user_id, followed_id, -1)
+    follow_graph.changed(user_id, followed_id, False)
+    recommendations.mark_stale([user_id])
+
+    if timeline.timeline_enabled():
+        timeline.remove_author_from_timeline(user_id, followed_id)
+
+    return True
+
+
+def apply_likes(changes):
+    """Write `{(user_id, message_id): liked}` with one statement per kind.
+
+    Callers check the messages aren't the users' own. Returns the number of
+    likes added or removed.
+    """
+
+    to_like = sorted(key for key, liked in changes.items() if liked)
+    to_unlike = sorted(key for key, liked in changes.items() if not liked)
+    added = removed = []
+
+    if to_like:
+        added = db.session.execute(
+            _insert_new(Like, [
+                {'user_liking_id': user_id, 'liked_message_id': message_id}
+                for user_id, message_id in to_like])
+            .returning(Like.user_liking_id, Like.liked_message_id)).all()
+
+    if to_unlike:
+        removed = db.session.execute(
+            _delete_where(
+                Like,
+                tuple_(Like.user_liking_id, Like.liked_message_id)
+                .in_(to_unlike))
+            .returning(Like.user_liking_id, Like.liked_message_id)).all()
+
+    user_deltas = Counter(user_id for user_id, message_id in added)
+    user_deltas.subtract(user_id for user_id, message_id in removed)
+    message_deltas = Counter(message_id for user_id, message_id in added)
+    message_deltas.subtract(message_id for user_id, message_id in removed)
+
+    # every user with a change, even if their likes and unlikes cancel out
+    for user_id, delta in user_deltas.items():
+        counters.like_changed(user_id, delta)
+
+    counters.message_likes_changed(message_deltas)
+    trending_likes.changed(message_deltas)
+    recommendations.mark_stale(
+        {user_id for user_id, message_id in added + removed})
+
+    return len(added) + len(removed)
+
+
+def like(user_id, message_id):
+    """Have `user_id` like a message; callers check it isn't their own.
+
+    Returns False if they already did.
+    """
+
+    return apply_likes({(user_id, message_id): True}) == 1
+
+
+def unlike(user_id, message_id):
+    """Have `user_id` stop liking a message.
+
+    Returns False if they didn't.
+    """
+
+    return apply_likes({(user_id, message_id): False}) == 1
+
+
+def set_liked(user_id, message_id, liked):
+    """Like or unlike a message now, or queue it if write-behind is on."""
+
+    if like_queue.enabled:
+        like_queue.put(user_id, message_id, liked)
+    else:
+        apply_likes({(user_id, message_id): liked})
+
+
+class WriteBehindQueue:
+    """Likes and unlikes waiting to be written in one batch."""
+
+    def __init__(self, app, interval=0, max_pending=DEFAULT_MAX_PENDING):
+        self.app = app
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread_pid = None
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def put(self, user_id, message_id, liked):
+        """Queue a like (liked=True) or unlike, replacing any queued one."""
+
+        self._start()
+
+        with self._lock:
+            self._pending[(user_id, message_id)] = liked
+            full = len(self._pending) >= self.max_pending
+
+        if full:
+            self._wakeup.set()
+
+    def pending_for(self, user_id):
+        """`{message_id: liked}` of `user_id`'s queued changes."""
+
+        with self._lock:
+            return {message_id: liked
+                    for (liker_id, message_id), liked in self._pending.items()
+                    if liker_id == user_id}
+
+    def flush(self):
+        """Write everything queued, in one transaction if possible.
+
+        If the batch fails (say, a message was deleted meanwhile), each
+        change is retried on its own and the ones that still fail are
+        dropped.
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return
+
+        with self.app.app_context():
+            try:
+                apply_likes(pending)
+                db.session.commit()
+                return
+            except IntegrityError:
+                db.session.rollback()
+
+            for key, liked in pending.items():
+                try:
+                    apply_likes({key: liked})
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback()
+                    logger.warning("Dropped queued like %s: %s", key, liked)
+
+    def _start(self):
+        """Start this process's writer thread if it isn't running."""
+
+        # a thread doesn't survive fork(); each worker starts its own
+        if self._thread_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._pending = {}
+                threading.Thread(
+                    target=self._run, name="like-writer", daemon=True).start()
+                atexit.register(self.flush)
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Writing queued likes failed")
+
+
+def init_app(app):
+    """Give `app` a like queue, set up from `LIKE_WRITE_BEHIND_INTERVAL`
+    (seconds; 0 is off).
+    """
+
+    app.extensions['like_queue'] = WriteBehindQueue(
+        app,
+        interval=app.config.get('LIKE_WRITE_BEHIND_INTERVAL', 0),
+        max_pending=app.config.get(
+            'LIKE_WRITE_BEHIND_MAX_PENDING', DEFAULT_MAX_PENDING))
+
+
+# the current app's `WriteBehindQueue`
+like_queue = LocalProxy(lambda: current_app.extensions['like_queue'])
@@ -0,0 +1,25 @@
+// Prepend messages pushed by /stream (see realtime.py) to the home feed.
+
+(function () {
+  const list = document.getElementById('messages');
+
+  if (!list || !window.EventSource) {
+    return;
+  }
+
+  const source = new EventSource('/stream');
+
+  source.addEventListener('message', function (event) {
+    const data = JSON.parse(event.data);
+
+    if (document.getElementById('message-' + data.id)) {
+      return;
+    }
+
+    const item = document.createElement('li');
+    item.className = 'list-group-item';
+    item.id = 'message-' + data.id;
+    item.innerHTML = data.html;
+    list.prepend(item);
+  });
+})();
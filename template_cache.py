@@ -0,0 +1,70 @@
+"""Compiled template caching for Warbler.
+
+Jinja compiles a template to Python the first time a process renders it,
+so after a deploy or a worker restart the first requests to each page pay
+for it. With `TEMPLATE_CACHE_DIR` set, compiled templates are kept there as
+bytecode, and a process finding a template's bytecode (for the same
+source) loads it instead of compiling.
+
+    flask precompile-templates
+
+fills the cache with everything under templates/, e.g. as a build step.
+Run it in the tree that will serve, with the same Python: entries are
+keyed by template path and only load in the Python version that wrote
+them. A template edited since is compiled and cached again on first use.
+
+`load_templates` also leaves every template compiled in the app's memory;
+gunicorn.conf.py calls it in the master, so preloaded workers are forked
+with them compiled.
+"""
+
+import os
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+def init_app(app):
+    """Keep compiled templates in `TEMPLATE_CACHE_DIR`, if it's set."""
+
+    directory = app.config.get('TEMPLATE_CACHE_DIR')
+
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def load_templates(app):
+    """Compile (or load from the bytecode cache) all of `app`'s templates.
+
+    Returns the number of templates.
+    """
+
+    names = app.jinja_env.list_templates()
+
+    for name in names:
+        app.jinja_env.get_template(name)
+
+    return len(names)
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_templates_command():
+    """Compile every template into TEMPLATE_CACHE_DIR."""
+
+    app = current_app._get_current_object()
+    bytecode_cache = app.jinja_env.bytecode_cache
+
+    if bytecode_cache is None:
+        raise click.UsageError("Set TEMPLATE_CACHE_DIR to precompile into.")
+
+    # drop entries of templates that no longer exist
+    bytecode_cache.clear()
+
+    num_templates = load_templates(app)
+    click.echo(
+        f"Compiled {num_templates} templates into "
+        f"{app.config['TEMPLATE_CACHE_DIR']}")
@@ -0,0 +1,192 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from timeline import rebuild_timelines
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        u1.following_count = 1
+        u2.followers_count = 1
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        m3 = Message(text="m3-text", user_id=u3.id)
+        db.session.add_all([m1, m2, m3])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+        self.m3_id = m3.id
+
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def test_login_required(self):
+        resp = app.test_client().get("/api/v1/feed")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.json, {"error": "Login required."})
+
+    def test_feed(self):
+        resp = self.client.get("/api/v1/feed")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            [item["id"] for item in resp.json["items"]],
+            [self.m2_id, self.m1_id])
+        self.assertEqual(resp.json["items"][0]["username"], "u2")
+        self.assertIsNone(resp.json["next"])
+
+    def test_feed_from_timeline(self):
+        app.config['TIMELINE_ENABLED'] = True
+
+        try:
+            rebuild_timelines(echo=lambda message: None)
+            resp = self.client.get("/api/v1/feed?fields=text")
+        finally:
+            app.config['TIMELINE_ENABLED'] = False
+
+        self.assertEqual(
+            resp.json["items"], [{"text": "m2-text"}, {"text": "m1-text"}])
+
+    def test_feed_pagination(self):
+        app.config['FEED_PAGE_SIZE'] = 1
+
+        try:
+            first = self.client.get("/api/v1/feed?fields=id")
+            second = self.client.get(
+                f"/api/v1/feed?fields=id&after={first.json['next']}")
+        finally:
+            app.config['FEED_PAGE_SIZE'] = 100
+
+        self.assertEqual(first.json["items"], [{"id": self.m2_id}])
+        self.assertEqual(second.json["items"], [{"id": self.m1_id}])
+        self.assertIsNotNone(second.json["prev"])
+        self.assertIsNone(second.json["next"])
+
+    def test_field_selection(self):
+        resp = self.client.get(
+            f"/api/v1/users/{self.u2_id}?fields=username,followers_count")
+
+        self.assertEqual(resp.json, {"username": "u2", "followers_count": 1})
+
+    def test_unknown_field(self):
+        resp = self.client.get(f"/api/v1/users/{self.u2_id}?fields=password")
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("password", resp.json["error"])
+
+    def test_show_message(self):
+        resp = self.client.get(f"/api/v1/messages/{self.m3_id}")
+
+        self.assertEqual(resp.json["text"], "m3-text")
+        self.assertEqual(resp.json["user_id"], self.u3_id)
+        self.assertIn("timestamp", resp.json)
+
+    def test_not_found(self):
+        resp = self.client.get("/api/v1/messages/0")
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("error", resp.json)
+
+    def test_user_messages(self):
+        resp = self.client.get(f"/api/v1/users/{self.u3_id}/messages")
+
+        self.assertEqual(
+            [item["text"] for item in resp.json["items"]], ["m3-text"])
+
+    def test_like_and_unlike(self):
+        resp = self.client.put(f"/api/v1/messages/{self.m3_id}/like")
+
+        self.assertEqual(resp.json, {"liked": True})
+        self.assertIsNotNone(db.session.get(
+            Like, {'user_liking_id': self.u1_id,
+                   'liked_message_id': self.m3_id}))
+        self.assertEqual(db.session.get(User, self.u1_id).likes_count, 1)
+
+        # liking twice changes nothing
+        self.client.put(f"/api/v1/messages/{self.m3_id}/like")
+        self.assertEqual(db.session.get(User, self.u1_id).likes_count, 1)
+
+        resp = self.client.delete(f"/api/v1/messages/{self.m3_id}/like")
+
+        self.assertEqual(resp.json, {"liked": False})
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(db.session.get(User, self.u1_id).likes_count, 0)
+
+    def test_like_own_message(self):
+        resp = self.client.put(f"/api/v1/messages/{self.m1_id}/like")
+
+        self.assertEqual(resp.status_code, 403)
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_follow_and_unfollow(self):
+        resp = self.client.put(f"/api/v1/users/{self.u3_id}/follow")
+
+        self.assertEqual(resp.json, {"following": True})
+        self.assertEqual(db.session.get(User, self.u1_id).following_count, 2)
+        self.assertEqual(db.session.get(User, self.u3_id).followers_count, 1)
+
+        resp = self.client.delete(f"/api/v1/users/{self.u2_id}/follow")
+
+        self.assertEqual(resp.json, {"following": False})
+        self.assertEqual(
+            db.session.get(User, self.u1_id).get_following_ids(),
+            {self.u3_id})
+        self.assertEqual(db.session.get(User, self.u2_id).followers_count, 0)
+
+    def test_follow_self(self):
+        resp = self.client.put(f"/api/v1/users/{self.u1_id}/follow")
+        self.assertEqual(resp.status_code, 403)
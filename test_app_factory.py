@@ -0,0 +1,97 @@
+"""Application factory tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_app_factory.py
+
+
+import os
+from unittest import TestCase
+
+from flask import has_app_context
+from sqlalchemy import event, select
+from sqlalchemy.engine import Engine
+
+from models import db, dispose_engines
+from cache import user_cache
+from followgraph import follow_graph
+import social
+
+# BEFORE we build an app, let's set an environmental variable
+# to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import create_app
+
+
+class CreateAppTestCase(TestCase):
+    def setUp(self):
+        self.connections = 0
+        event.listen(Engine, "connect", self.count_connection)
+
+    def tearDown(self):
+        event.remove(Engine, "connect", self.count_connection)
+
+    def count_connection(self, dbapi_connection, connection_record):
+        self.connections += 1
+
+    def test_config_overrides(self):
+        app = create_app({'FEED_PAGE_SIZE': 7, 'TESTING': True})
+
+        self.assertEqual(app.config['FEED_PAGE_SIZE'], 7)
+        self.assertEqual(app.config['USERS_PAGE_SIZE'], 48)
+
+    def test_no_connection_until_needed(self):
+        app = create_app()
+
+        self.assertEqual(self.connections, 0)
+        self.assertFalse(has_app_context())
+
+        with app.app_context():
+            db.session.execute(select(1))
+
+        self.assertEqual(self.connections, 1)
+
+    def test_app_context_per_request(self):
+        app = create_app()
+
+        with app.test_client() as client:
+            self.assertEqual(client.get("/login").status_code, 200)
+            self.assertTrue(has_app_context())
+
+        # popped along with the request
+        self.assertFalse(has_app_context())
+
+    def test_dispose_engines(self):
+        app = create_app()
+
+        with app.app_context():
+            db.session.execute(select(1))
+            pool = db.engine.pool
+
+        dispose_engines(app)
+
+        with app.app_context():
+            self.assertIsNot(db.engine.pool, pool)
+
+    def test_apps_keep_their_own_state(self):
+        first = create_app(
+            {'FOLLOW_GRAPH_ENABLED': True, 'LIKE_WRITE_BEHIND_INTERVAL': 5})
+        second = create_app()
+
+        with first.app_context():
+            first_backend = user_cache.backend
+
+            self.assertTrue(follow_graph.enabled)
+            self.assertEqual(social.like_queue.interval, 5)
+
+        with second.app_context():
+            self.assertIsNot(user_cache.backend, first_backend)
+            self.assertFalse(follow_graph.enabled)
+            self.assertFalse(social.like_queue.enabled)
+
+        # building the second app left the first one alone
+        with first.app_context():
+            self.assertIs(user_cache.backend, first_backend)
+            self.assertTrue(follow_graph.enabled)
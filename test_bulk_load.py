@@ -0,0 +1,93 @@
+"""Synthetic data generator and bulk loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bulk_load.py
+
+
+import csv
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app
+from bulk_load import load_data
+from generator.synthetic import generate
+from search import search_users
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+UNTIL = datetime(2023, 6, 1)
+
+
+def quiet(line):
+    pass
+
+
+class BulkLoadTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Follow.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        self.data_dir = tempfile.TemporaryDirectory()
+
+        generate(self.data_dir.name, num_users=60, avg_followers=5,
+                 avg_messages=3, avg_likes=2, until=UNTIL, password_rounds=4,
+                 echo=quiet)
+
+    def tearDown(self):
+        db.session.rollback()
+        self.data_dir.cleanup()
+
+    def count_rows(self, filename):
+        with open(os.path.join(self.data_dir.name, filename)) as file:
+            return sum(1 for row in csv.reader(file)) - 1
+
+    def test_generate_is_repeatable(self):
+        with tempfile.TemporaryDirectory() as other_dir:
+            generate(other_dir, num_users=60, avg_followers=5,
+                     avg_messages=3, avg_likes=2, until=UNTIL,
+                     password_rounds=4, echo=quiet)
+
+            for filename in ('messages.csv', 'follows.csv', 'likes.csv'):
+                with open(os.path.join(self.data_dir.name, filename)) as a, \
+                        open(os.path.join(other_dir, filename)) as b:
+                    self.assertEqual(a.read(), b.read())
+
+    def test_load_data(self):
+        load_data(self.data_dir.name, chunk_size=25, echo=quiet)
+
+        self.assertEqual(User.query.count(), 60)
+        self.assertEqual(Message.query.count(),
+                         self.count_rows('messages.csv'))
+        self.assertEqual(Follow.query.count(), self.count_rows('follows.csv'))
+        self.assertEqual(Like.query.count(), self.count_rows('likes.csv'))
+
+        # counters and search index are rebuilt after loading
+        user = User.query.get(1)
+        self.assertEqual(user.followers_count, len(user.followers))
+        self.assertEqual(user.messages_count, len(user.messages))
+        self.assertIn(user, search_users(user.username, 10))
+
+        self.assertTrue(User.authenticate(user.username, "password"))
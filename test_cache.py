@@ -0,0 +1,144 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import LRUCache, InMemorySharedCache, SharedCache, user_cache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expires_after_ttl(self):
+        clock = FakeClock()
+        cache = LRUCache(ttl=10, clock=clock)
+        cache.set("a", 1)
+
+        clock.now = 9
+        self.assertEqual(cache.get("a"), 1)
+
+        clock.now = 10
+        self.assertIsNone(cache.get("a"))
+
+    def test_shared_stand_in_copies_values(self):
+        cache = InMemorySharedCache()
+        value = {"username": "u1"}
+        cache.set("a", value)
+        value["username"] = "changed"
+
+        self.assertEqual(cache.get("a"), {"username": "u1"})
+
+    def test_incomplete_shared_backend(self):
+        class NoClear(SharedCache):
+            def get(self, key):
+                return None
+
+            def set(self, key, value):
+                pass
+
+            def delete(self, key):
+                pass
+
+        with self.assertRaises(TypeError):
+            NoClear()
+
+
+class UserCacheTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_cached_user_is_usable(self):
+        user_cache.get_user(self.u1_id)
+        db.session.expunge_all()
+
+        user = user_cache.get_user(self.u1_id)
+
+        self.assertEqual(user.username, "u1")
+        self.assertIn(user, db.session)
+
+    def test_secrets_are_not_cached(self):
+        backend = InMemorySharedCache()
+        original, user_cache.backend = user_cache.backend, backend
+
+        try:
+            user_cache.get_user(self.u1_id)
+            db.session.expunge_all()
+
+            cached = backend.get(f"user:{self.u1_id}")
+            self.assertNotIn("password", cached)
+            self.assertNotIn("email", cached)
+
+            # still there when used, from the database
+            user = user_cache.get_user(self.u1_id)
+            self.assertEqual(user.email, "u1@email.com")
+        finally:
+            user_cache.backend = original
+
+    def test_profile_edit_invalidates(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post("/users/profile",
+                   data={"username": "renamed",
+                         "email": "u1@email.com",
+                         "password": "password"})
+
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("this is homepage and renamed is logged in", html)
@@ -0,0 +1,162 @@
+"""User counter column tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+import counters
+import purge
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterBaseTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add(m2)
+        db.session.commit()
+
+        counters.reconcile_counters(echo=lambda line: None)
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m2_id = m2.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def counts(self, user_id):
+        user = User.query.get(user_id)
+        db.session.refresh(user)
+
+        return (user.messages_count,
+                user.following_count,
+                user.followers_count,
+                user.likes_count)
+
+    def like_count(self, message_id):
+        msg = Message.query.get(message_id)
+        db.session.refresh(msg)
+
+        return msg.like_count
+
+
+class CounterUpdateTestCase(CounterBaseTestCase):
+    def test_add_and_delete_message(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post("/messages/new", data={"text": "Hello"})
+            self.assertEqual(self.counts(self.u1_id), (1, 0, 0, 0))
+
+            msg = Message.query.filter_by(text="Hello").one()
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+    def test_follow_and_unfollow(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 1, 0))
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+            self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_like_and_unlike(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+
+            c.post(f"/messages/{self.m2_id}/like",
+                   headers={"Referer": "/"})
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 1))
+            self.assertEqual(self.like_count(self.m2_id), 1)
+
+            c.post(f"/messages/{self.m2_id}/unlike",
+                   headers={"Referer": "/"})
+            self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+            self.assertEqual(self.like_count(self.m2_id), 0)
+
+    def test_delete_user(self):
+        with self.client as c:
+            self.login(c, self.u1_id)
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post(f"/messages/{self.m2_id}/like", headers={"Referer": "/"})
+
+            self.login(c, self.u2_id)
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post("/users/delete")
+
+        purge.purge_deleted_users(echo=lambda line: None)
+
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+
+class ReconcileCountersTestCase(CounterBaseTestCase):
+    def test_reconcile_counters(self):
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        m2 = Message.query.get(self.m2_id)
+
+        u1.following.append(u2)
+        u1.liked_messages.append(m2)
+        db.session.commit()
+
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0, 0))
+
+        counters.reconcile_counters(echo=lambda line: None)
+
+        self.assertEqual(self.counts(self.u1_id), (0, 1, 0, 1))
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 1, 0))
+
+    def test_reconcile_like_counts(self):
+        u1 = User.query.get(self.u1_id)
+        m2 = Message.query.get(self.m2_id)
+
+        u1.liked_messages.append(m2)
+        db.session.commit()
+
+        self.assertEqual(self.like_count(self.m2_id), 0)
+
+        counters.reconcile_like_counts(echo=lambda line: None)
+
+        self.assertEqual(self.like_count(self.m2_id), 1)
@@ -0,0 +1,247 @@
+"""In-process follow graph tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_followgraph.py
+
+
+import os
+import threading
+import time
+from unittest import TestCase
+
+from sqlalchemy import delete, insert, update
+
+from models import db, User, Message, Follow
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from followgraph import Adjacency, FollowGraph, intersect, follow_graph
+import followgraph
+import social
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AdjacencyTestCase(TestCase):
+    def setUp(self):
+        self.lists = Adjacency.from_sorted_pairs(
+            [(1, 2), (1, 5), (1, 9), (4, 1)])
+
+    def test_neighbours(self):
+        self.assertEqual(list(self.lists.neighbours(1)), [2, 5, 9])
+        self.assertEqual(list(self.lists.neighbours(2)), [])
+        self.assertEqual(list(self.lists.neighbours(4)), [1])
+        self.assertEqual(list(self.lists.neighbours(100)), [])
+        self.assertEqual(self.lists.degree(1), 3)
+
+    def test_contains(self):
+        self.assertTrue(self.lists.contains(1, 5))
+        self.assertFalse(self.lists.contains(1, 4))
+        self.assertFalse(self.lists.contains(3, 1))
+
+    def test_add_and_remove(self):
+        self.lists.add(1, 3)
+        self.lists.add(7, 1)
+        self.lists.remove(1, 9)
+
+        self.assertEqual(list(self.lists.neighbours(1)), [2, 3, 5])
+        self.assertEqual(list(self.lists.neighbours(7)), [1])
+        self.assertEqual(list(self.lists.targets), [2, 5, 9, 1])
+
+    def test_intersect(self):
+        self.assertEqual(intersect([1, 3, 5, 7], [2, 3, 4, 7, 8]), [3, 7])
+        self.assertEqual(intersect([], [1, 2]), [])
+
+
+class FollowGraphTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+        user_cache.clear()
+
+        users = [User.signup(f"u{n}", f"u{n}@email.com", "password", None)
+                 for n in range(4)]
+        db.session.flush()
+
+        self.ids = [user.id for user in users]
+        u0, u1, u2, u3 = self.ids
+
+        # u0 <-> u1, u0 -> u2, u1 -> u3, u2 -> u3
+        for follower, followed in [(u0, u1), (u1, u0), (u0, u2),
+                                   (u1, u3), (u2, u3)]:
+            social.follow(follower, followed)
+
+        db.session.commit()
+
+        self.graph = FollowGraph()
+        self.graph.enabled = True
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_queries(self):
+        u0, u1, u2, u3 = self.ids
+
+        self.assertTrue(self.graph.follows(u0, u2))
+        self.assertFalse(self.graph.follows(u2, u0))
+        self.assertEqual(list(self.graph.following(u0)), sorted([u1, u2]))
+        self.assertEqual(list(self.graph.followers(u3)), sorted([u1, u2]))
+        self.assertEqual(self.graph.followers_count(u3), 2)
+        self.assertEqual(self.graph.following_count(u3), 0)
+        self.assertEqual(self.graph.mutuals(u0), [u1])
+
+    def test_two_hops(self):
+        u0, u1, u2, u3 = self.ids
+
+        self.assertEqual(self.graph.following_of_following(u0), {u3: 2})
+        self.assertEqual(self.graph.followers_of_followers(u2), {u1: 1})
+
+    def test_applies_committed_changes(self):
+        u0, u1, u2, u3 = self.ids
+        was_enabled = follow_graph.enabled
+
+        follow_graph.enabled = True
+        follow_graph.build()
+
+        try:
+            social.follow(u3, u0)
+            social.unfollow(u0, u1)
+
+            # nothing changes until the commit
+            self.assertFalse(follow_graph.follows(u3, u0))
+
+            db.session.commit()
+
+            self.assertTrue(follow_graph.follows(u3, u0))
+            self.assertFalse(follow_graph.follows(u0, u1))
+            self.assertEqual(list(follow_graph.followers(u1)), [])
+
+            social.follow(u2, u0)
+            db.session.rollback()
+
+            self.assertFalse(follow_graph.follows(u2, u0))
+        finally:
+            follow_graph.enabled = was_enabled
+
+    def test_homepage_reads_following_from_graph(self):
+        u0, u1, u2, u3 = self.ids
+        db.session.add(Message(text="from-u3", user_id=u3))
+        db.session.add(Message(text="from-u1", user_id=u1))
+        db.session.commit()
+
+        app.config['FOLLOW_GRAPH_ENABLED'] = True
+        followgraph.init_app(app)
+
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = u1
+
+                html = c.get("/").get_data(as_text=True)
+                following_ids = set(follow_graph.following(u1))
+        finally:
+            app.config['FOLLOW_GRAPH_ENABLED'] = False
+            followgraph.init_app(app)
+
+        self.assertEqual(following_ids, {u0, u3})
+        self.assertIn("from-u3", html)
+        self.assertIn("from-u1", html)
+
+    def test_stale_graph_is_rebuilt_in_background(self):
+        u0, u1, u2, u3 = self.ids
+        graph = FollowGraph(app, enabled=True, ttl=3600)
+        graph.build()
+
+        built = threading.Event()
+        build = graph.build
+
+        def build_when_told():
+            built.wait(5)
+            build()
+
+        graph.build = build_when_told
+
+        with db.engine.begin() as conn:
+            conn.execute(insert(Follow).values(
+                user_following_id=u3, user_being_followed_id=u0))
+
+        graph.built_at -= 3600
+        built_at = graph.built_at
+
+        # the old graph answers while the new one is built
+        self.assertFalse(graph.follows(u3, u0))
+
+        built.set()
+        deadline = time.monotonic() + 5
+
+        while graph.built_at == built_at and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertTrue(graph.follows(u3, u0))
+
+    def test_versioned_following(self):
+        u0, u1, u2, u3 = self.ids
+
+        self.graph.build()
+        version, following = self.graph.versioned_following(u0)
+
+        self.assertEqual(version, db.session.get(User, u0).graph_version)
+        self.assertEqual(list(following), sorted([u1, u2]))
+
+    def test_homepage_skips_graph_behind_other_process(self):
+        u0, u1, u2, u3 = self.ids
+        db.session.add(Message(text="from-u2", user_id=u2))
+        db.session.add(Message(text="from-u3", user_id=u3))
+        db.session.commit()
+
+        app.config['FOLLOW_GRAPH_ENABLED'] = True
+        followgraph.init_app(app)
+
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = u0
+
+                # builds the graph and caches u0
+                self.assertIn("from-u2", c.get("/").get_data(as_text=True))
+
+            # another process swaps u0's u2 for u3 on its own connection:
+            # same number followed, and nothing here hears of it
+            with db.engine.begin() as conn:
+                conn.execute(insert(Follow).values(
+                    user_following_id=u0, user_being_followed_id=u3))
+                conn.execute(delete(Follow).where(
+                    (Follow.user_following_id == u0)
+                    & (Follow.user_being_followed_id == u2)))
+                conn.execute(update(User).where(User.id == u0).values(
+                    graph_version=User.graph_version + 2))
+
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = u0
+
+                html = c.get("/").get_data(as_text=True)
+        finally:
+            app.config['FOLLOW_GRAPH_ENABLED'] = False
+            followgraph.init_app(app)
+
+        self.assertIn("from-u3", html)
+        self.assertNotIn("from-u2", html)
@@ -0,0 +1,130 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import update
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from fragments import message_fragments
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        user_cache.clear()
+        message_fragments.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def get_homepage(self, user_id):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            return c.get("/").get_data(as_text=True)
+
+    def edit_text_behind_cache(self, text):
+        db.session.execute(
+            update(Message).where(Message.id == self.m1_id).values(text=text))
+        db.session.commit()
+
+    def test_fragment_reused(self):
+        self.assertIn("m1-text", self.get_homepage(self.u1_id))
+
+        # a change the cache doesn't know about isn't rendered
+        self.edit_text_behind_cache("changed-text")
+
+        html = self.get_homepage(self.u1_id)
+        self.assertIn("m1-text", html)
+        self.assertNotIn("changed-text", html)
+
+    def test_like_button_stays_live(self):
+        self.assertIn('bi-star ', self.get_homepage(self.u1_id))
+
+        with self.client as c:
+            c.post(f"/messages/{self.m1_id}/like", headers={"Referer": "/"})
+
+        html = self.get_homepage(self.u1_id)
+        self.assertIn("bi-star-fill", html)
+        self.assertIn(f"/messages/{self.m1_id}/unlike", html)
+
+        # the author sees their own message without a like button
+        self.assertNotIn("/like", self.get_homepage(self.u2_id))
+
+    def test_author_edit_rerenders(self):
+        self.get_homepage(self.u1_id)
+        self.edit_text_behind_cache("changed-text")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            c.post("/users/profile", data={"username": "u2-renamed",
+                                           "email": "u2@email.com",
+                                           "password": "password"})
+
+        html = self.get_homepage(self.u1_id)
+        self.assertIn("@u2-renamed", html)
+        self.assertIn("changed-text", html)
+
+    def test_delete_invalidates(self):
+        self.get_homepage(self.u1_id)
+        self.assertIsNotNone(
+            message_fragments.backend.get(f"message:{self.m1_id}"))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            c.post(f"/messages/{self.m1_id}/delete")
+
+        self.assertIsNone(
+            message_fragments.backend.get(f"message:{self.m1_id}"))
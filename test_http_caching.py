@@ -0,0 +1,251 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_http_caching.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from instrumentation import QueryCounter
+import social
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StaticCachingTestCase(TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_fingerprinted_static_urls(self):
+        html = self.client.get("/login").get_data(as_text=True)
+        match = re.search(r'/static/stylesheets/style\.css\?v=(\w+)', html)
+
+        self.assertIsNotNone(match)
+
+        resp = self.client.get(match.group(0))
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.immutable)
+        self.assertEqual(resp.cache_control.max_age, 365 * 24 * 60 * 60)
+        resp.close()
+
+    def test_unfingerprinted_static_revalidates(self):
+        resp = self.client.get("/static/stylesheets/style.css")
+
+        self.assertTrue(resp.cache_control.no_cache)
+        self.assertFalse(resp.cache_control.immutable)
+        resp.close()
+
+    def test_pages_not_stored_by_default(self):
+        resp = self.client.get("/login")
+        self.assertTrue(resp.cache_control.no_store)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def revisit(self, c, url):
+        etag = c.get(url).headers["ETag"]
+        return c.get(url, headers={"If-None-Match": etag})
+
+    def test_profile_not_modified(self):
+        with self.client as c:
+            self.login(c)
+
+            first = c.get(f"/users/{self.u2_id}")
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.cache_control.private)
+            self.assertTrue(first.cache_control.no_cache)
+
+            with QueryCounter() as counter:
+                resp = c.get(f"/users/{self.u2_id}",
+                             headers={"If-None-Match": first.headers["ETag"]})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b"")
+            self.assertEqual(resp.headers["ETag"], first.headers["ETag"])
+
+            # user, latest message and viewer lookups only
+            self.assertLessEqual(counter.count, 3)
+
+    def test_new_message_changes_profile(self):
+        with self.client as c:
+            self.login(c)
+            etag = c.get(f"/users/{self.u2_id}").headers["ETag"]
+
+            db.session.add(Message(text="m2-text", user_id=self.u2_id))
+            db.session.commit()
+
+            resp = c.get(f"/users/{self.u2_id}",
+                         headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("m2-text", resp.get_data(as_text=True))
+
+    def test_follow_changes_message_page(self):
+        url = f"/messages/{self.m1_id}"
+
+        with self.client as c:
+            self.login(c)
+            self.assertEqual(self.revisit(c, url).status_code, 304)
+
+            etag = c.get(url).headers["ETag"]
+            c.post(f"/users/follow/{self.u2_id}")
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+    def add_u3(self):
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        return u3.id
+
+    def test_follow_and_unfollow_change_message_page(self):
+        u3_id = self.add_u3()
+        social.follow(self.u1_id, u3_id)
+        social.follow(u3_id, self.u2_id)
+        db.session.commit()
+
+        url = f"/messages/{self.m1_id}"
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(url).headers["ETag"]
+
+            # u1 follows u2 instead of u3, and u3 drops u2: every count on
+            # the page comes out the same
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post(f"/users/stop-following/{u3_id}")
+            social.unfollow(u3_id, self.u2_id)
+            db.session.commit()
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Unfollow", resp.get_data(as_text=True))
+
+    def test_like_and_unlike_change_message_page(self):
+        u3_id = self.add_u3()
+        m2 = Message(text="m2-text", user_id=self.u2_id)
+        db.session.add(m2)
+        db.session.flush()
+        social.like(self.u1_id, m2.id)
+        social.like(u3_id, self.m1_id)
+        db.session.commit()
+        m2_id = m2.id
+
+        url = f"/messages/{self.m1_id}"
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(url).headers["ETag"]
+
+            # u1 likes m1 instead of m2, and u3 unlikes m1: every count on
+            # the page comes out the same
+            c.post(f"/messages/{self.m1_id}/like")
+            c.post(f"/messages/{m2_id}/unlike")
+            social.unlike(u3_id, self.m1_id)
+            db.session.commit()
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'action="/messages/{self.m1_id}/unlike"',
+                          resp.get_data(as_text=True))
+
+    def test_queued_like_changes_message_page(self):
+        url = f"/messages/{self.m1_id}"
+        original = app.extensions['like_queue']
+        app.extensions['like_queue'] = social.WriteBehindQueue(
+            app, interval=3600)
+
+        try:
+            with self.client as c:
+                self.login(c)
+                etag = c.get(url).headers["ETag"]
+
+                c.post(f"/messages/{self.m1_id}/like")
+
+                resp = c.get(url, headers={"If-None-Match": etag})
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn(f'action="/messages/{self.m1_id}/unlike"',
+                              resp.get_data(as_text=True))
+
+                self.assertEqual(self.revisit(c, url).status_code, 304)
+        finally:
+            app.extensions['like_queue'] = original
+
+    def test_viewer_specific(self):
+        url = f"/messages/{self.m1_id}"
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(url).headers["ETag"]
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_pending_flash_renders_page(self):
+        url = f"/users/{self.u2_id}"
+
+        with self.client as c:
+            self.login(c)
+            etag = c.get(url).headers["ETag"]
+
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [("success", "Hello!")]
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Hello!", resp.get_data(as_text=True))
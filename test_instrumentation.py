@@ -0,0 +1,172 @@
+"""Request instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_instrumentation.py
+
+
+import json
+import os
+import re
+import time
+from unittest import TestCase, mock
+
+from flask import g, render_template_string
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# /metrics and the Server-Timing header are off unless asked for
+
+os.environ['METRICS_ENDPOINT_ENABLED'] = "true"
+os.environ['SERVER_TIMING_HEADER'] = "true"
+
+# Now we can import app
+
+from app import create_app
+from testing import app, CURR_USER_KEY
+from instrumentation import QueryCounter, RequestMetrics, registry
+from cache import user_cache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        user_cache.clear()
+        registry.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_server_timing_header(self):
+        with self.client as c:
+            self.login(c)
+
+            with QueryCounter() as counter:
+                resp = c.get(f"/users/{self.u1_id}")
+
+        timing = resp.headers["Server-Timing"]
+
+        self.assertIn(f'desc="{counter.count} queries"', timing)
+        self.assertRegex(timing, r'tpl;dur=[\d.]+')
+        self.assertRegex(timing, r'total;dur=[\d.]+')
+        self.assertNotIn("bcrypt", timing)
+
+    def test_bcrypt_timed_on_login(self):
+        with self.client as c:
+            resp = c.post("/login", data={"username": "u1",
+                                          "password": "password"})
+
+        self.assertRegex(resp.headers["Server-Timing"], r'bcrypt;dur=[\d.]+')
+
+    def test_request_logged(self):
+        with self.client as c:
+            self.login(c)
+
+            with self.assertLogs('warbler.requests', level='INFO') as logs:
+                c.get("/users")
+
+        line = json.loads(logs.records[-1].getMessage())
+
+        self.assertEqual(line["endpoint"], "views.list_users")
+        self.assertEqual(line["status"], 200)
+        self.assertGreater(line["sql_count"], 0)
+        self.assertGreater(line["template_ms"], 0)
+
+    def test_metrics_endpoint(self):
+        with self.client as c:
+            self.login(c)
+            c.get("/users")
+            c.get("/users")
+
+            resp = c.get("/metrics")
+
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("# TYPE warbler_request_duration_seconds histogram",
+                      text)
+        self.assertIn(
+            'warbler_request_duration_seconds_count'
+            '{endpoint="views.list_users"} 2',
+            text)
+        self.assertTrue(re.search(
+            r'warbler_request_sql_statements_bucket'
+            r'\{endpoint="views.list_users",le="\+Inf"\} 2', text))
+
+    def test_metrics_token(self):
+        app.config['METRICS_TOKEN'] = "secret"
+
+        try:
+            with self.client as c:
+                self.assertEqual(c.get("/metrics").status_code, 403)
+
+                resp = c.get(
+                    "/metrics", headers={"Authorization": "Bearer secret"})
+                self.assertEqual(resp.status_code, 200)
+        finally:
+            app.config['METRICS_TOKEN'] = None
+
+    def test_off_by_default(self):
+        with mock.patch.dict(os.environ):
+            del os.environ['METRICS_ENDPOINT_ENABLED']
+            del os.environ['SERVER_TIMING_HEADER']
+            default_app = create_app()
+
+        with default_app.test_client() as c:
+            resp = c.get("/login")
+
+            self.assertNotIn("Server-Timing", resp.headers)
+            self.assertEqual(c.get("/metrics").status_code, 404)
+
+    def test_nested_render_is_timed(self):
+        def inner():
+            html = render_template_string("inner")
+            time.sleep(0.05)
+            return html
+
+        with app.test_request_context():
+            metrics = g.request_metrics = RequestMetrics()
+            render_template_string("{{ inner() }}", inner=inner)
+
+        self.assertGreaterEqual(metrics.timings['tpl'], 0.05)
+
+    def test_apps_keep_their_own_metrics(self):
+        other_app = create_app()
+
+        with other_app.test_client() as c:
+            c.get("/login")
+
+        with self.client as c:
+            self.login(c)
+            text = c.get("/metrics").get_data(as_text=True)
+
+        self.assertNotIn('endpoint="views.login"', text)
@@ -9,6 +9,7 @@ import os
 from unittest import TestCase
 
 from models import db, Message, User
+from instrumentation import QueryCounter
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -19,7 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from testing import app, CURR_USER_KEY
 
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -61,6 +62,7 @@ class MessageBaseViewTestCase(TestCase):
 
     def tearDown(self):
         db.session.rollback()
+        db.session.expunge_all()
 
 
 class MessageAddViewTestCase(MessageBaseViewTestCase):
@@ -111,6 +113,68 @@ class DeleteMessageTestCase(MessageBaseViewTestCase):
                 self.assertIn("m2-text", html)
                 self.assertIn("Access unauthorized.", html)
 
+class MessageListQueryCountTestCase(MessageBaseViewTestCase):
+    """Message lists should load their authors in a fixed number of queries,
+    however many messages (and authors) are on the page."""
+
+    def setUp(self):
+        super().setUp()
+        self.num_authors = 0
+        self.add_authors(5)
+
+    def add_authors(self, num_authors):
+        """Have u1 follow `num_authors` more authors and like a message by
+        as many others."""
+
+        u1 = User.query.get(self.u1_id)
+
+        for i in range(self.num_authors, self.num_authors + num_authors):
+            followed = User.signup(f"a{i}", f"a{i}@email.com", "password", None)
+            liked = User.signup(f"b{i}", f"b{i}@email.com", "password", None)
+            db.session.flush()
+
+            u1.following.append(followed)
+            db.session.add(Message(text=f"a{i}-text", user_id=followed.id))
+            u1.liked_messages.append(
+                Message(text=f"b{i}-text", user_id=liked.id))
+
+        db.session.commit()
+        self.num_authors += num_authors
+
+    def get_counting_queries(self, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            # warm the session-user cache, then start from an empty
+            # identity map, as a fresh request would
+            c.get(url)
+            db.session.expunge_all()
+
+            with QueryCounter() as counter:
+                resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            return counter.count
+
+    def assert_constant_query_count(self, url):
+        """Twice the messages and authors take no more queries."""
+
+        num_queries = self.get_counting_queries(url)
+        self.add_authors(self.num_authors)
+
+        self.assertEqual(self.get_counting_queries(url), num_queries)
+
+    def test_homepage_query_count(self):
+        self.assert_constant_query_count("/")
+
+    def test_liked_messages_query_count(self):
+        self.assert_constant_query_count(f"/users/{self.u1_id}/likes")
+
+    def test_show_message_query_count(self):
+        self.assert_constant_query_count(f"/messages/{self.m2_id}")
+
+
 # class LikeMessageTestCase(MessageBaseViewTestCase):
 #      def test_like_own_message(self):
 #         with self.client as c:
@@ -0,0 +1,138 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase, skipUnless
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app
+import migrations
+
+# The tables as they were before migrations existed
+
+baseline = db.MetaData()
+
+db.Table(
+    'users', baseline,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('email', db.String(50), nullable=False, unique=True),
+    db.Column('username', db.String(30), nullable=False, unique=True),
+    db.Column('image_url', db.String(255), nullable=False),
+    db.Column('header_image_url', db.String(255), nullable=False),
+    db.Column('bio', db.Text, nullable=False),
+    db.Column('location', db.String(30), nullable=False),
+    db.Column('password', db.String(100), nullable=False),
+)
+
+db.Table(
+    'follows', baseline,
+    db.Column('user_being_followed_id', db.Integer,
+              db.ForeignKey('users.id', ondelete="cascade"), primary_key=True),
+    db.Column('user_following_id', db.Integer,
+              db.ForeignKey('users.id', ondelete="cascade"), primary_key=True),
+)
+
+db.Table(
+    'messages', baseline,
+    db.Column('id', db.Integer, primary_key=True),
+    db.Column('text', db.String(140), nullable=False),
+    db.Column('timestamp', db.DateTime, nullable=False),
+    db.Column('user_id', db.Integer,
+              db.ForeignKey('users.id', ondelete="cascade"), nullable=False),
+)
+
+db.Table(
+    'likes', baseline,
+    db.Column('liked_message_id', db.Integer,
+              db.ForeignKey('messages.id', ondelete="cascade"),
+              primary_key=True),
+    db.Column('user_liking_id', db.Integer,
+              db.ForeignKey('users.id', ondelete="cascade"), primary_key=True),
+)
+
+
+class UpgradeTestCase(TestCase):
+    def setUp(self):
+        db.session.remove()
+        db.drop_all()
+        baseline.create_all(db.engine)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def test_upgrade_baseline_database(self):
+        migrations.upgrade(echo=lambda line: None)
+
+        inspector = inspect(db.engine)
+        user_columns = {col['name'] for col in inspector.get_columns('users')}
+        message_indexes = {ix['name'] for ix in inspector.get_indexes('messages')}
+        follow_indexes = {ix['name'] for ix in inspector.get_indexes('follows')}
+
+        self.assertIn('followers_count', user_columns)
+        self.assertIn('ix_messages_user_id_timestamp', message_indexes)
+        self.assertIn('ix_follows_user_following_id', follow_indexes)
+        self.assertTrue(inspector.has_table('timeline_entries'))
+
+        self.assertEqual(
+            migrations.applied_versions(db.engine),
+            {version for version, fn in migrations.MIGRATIONS})
+
+    def test_upgrade_is_repeatable(self):
+        migrations.upgrade(echo=lambda line: None)
+
+        applied = []
+        migrations.upgrade(echo=applied.append)
+
+        self.assertEqual(applied, [])
+
+
+@skipUnless(db.engine.dialect.name == 'postgresql', "PostgreSQL only")
+class InvalidIndexTestCase(TestCase):
+    def setUp(self):
+        self.table = db.Table(
+            'index_test', db.MetaData(), db.Column('x', db.Integer))
+        self.table.create(db.engine)
+
+    def tearDown(self):
+        self.table.drop(db.engine)
+
+    def test_invalid_index_is_rebuilt(self):
+        index = db.Index('ix_index_test_x', self.table.c.x, unique=True)
+
+        with db.engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(self.table.insert(), [{'x': 1}, {'x': 1}])
+
+            # fails on the duplicate, leaving an INVALID index behind
+            with self.assertRaises(IntegrityError):
+                conn.execute(text(
+                    "CREATE UNIQUE INDEX CONCURRENTLY ix_index_test_x"
+                    " ON index_test (x)"))
+
+            conn.execute(self.table.delete().where(self.table.c.x == 1))
+
+        migrations.create_index_if_missing(db.engine, index)
+
+        with db.engine.connect() as conn:
+            self.assertTrue(conn.scalar(text(
+                "SELECT indisvalid FROM pg_index"
+                " WHERE indexrelid = to_regclass('ix_index_test_x')")))
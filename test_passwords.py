@@ -0,0 +1,116 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app
+import passwords
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PasswordHashingTestCase(TestCase):
+    def setUp(self):
+        self.config = dict(app.config)
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+    def tearDown(self):
+        passwords.shutdown()
+        app.config.clear()
+        app.config.update(self.config)
+
+    def test_hash_and_check(self):
+        hashed = passwords.hash_password("password")
+
+        self.assertTrue(hashed.startswith("$2b$04$"))
+        self.assertTrue(passwords.check_password(hashed, "password"))
+        self.assertFalse(passwords.check_password(hashed, "wrong"))
+        self.assertFalse(passwords.check_password("not a hash", "password"))
+
+    def test_empty_password(self):
+        with self.assertRaises(ValueError):
+            passwords.hash_password("")
+
+    def test_needs_rehash(self):
+        hashed = passwords.hash_password("password")
+        self.assertFalse(passwords.needs_rehash(hashed))
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.assertTrue(passwords.needs_rehash(hashed))
+        self.assertTrue(passwords.needs_rehash("not a hash"))
+
+    def test_process_pool(self):
+        app.config['PASSWORD_HASH_WORKERS'] = 1
+
+        hashed = passwords.hash_password("password")
+
+        self.assertIsNotNone(passwords._pool)
+        self.assertTrue(passwords.check_password(hashed, "password"))
+        self.assertFalse(passwords.check_password(hashed, "wrong"))
+
+
+class PasswordRehashTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        self.config = dict(app.config)
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config.clear()
+        app.config.update(self.config)
+
+    def test_login_upgrades_hash(self):
+        with self.client as c:
+            resp = c.post("/login", data={"username": "u1",
+                                          "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+        db.session.expire_all()
+        hashed = User.query.get(self.u1_id).password
+
+        self.assertTrue(hashed.startswith("$2b$05$"))
+        self.assertTrue(passwords.check_password(hashed, "password"))
+
+    def test_failed_login_keeps_hash(self):
+        with self.client as c:
+            c.post("/login", data={"username": "u1", "password": "wrong"})
+
+        db.session.expire_all()
+        hashed = User.query.get(self.u1_id).password
+
+        self.assertTrue(hashed.startswith("$2b$04$"))
@@ -0,0 +1,219 @@
+"""Account deletion and purge tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_purge.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, UserSearchTerm
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from search import index_message, index_user, search_messages
+import purge
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class PurgeTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        m2 = Message(text="m2-text", user_id=u1.id)
+        m3 = Message(text="m3-text", user_id=u2.id)
+        db.session.add_all([m1, m2, m3])
+        db.session.flush()
+
+        # u1 and u2 follow each other and like each other's messages
+        db.session.add_all([
+            Follow(user_following_id=u1.id, user_being_followed_id=u2.id),
+            Follow(user_following_id=u2.id, user_being_followed_id=u1.id),
+            Like(user_liking_id=u1.id, liked_message_id=m3.id),
+            Like(user_liking_id=u2.id, liked_message_id=m1.id),
+            Like(user_liking_id=u2.id, liked_message_id=m2.id),
+        ])
+        u1.messages_count = 2
+        u2.messages_count = 1
+        u1.following_count = u1.followers_count = 1
+        u2.following_count = u2.followers_count = 1
+        u1.likes_count = 1
+        u2.likes_count = 2
+        m1.like_count = m2.like_count = m3.like_count = 1
+
+        index_user(u1)
+        index_message(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+        self.m3_id = m3.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def delete_u1(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        self.client.post("/users/delete")
+
+    def test_deleted_user_is_hidden(self):
+        self.delete_u1()
+
+        self.assertIsNotNone(db.session.get(User, self.u1_id).deleted_at)
+        self.assertFalse(User.authenticate("u1", "password"))
+        self.assertEqual(
+            UserSearchTerm.query.filter_by(user_id=self.u1_id).count(), 0)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        self.assertEqual(
+            self.client.get(f"/users/{self.u1_id}").status_code, 404)
+        self.assertEqual(
+            self.client.get(f"/messages/{self.m1_id}").status_code, 404)
+        self.assertNotIn(
+            "@u1", self.client.get("/users").get_data(as_text=True))
+
+    def log_in_u2(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+    def test_deleted_users_messages_leave_homepage(self):
+        self.delete_u1()
+        self.log_in_u2()
+
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertIn("m3-text", html)
+        self.assertNotIn("m1-text", html)
+
+    def test_deleted_users_messages_leave_api_feed(self):
+        self.delete_u1()
+        self.log_in_u2()
+
+        resp = self.client.get("/api/v1/feed?fields=id")
+
+        self.assertEqual(resp.json["items"], [{"id": self.m3_id}])
+
+    def test_deleted_users_message_is_gone_from_api(self):
+        self.delete_u1()
+        self.log_in_u2()
+
+        self.assertEqual(
+            self.client.get(f"/api/v1/messages/{self.m1_id}").status_code,
+            404)
+
+    def test_deleted_users_messages_leave_search(self):
+        self.delete_u1()
+
+        self.assertEqual(list(search_messages("m1", 10)), [])
+
+    def test_deleted_users_messages_cant_be_liked(self):
+        self.delete_u1()
+        self.log_in_u2()
+
+        self.assertEqual(
+            self.client.post(f"/messages/{self.m1_id}/unlike").status_code,
+            404)
+        self.assertEqual(
+            self.client.post(f"/messages/{self.m1_id}/like").status_code, 404)
+        self.assertEqual(
+            self.client.delete(
+                f"/api/v1/messages/{self.m1_id}/like").status_code,
+            404)
+        self.assertEqual(
+            self.client.put(f"/api/v1/messages/{self.m1_id}/like").status_code,
+            404)
+        self.assertEqual(Like.query.filter_by(user_liking_id=self.u2_id)
+                         .count(), 2)
+
+    def test_deleted_users_messages_leave_likes_page(self):
+        self.delete_u1()
+        self.log_in_u2()
+
+        html = self.client.get(f"/users/{self.u2_id}/likes").get_data(
+            as_text=True)
+
+        self.assertNotIn("m1-text", html)
+
+    def test_deleted_user_is_logged_out_everywhere(self):
+        other_device = app.test_client()
+
+        with other_device.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        self.delete_u1()
+
+        resp = other_device.get(f"/users/{self.u2_id}")
+        self.assertEqual(resp.status_code, 302)
+
+    def test_purge(self):
+        self.delete_u1()
+
+        lines = []
+        num_purged = purge.purge_deleted_users(batch_size=1, echo=lines.append)
+
+        self.assertEqual(num_purged, 1)
+        self.assertIn(f"User {self.u1_id}: purged 2 messages", lines)
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(Message.query.count(), 1)
+        self.assertEqual(Follow.query.count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+
+        u2 = db.session.get(User, self.u2_id)
+        db.session.refresh(u2)
+
+        self.assertEqual(
+            (u2.messages_count, u2.following_count, u2.followers_count,
+             u2.likes_count),
+            (1, 0, 0, 0))
+        self.assertEqual(db.session.get(Message, self.m3_id).like_count, 0)
+
+    def test_purge_resumes(self):
+        self.delete_u1()
+
+        # as if the job stopped after one batch
+        purge._purge_messages(self.u1_id, 1)
+        db.session.commit()
+
+        purge.purge_deleted_users(echo=lambda line: None)
+
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(Message.query.count(), 1)
+
+        u2 = db.session.get(User, self.u2_id)
+        db.session.refresh(u2)
+        self.assertEqual(u2.likes_count, 0)
@@ -0,0 +1,147 @@
+"""Live feed (server-sent events) tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_realtime.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from realtime import Broker, LocalBroker, Realtime, realtime, user_channel
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LocalBrokerTestCase(TestCase):
+    def setUp(self):
+        self.broker = LocalBroker()
+
+    def test_publish_reaches_subscribed_channels(self):
+        subscription = self.broker.subscribe(["user:1", "user:2"])
+
+        self.broker.publish("user:2", {'id': 1})
+        self.broker.publish("user:3", {'id': 2})
+
+        self.assertEqual(subscription.get(timeout=0), {'id': 1})
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_close(self):
+        subscription = self.broker.subscribe(["user:1"])
+        self.assertEqual(self.broker.num_subscriptions, 1)
+
+        subscription.close()
+        self.broker.publish("user:1", {'id': 1})
+
+        self.assertEqual(self.broker.num_subscriptions, 0)
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_incomplete_broker(self):
+        class NoUnsubscribe(Broker):
+            def subscribe(self, channels):
+                pass
+
+            def publish(self, channel, data):
+                pass
+
+            @property
+            def num_subscriptions(self):
+                return 0
+
+        with self.assertRaises(TypeError):
+            NoUnsubscribe()
+
+
+class StreamTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.original = app.extensions['realtime']
+        app.extensions['realtime'] = Realtime(LocalBroker(), keepalive=0.01)
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+        app.extensions['realtime'] = self.original
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_posted_message_is_published_on_commit(self):
+        subscription = realtime.broker.subscribe([user_channel(self.u2_id)])
+        self.login(self.u2_id)
+
+        self.client.post("/messages/new", data={"text": "Live!"})
+
+        data = subscription.get(timeout=0)
+        self.assertIn("Live!", data['html'])
+
+        msg = Message(text="never", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.flush()
+        realtime.message_posted(msg)
+        db.session.rollback()
+
+        self.assertIsNone(subscription.get(timeout=0))
+
+    def test_stream(self):
+        self.login(self.u1_id)
+
+        resp = self.client.get("/stream", buffered=False)
+        chunks = iter(resp.response)
+
+        self.assertEqual(resp.mimetype, "text/event-stream")
+        self.assertIn(b"retry:", next(chunks))
+        self.assertEqual(next(chunks), b": keepalive\n\n")
+
+        realtime.broker.publish(user_channel(self.u2_id), {'id': 7})
+        self.assertEqual(
+            next(chunks), b'event: message\ndata: {"id": 7}\n\n')
+
+        resp.close()
+        self.assertEqual(realtime.broker.num_subscriptions, 0)
+
+    def test_stream_limits(self):
+        self.assertEqual(self.client.get("/stream").status_code, 401)
+
+        self.login(self.u1_id)
+        realtime.max_connections = 0
+
+        self.assertEqual(self.client.get("/stream").status_code, 503)
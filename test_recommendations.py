@@ -0,0 +1,173 @@
+"""Who-to-follow recommendation tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_recommendations.py
+
+
+from datetime import datetime, timedelta
+import os
+from unittest import TestCase, mock
+
+from models import db, User, Message, Recommendation, StaleRecommendation
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+import recommendations
+from recommendations import (
+    refresh_recommendations, suggestions_for, suggestions_query)
+import social
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecommendationTestCase(TestCase):
+    def setUp(self):
+        Recommendation.query.delete()
+        StaleRecommendation.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        users = [User.signup(f"u{n}", f"u{n}@email.com", "password", None)
+                 for n in range(5)]
+        db.session.flush()
+
+        self.ids = [user.id for user in users]
+        u0, u1, u2, u3, u4 = self.ids
+
+        m1 = Message(text="m1-text", user_id=u1)
+        m4 = Message(text="m4-text", user_id=u4)
+        db.session.add_all([m1, m4])
+        db.session.flush()
+
+        # u0 follows u1, who follows u2, u3 and u0 back
+        for follower, followed in [(u0, u1), (u1, u2), (u1, u3), (u1, u0)]:
+            social.follow(follower, followed)
+
+        # u0 and u2 both like u1; u2 also likes u4
+        social.apply_likes({
+            (u0, m1.id): True,
+            (u2, m1.id): True,
+            (u2, m4.id): True,
+        })
+
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def suggested_ids(self, user_id):
+        return [user.id for user in suggestions_for(user_id, 10)]
+
+    def test_suggest(self):
+        u0, u1, u2, u3, u4 = self.ids
+        rows = db.session.execute(suggestions_query([u0], 10)).all()
+
+        scores = {candidate_id: score for user_id, candidate_id, score in rows}
+
+        # friends of friends count 1 each, a co-liked author less; u1 is
+        # already followed
+        self.assertEqual(scores, {u2: 1, u3: 1, u4: 0.25})
+        self.assertEqual(
+            len(db.session.execute(suggestions_query([u0], 2)).all()), 2)
+
+    def test_suggest_in_bulk(self):
+        u0, u1, u2, u3, u4 = self.ids
+
+        rows = db.session.execute(suggestions_query(self.ids, 10)).all()
+
+        # u2 gets u1 from u0 liking u1 too; nobody else has candidates
+        self.assertEqual(
+            {(user_id, candidate_id): score
+             for user_id, candidate_id, score in rows},
+            {(u0, u2): 1, (u0, u3): 1, (u0, u4): 0.25, (u2, u1): 0.25})
+
+    def test_fanout_keeps_most_recently_liked(self):
+        u0, u1, u2, u3, u4 = self.ids
+
+        # u2's likes, newest first: u3, u4, then u1 (already followed)
+        now = datetime.utcnow()
+        Message.query.filter_by(user_id=u1).update(
+            {'timestamp': now - timedelta(days=2)})
+        Message.query.filter_by(user_id=u4).update(
+            {'timestamp': now - timedelta(days=1)})
+        m3 = Message(text="m3-text", user_id=u3, timestamp=now)
+        db.session.add(m3)
+        db.session.flush()
+        social.apply_likes({(u2, m3.id): True})
+        db.session.commit()
+
+        with mock.patch.object(recommendations, 'FANOUT', 2):
+            rows = db.session.execute(suggestions_query([u0], 10)).all()
+
+        # the lowest ids would have kept u1 and u3, dropping u4
+        scores = {candidate_id: score for user_id, candidate_id, score in rows}
+        self.assertEqual(scores[u4], 0.25)
+
+    def test_refresh_and_read(self):
+        u0, u1, u2, u3, u4 = self.ids
+
+        num_done = refresh_recommendations(echo=lambda line: None)
+
+        self.assertEqual(num_done, 5)
+        self.assertEqual(self.suggested_ids(u0), [u2, u3, u4])
+        self.assertEqual(StaleRecommendation.query.count(), 0)
+
+    def test_followed_since_is_left_out(self):
+        u0, u1, u2, u3, u4 = self.ids
+        refresh_recommendations(echo=lambda line: None)
+
+        social.follow(u0, u2)
+        db.session.commit()
+
+        self.assertEqual(self.suggested_ids(u0), [u3, u4])
+
+    def test_incremental_refresh(self):
+        u0, u1, u2, u3, u4 = self.ids
+        refresh_recommendations(echo=lambda line: None)
+
+        # u3 now follows u1, so u3 gets u2 and u0 suggested
+        social.follow(u3, u1)
+        db.session.commit()
+
+        num_done = refresh_recommendations(
+            incremental=True, echo=lambda line: None)
+
+        self.assertEqual(num_done, 1)
+        self.assertEqual(self.suggested_ids(u3), [u0, u2])
+        self.assertEqual(
+            refresh_recommendations(incremental=True, echo=lambda line: None),
+            0)
+
+    def test_homepage_shows_suggestions(self):
+        u0, u1, u2, u3, u4 = self.ids
+        refresh_recommendations(echo=lambda line: None)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u0
+
+            html = c.get("/").get_data(as_text=True)
+
+        self.assertIn("Who to follow", html)
+        self.assertIn(f'action="/users/follow/{u2}"', html)
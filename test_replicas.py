@@ -0,0 +1,140 @@
+"""Connection settings and read-replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_replicas.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, select
+
+from models import db, engine_options, User, Message
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+# a local file standing in for a replica of the test database
+REPLICA_PATH = os.path.join(tempfile.gettempdir(), "warbler_test_replica.db")
+REPLICA_URL = f"sqlite:///{REPLICA_PATH}"
+
+
+class EngineOptionsTestCase(TestCase):
+    def test_postgresql_options(self):
+        options = engine_options(
+            {'DB_POOL_SIZE': 20, 'DB_STATEMENT_TIMEOUT_MS': 5000},
+            "postgresql:///warbler")
+
+        self.assertEqual(options['pool_size'], 20)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(
+            options['connect_args'], {'options': "-c statement_timeout=5000"})
+
+    def test_sqlite_options(self):
+        options = engine_options({'DB_POOL_SIZE': 20}, REPLICA_URL)
+
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('connect_args', options)
+
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u2.location = "Primary"
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        # the replica has the same users, but lags behind on u2
+        if os.path.exists(REPLICA_PATH):
+            os.remove(REPLICA_PATH)
+
+        self.replica = create_engine(REPLICA_URL)
+        db.metadata.create_all(self.replica)
+
+        rows = [dict(row._mapping) for row in db.session.execute(
+            select(User.__table__))]
+
+        for row in rows:
+            if row['id'] == self.u2_id:
+                row['location'] = "Replica"
+
+        with self.replica.begin() as conn:
+            conn.execute(User.__table__.insert(), rows)
+
+        db.engines['replica_0'] = self.replica
+        app.config['DATABASE_REPLICA_URLS'] = [REPLICA_URL]
+
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        app.config['DATABASE_REPLICA_URLS'] = []
+        del db.engines['replica_0']
+
+        db.session.rollback()
+        db.session.close()
+        self.replica.dispose()
+        os.remove(REPLICA_PATH)
+
+    def get_location(self, path):
+        html = self.client.get(path).get_data(as_text=True)
+
+        if "Replica" in html:
+            return "Replica"
+        if "Primary" in html:
+            return "Primary"
+
+    def test_read_only_view_uses_replica(self):
+        self.assertEqual(self.get_location(f"/users/{self.u2_id}"), "Replica")
+
+    def test_other_views_use_primary(self):
+        self.assertEqual(
+            self.get_location(f"/users/{self.u2_id}/following/"), "Primary")
+
+    def test_reads_own_writes(self):
+        self.client.post("/messages/new", data={"text": "Hello"})
+
+        self.assertEqual(self.get_location(f"/users/{self.u2_id}"), "Primary")
+        self.assertEqual(
+            db.session.scalar(select(Message.text)), "Hello")
+
+        with self.client.session_transaction() as sess:
+            sess['primary_until'] = 0
+
+        self.assertEqual(self.get_location(f"/users/{self.u2_id}"), "Replica")
+
+    def test_no_replicas(self):
+        app.config['DATABASE_REPLICA_URLS'] = []
+
+        self.assertEqual(self.get_location(f"/users/{self.u2_id}"), "Primary")
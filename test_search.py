@@ -0,0 +1,223 @@
+"""Search tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_search.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from models import db, User, Message, MessageSearchTerm
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from search import (
+    reindex_users, search_users, user_terms, reindex_messages,
+    search_messages, message_terms)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class UserSearchTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        alice = User.signup("alice", "alice@email.com", "password", None)
+        bob = User.signup("bob", "bob@email.com", "password", None)
+        carol = User.signup("carol", "carol@email.com", "password", None)
+
+        bob.bio = "Best friends with alice"
+        carol.location = "Alicetown"
+        db.session.commit()
+
+        reindex_users(echo=lambda line: None)
+
+        self.alice_id = alice.id
+        self.bob_id = bob.id
+        self.carol_id = carol.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search(self, q, per_page=10, **cursors):
+        return [user.username for user in search_users(q, per_page, **cursors)]
+
+    def test_user_terms(self):
+        terms = user_terms(User.query.get(self.carol_id))
+
+        self.assertIn("carol", terms)
+        self.assertIn("car", terms)
+        self.assertIn("alicetown", terms)
+        self.assertGreater(terms["carol"], terms["alicetown"])
+
+    def test_ranked_by_match_strength(self):
+        self.assertEqual(self.search("alice"), ["alice", "bob", "carol"])
+        self.assertEqual(self.search("ali"), ["alice", "carol"])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search("best alice"), ["bob"])
+        self.assertEqual(self.search("best carol"), [])
+
+    def test_paginated(self):
+        page = search_users("ali", 1)
+        self.assertEqual([user.username for user in page], ["alice"])
+
+        self.assertEqual(
+            self.search("ali", 1, after=page.next_cursor), ["carol"])
+
+    def test_short_query_prefix_fallback(self):
+        self.assertEqual(self.search("b"), ["bob"])
+
+    def test_signup_and_edit_update_index(self):
+        with self.client as c:
+            c.post("/signup", data={"username": "dave",
+                                    "password": "password",
+                                    "email": "dave@email.com"})
+            self.assertEqual(self.search("dave"), ["dave"])
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.bob_id
+
+            c.post("/users/profile", data={"username": "robert",
+                                           "email": "bob@email.com",
+                                           "password": "password"})
+            self.assertEqual(self.search("robert"), ["robert"])
+            self.assertEqual(self.search("bob"), [])
+
+    def test_list_users_search(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+
+            html = c.get("/users?q=friends").get_data(as_text=True)
+            self.assertIn("@bob", html)
+            self.assertNotIn("@carol", html)
+
+
+class MessageSearchTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        alice = User.signup("alice", "alice@email.com", "password", None)
+        bob = User.signup("bob", "bob@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="Coffee is great", user_id=alice.id,
+                     timestamp=datetime(2023, 1, 1))
+        m2 = Message(text="coffee coffee COFFEE and cake", user_id=bob.id,
+                     timestamp=datetime(2023, 2, 1))
+        m3 = Message(text="Cake for breakfast", user_id=alice.id,
+                     timestamp=datetime(2023, 3, 1))
+        db.session.add_all([m1, m2, m3])
+        db.session.commit()
+
+        reindex_messages(echo=lambda line: None)
+
+        self.alice_id = alice.id
+        self.bob_id = bob.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+        self.m3_id = m3.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search(self, q, per_page=10, **kwargs):
+        return [msg.id for msg in search_messages(q, per_page, **kwargs)]
+
+    def test_message_terms(self):
+        terms = message_terms("The coffee, the COFFEE!")
+
+        self.assertEqual(terms, {"coffee": 2})
+
+    def test_ranked_by_occurrences_then_recency(self):
+        self.assertEqual(self.search("coffee"), [self.m2_id, self.m1_id])
+        self.assertEqual(self.search("cake"), [self.m3_id, self.m2_id])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search("coffee cake"), [self.m2_id])
+        self.assertEqual(self.search("coffee breakfast"), [])
+        self.assertEqual(self.search("the"), [])
+
+    def test_filters(self):
+        self.assertEqual(
+            self.search("coffee", author_id=self.alice_id), [self.m1_id])
+        self.assertEqual(
+            self.search("cake", since=datetime(2023, 2, 15)), [self.m3_id])
+        self.assertEqual(
+            self.search("cake", until=datetime(2023, 2, 15)), [self.m2_id])
+
+    def test_paginated(self):
+        page = search_messages("coffee", 1)
+        self.assertEqual([msg.id for msg in page], [self.m2_id])
+
+        page = search_messages("coffee", 1, after=page.next_cursor)
+        self.assertEqual([msg.id for msg in page], [self.m1_id])
+
+        self.assertEqual(
+            self.search("coffee", 1, before=page.prev_cursor), [self.m2_id])
+
+    def test_add_and_delete_update_index(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.bob_id
+
+            c.post("/messages/new", data={"text": "Tea time"})
+            msg = Message.query.filter_by(text="Tea time").one()
+            self.assertEqual(self.search("tea"), [msg.id])
+
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(self.search("tea"), [])
+            self.assertEqual(
+                MessageSearchTerm.query.filter_by(message_id=msg.id).count(),
+                0)
+
+    def test_search_page(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.alice_id
+
+            resp = c.get("/messages/search?q=coffee&author=bob")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("coffee coffee COFFEE", html)
+            self.assertNotIn("Coffee is great", html)
+
+            html = c.get("/messages/search?q=cake&until=2023-02-01").get_data(
+                as_text=True)
+            self.assertIn("coffee coffee COFFEE", html)
+            self.assertNotIn("Cake for breakfast", html)
+
+            html = c.get("/messages/search?q=coffee&author=nobody").get_data(
+                as_text=True)
+            self.assertIn("no messages found", html)
+
+    def test_search_page_unauthorized(self):
+        with self.client as c:
+            resp = c.get("/messages/search?q=coffee")
+            self.assertEqual(resp.status_code, 302)
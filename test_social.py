@@ -0,0 +1,169 @@
+"""Follow and like write path tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_social.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+import social
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class SocialBaseTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+    def get_user(self, user_id):
+        db.session.expire_all()
+        return db.session.get(User, user_id)
+
+
+class SocialTestCase(SocialBaseTestCase):
+    def test_follow_is_idempotent(self):
+        self.assertTrue(social.follow(self.u1_id, self.u2_id))
+        self.assertFalse(social.follow(self.u1_id, self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(Follow.query.count(), 1)
+        self.assertEqual(self.get_user(self.u1_id).following_count, 1)
+        self.assertEqual(self.get_user(self.u2_id).followers_count, 1)
+
+    def test_unfollow_is_idempotent(self):
+        social.follow(self.u1_id, self.u2_id)
+
+        self.assertTrue(social.unfollow(self.u1_id, self.u2_id))
+        self.assertFalse(social.unfollow(self.u1_id, self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(Follow.query.count(), 0)
+        self.assertEqual(self.get_user(self.u1_id).following_count, 0)
+        self.assertEqual(self.get_user(self.u2_id).followers_count, 0)
+
+    def test_like_and_unlike(self):
+        self.assertTrue(social.like(self.u1_id, self.m1_id))
+        self.assertFalse(social.like(self.u1_id, self.m1_id))
+        db.session.commit()
+
+        self.assertEqual(self.get_user(self.u1_id).likes_count, 1)
+
+        self.assertTrue(social.unlike(self.u1_id, self.m1_id))
+        self.assertFalse(social.unlike(self.u1_id, self.m1_id))
+        db.session.commit()
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(self.get_user(self.u1_id).likes_count, 0)
+
+    def test_apply_likes_in_bulk(self):
+        social.like(self.u1_id, self.m1_id)
+
+        num_changed = social.apply_likes({
+            (self.u1_id, self.m1_id): False,
+            (self.u1_id, self.m2_id): True,
+        })
+        db.session.commit()
+
+        self.assertEqual(num_changed, 2)
+        self.assertEqual(
+            self.get_user(self.u1_id).get_liked_message_ids(), {self.m2_id})
+        self.assertEqual(self.get_user(self.u1_id).likes_count, 1)
+
+
+class WriteBehindQueueTestCase(SocialBaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.queue = social.WriteBehindQueue(app, interval=3600)
+
+    def test_toggles_coalesce(self):
+        for liked in [True, False, True]:
+            self.queue.put(self.u1_id, self.m1_id, liked)
+
+        self.queue.put(self.u1_id, self.m2_id, True)
+        self.queue.put(self.u1_id, self.m2_id, False)
+
+        self.assertEqual(
+            self.queue.pending_for(self.u1_id),
+            {self.m1_id: True, self.m2_id: False})
+        self.assertEqual(Like.query.count(), 0)
+
+        self.queue.flush()
+
+        self.assertEqual(self.queue.pending_for(self.u1_id), {})
+        self.assertEqual(
+            self.get_user(self.u1_id).get_liked_message_ids(), {self.m1_id})
+        self.assertEqual(self.get_user(self.u1_id).likes_count, 1)
+
+    def test_failed_change_is_dropped_alone(self):
+        self.queue.put(self.u1_id, self.m1_id, True)
+        self.queue.put(self.u1_id, 0, True)
+
+        self.queue.flush()
+
+        self.assertEqual(
+            self.get_user(self.u1_id).get_liked_message_ids(), {self.m1_id})
+
+    def test_queued_like_shows_as_liked(self):
+        social.follow(self.u1_id, self.u2_id)
+        db.session.commit()
+
+        self.queue.put(self.u1_id, self.m1_id, True)
+        original, app.extensions['like_queue'] = (
+            app.extensions['like_queue'], self.queue)
+
+        try:
+            with app.test_client() as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                html = c.get("/").get_data(as_text=True)
+        finally:
+            app.extensions['like_queue'] = original
+
+        self.assertIn(f'action="/messages/{self.m1_id}/unlike"', html)
+        self.assertIn(f'action="/messages/{self.m2_id}/like"', html)
@@ -0,0 +1,64 @@
+"""Compiled template cache tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_template_cache.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+# BEFORE we build an app, let's set an environmental variable
+# to use a different database for tests
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import create_app
+from template_cache import load_templates
+
+
+class TemplateCacheTestCase(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.cache_dir.cleanup()
+
+    def num_templates(self, app):
+        templates_dir = os.path.join(app.root_path, app.template_folder)
+        return sum(len(files) for _, _, files in os.walk(templates_dir))
+
+    def test_precompile(self):
+        app = create_app({'TEMPLATE_CACHE_DIR': self.cache_dir.name})
+
+        result = app.test_cli_runner().invoke(args=["precompile-templates"])
+
+        num_templates = self.num_templates(app)
+
+        self.assertIn(f"Compiled {num_templates} templates", result.output)
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), num_templates)
+
+    def test_precompiled_templates_are_not_compiled_again(self):
+        load_templates(create_app({'TEMPLATE_CACHE_DIR': self.cache_dir.name}))
+
+        app = create_app({'TEMPLATE_CACHE_DIR': self.cache_dir.name})
+        compiled = []
+        compile = app.jinja_env.compile
+
+        def compile_and_record(source, name=None, *args, **kwargs):
+            compiled.append(name)
+            return compile(source, name, *args, **kwargs)
+
+        app.jinja_env.compile = compile_and_record
+
+        self.assertEqual(load_templates(app), self.num_templates(app))
+        self.assertEqual(compiled, [])
+
+    def test_off_by_default(self):
+        app = create_app()
+
+        self.assertIsNone(app.jinja_env.bytecode_cache)
+
+        result = app.test_cli_runner().invoke(args=["precompile-templates"])
+        self.assertNotEqual(result.exit_code, 0)
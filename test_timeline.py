@@ -0,0 +1,194 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from fragments import message_fragments
+import timeline
+import counters
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class TimelineBaseTestCase(TestCase):
+    def setUp(self):
+        app.config['TIMELINE_ENABLED'] = True
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 10000
+
+        TimelineEntry.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        counters.reconcile_counters(echo=lambda line: None)
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        message_fragments.clear()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_ENABLED'] = False
+
+    def post_as(self, user_id, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.post("/messages/new", data={"text": text})
+
+    def timeline_texts(self, user_id):
+        user = User.query.get(user_id)
+        return [msg.text for msg in timeline.get_timeline_page(user, 100)]
+
+    def timeline_size(self, user_id):
+        return db.session.scalar(
+            db.select(User.timeline_size).where(User.id == user_id))
+
+
+class FanOutTestCase(TimelineBaseTestCase):
+    def test_fan_out_to_followers(self):
+        self.post_as(self.u2_id, "hello from u2")
+
+        self.assertEqual(self.timeline_texts(self.u1_id), ["hello from u2"])
+        self.assertEqual(self.timeline_texts(self.u2_id), ["hello from u2"])
+        self.assertEqual(self.timeline_texts(self.u3_id), [])
+
+    def test_homepage_reads_timeline(self):
+        self.post_as(self.u2_id, "hello from u2")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("hello from u2", html)
+
+    def test_trim_to_depth(self):
+        app.config['TIMELINE_DEPTH'] = 2
+        app.config['TIMELINE_TRIM_SLACK'] = 0
+
+        try:
+            for i in range(4):
+                self.post_as(self.u2_id, f"message {i}")
+
+            self.assertEqual(
+                self.timeline_texts(self.u1_id), ["message 3", "message 2"])
+            self.assertEqual(self.timeline_size(self.u1_id), 2)
+        finally:
+            app.config['TIMELINE_DEPTH'] = 800
+            app.config['TIMELINE_TRIM_SLACK'] = 50
+
+    def test_trim_once_over_slack(self):
+        app.config['TIMELINE_DEPTH'] = 2
+        app.config['TIMELINE_TRIM_SLACK'] = 2
+
+        try:
+            for i in range(4):
+                self.post_as(self.u2_id, f"message {i}")
+
+            # up to depth + slack, nothing is trimmed
+            self.assertEqual(
+                TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 4)
+            self.assertEqual(self.timeline_size(self.u1_id), 4)
+
+            # going over trims straight back to depth, whatever the id
+            self.post_as(self.u2_id, "message 4")
+
+            self.assertEqual(
+                self.timeline_texts(self.u1_id), ["message 4", "message 3"])
+            self.assertEqual(self.timeline_size(self.u1_id), 2)
+        finally:
+            app.config['TIMELINE_DEPTH'] = 800
+            app.config['TIMELINE_TRIM_SLACK'] = 50
+
+    def test_celebrity_read_at_query_time(self):
+        app.config['TIMELINE_CELEBRITY_FOLLOWERS'] = 1
+
+        self.post_as(self.u2_id, "celebrity post")
+
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 0)
+        self.assertEqual(self.timeline_texts(self.u1_id), ["celebrity post"])
+
+
+class FollowTimelineTestCase(TimelineBaseTestCase):
+    def test_follow_backfills_and_unfollow_removes(self):
+        self.post_as(self.u3_id, "hello from u3")
+        self.assertEqual(self.timeline_texts(self.u1_id), [])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/users/follow/{self.u3_id}")
+            self.assertEqual(self.timeline_texts(self.u1_id), ["hello from u3"])
+
+            c.post(f"/users/stop-following/{self.u3_id}")
+            self.assertEqual(self.timeline_texts(self.u1_id), [])
+
+    def test_rebuild_timelines(self):
+        m = Message(text="seeded", user_id=self.u2_id)
+        db.session.add(m)
+        db.session.commit()
+
+        timeline.rebuild_timelines(echo=lambda line: None)
+
+        self.assertEqual(self.timeline_texts(self.u1_id), ["seeded"])
+        self.assertEqual(self.timeline_size(self.u1_id), 1)
+        self.assertEqual(self.timeline_size(self.u2_id), 1)
+
+    def test_rebuild_keeps_newest_per_user(self):
+        for i in range(3):
+            db.session.add(Message(text=f"seeded {i}", user_id=self.u2_id))
+            db.session.commit()
+
+        app.config['TIMELINE_DEPTH'] = 2
+
+        try:
+            timeline.rebuild_timelines(batch_size=1, echo=lambda line: None)
+        finally:
+            app.config['TIMELINE_DEPTH'] = 800
+
+        self.assertEqual(
+            self.timeline_texts(self.u1_id), ["seeded 2", "seeded 1"])
+        self.assertEqual(self.timeline_size(self.u1_id), 2)
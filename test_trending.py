@@ -0,0 +1,134 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_trending.py
+
+
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, TrendingBucket
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from testing import app, CURR_USER_KEY
+from cache import user_cache
+from trending import TrendingLikes, trending_likes
+import social
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+# Don't have WTForms use CSRF at all, since it's a pain to test
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+HOUR = 3600
+
+
+class TrendingBaseTestCase(TestCase):
+    def setUp(self):
+        TrendingBucket.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        user_cache.clear()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+    def tearDown(self):
+        db.session.rollback()
+        db.session.expunge_all()
+
+
+class TrendingLikesTestCase(TrendingBaseTestCase):
+    def setUp(self):
+        super().setUp()
+
+        # checkpointed by hand
+        self.trending = TrendingLikes(interval=0)
+
+    def test_windows_and_decay(self):
+        now = time.time()
+
+        # m1 was liked a lot five hours ago, m2 a little just now
+        self.trending.add({self.m1_id: 3}, now=now - 5 * HOUR)
+        self.trending.add({self.m2_id: 2}, now=now)
+        self.trending.flush(now=now)
+        self.trending.refresh(now=now)
+
+        self.assertEqual(
+            [message_id for score, message_id in self.trending.top('hour')],
+            [self.m2_id])
+        self.assertEqual(
+            [message_id for score, message_id in self.trending.top('day')],
+            [self.m2_id, self.m1_id])
+
+    def test_checkpoints_add_up(self):
+        now = time.time()
+
+        self.trending.add({self.m1_id: 2}, now=now)
+        self.trending.flush(now=now)
+        self.trending.add({self.m1_id: -1, self.m2_id: 1}, now=now)
+        self.trending.flush(now=now)
+
+        self.assertEqual(
+            {row.message_id: row.likes for row in TrendingBucket.query},
+            {self.m1_id: 1, self.m2_id: 1})
+
+    def test_expired_buckets_are_dropped(self):
+        now = time.time()
+
+        self.trending.add({self.m1_id: 1}, now=now - 2 * 24 * HOUR)
+        self.trending.add({self.m2_id: 1}, now=now)
+        self.trending.flush(now=now)
+        self.trending.refresh(now=now)
+
+        self.assertEqual(
+            [row.message_id for row in TrendingBucket.query], [self.m2_id])
+        self.assertEqual(len(self.trending.buckets), 1)
+
+
+class TrendingViewTestCase(TrendingBaseTestCase):
+    def test_committed_likes_trend(self):
+        social.like(self.u1_id, self.m1_id)
+        db.session.commit()
+
+        social.like(self.u1_id, self.m2_id)
+        db.session.rollback()
+
+        trending_likes.checkpoint()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get("/messages/trending").get_data(as_text=True)
+            resp = c.get("/messages/trending?window=week")
+
+        self.assertIn("m1-text", html)
+        self.assertNotIn("m2-text", html)
+        self.assertEqual(resp.status_code, 404)
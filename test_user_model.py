@@ -20,7 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 # Now we can import app
 
-from app import app
+from testing import app
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -88,6 +88,33 @@ class UserFollowTestCase(UserModelTestCase):
         self.assertFalse(u1.is_followed_by(u2))
 
 
+class UserMembershipIdsTestCase(UserModelTestCase):
+    """Test cases for the set-based following/liked id lookups"""
+
+    def test_get_following_ids(self):
+        """Test User method .get_following_ids"""
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        self.assertEqual(u1.get_following_ids(), set())
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.assertEqual(u1.get_following_ids(), {self.u2_id})
+        self.assertEqual(u2.get_following_ids(), set())
+
+    def test_get_liked_message_ids(self):
+        """Test User method .get_liked_message_ids"""
+        u1 = User.query.get(self.u1_id)
+        msg = Message(text="test", user_id=self.u2_id)
+
+        u1.liked_messages.append(msg)
+        db.session.commit()
+
+        self.assertEqual(u1.get_liked_message_ids(), {msg.id})
+
+
 class UserSignupTestCase(UserModelTestCase):
     """Test cases for valid and invalid user signup"""
 
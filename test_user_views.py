@@ -6,6 +6,8 @@
 
 
 import os
+import re
+from datetime import datetime
 from unittest import TestCase
 
 from models import db, Message, User
@@ -19,7 +21,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from testing import app, CURR_USER_KEY
 
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -81,6 +83,60 @@ class HomePageTestCase(UserBaseViewTestCase):
             self.assertIn("this is homepage and u1 is logged in", html)
 
 
+class HomePagePaginationTestCase(UserBaseViewTestCase):
+    def test_home_pages_older_and_newer(self):
+        for i in range(3):
+            db.session.add(Message(
+                text=f"message {i}",
+                user_id=self.u1_id,
+                timestamp=datetime(2023, 1, i + 1)))
+        db.session.commit()
+
+        app.config['FEED_PAGE_SIZE'] = 2
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                html = c.get("/").get_data(as_text=True)
+                self.assertIn("message 2", html)
+                self.assertIn("message 1", html)
+                self.assertNotIn("message 0", html)
+                self.assertIn("Older", html)
+
+                older_url = re.search(r'href="(/\?after=[^"]+)"', html)[1]
+                html = c.get(older_url.replace("&amp;", "&")).get_data(
+                    as_text=True)
+                self.assertIn("message 0", html)
+                self.assertNotIn("message 2", html)
+                self.assertIn("Newer", html)
+                self.assertNotIn("Older", html)
+        finally:
+            app.config['FEED_PAGE_SIZE'] = 100
+
+
+class UserListPaginationTestCase(UserBaseViewTestCase):
+    def test_list_users_pages(self):
+        app.config['USERS_PAGE_SIZE'] = 1
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+
+                html = c.get("/users").get_data(as_text=True)
+                self.assertIn("@u1", html)
+                self.assertNotIn("@u2", html)
+
+                html = c.get(f"/users?after={self.u1_id}").get_data(
+                    as_text=True)
+                self.assertIn("@u2", html)
+                self.assertNotIn("@u1<", html)
+        finally:
+            app.config['USERS_PAGE_SIZE'] = 48
+
+
 class UserSignUpTestCase(UserBaseViewTestCase):
 
     def test_signup_user_valid(self):
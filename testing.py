@@ -0,0 +1,13 @@
+"""Shared setup for the test modules.
+
+    from testing import app, CURR_USER_KEY
+
+stands in for importing them from app.py: setting up and checking data
+happens outside of requests, so the app comes with an app context pushed
+for the whole test run (the test client's requests share it). Set
+`DATABASE_URL` before importing it.
+"""
+
+from app import app, CURR_USER_KEY
+
+app.app_context().push()
@@ -0,0 +1,306 @@
+"""Fan-out-on-write home timelines for Warbler.
+
+When `TIMELINE_ENABLED` is set, every new message is copied into the
+`timeline_entries` table of its author and of each of the author's followers,
+so the homepage reads a single indexed range instead of an `IN (...)` query
+over all followed users. Authors with at least `TIMELINE_CELEBRITY_FOLLOWERS`
+followers are not fanned out; their messages are merged in at read time.
+
+Each user's `timeline_size` counts their entries (or a few more, if
+messages were deleted since). A fan-out bumps it for every recipient in one
+UPDATE, and a timeline that goes more than `TIMELINE_TRIM_SLACK` entries
+over `TIMELINE_DEPTH` is trimmed back to depth and recounted. So a post
+usually trims nobody, and no timeline ever runs further over depth than
+that. Reads only ever look at the newest pages.
+"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import (
+    delete, func, literal, select, tuple_, union_all, update)
+
+from models import db, Follow, Message, TimelineEntry, User
+from pagination import paginate, merge_pages, message_key
+
+DEFAULT_TIMELINE_DEPTH = 800
+DEFAULT_CELEBRITY_FOLLOWERS = 10000
+DEFAULT_TRIM_SLACK = 50
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+
+def timeline_enabled():
+    """Is the materialized timeline turned on for this app?"""
+
+    return current_app.config.get('TIMELINE_ENABLED', False)
+
+
+def timeline_depth():
+    """Number of entries kept per user timeline."""
+
+    return current_app.config.get('TIMELINE_DEPTH', DEFAULT_TIMELINE_DEPTH)
+
+
+def trim_slack():
+    """Entries a timeline may go over depth before it's trimmed."""
+
+    return current_app.config.get('TIMELINE_TRIM_SLACK', DEFAULT_TRIM_SLACK)
+
+
+def celebrity_threshold():
+    """Follower count at which an author is read at query time instead."""
+
+    return current_app.config.get(
+        'TIMELINE_CELEBRITY_FOLLOWERS', DEFAULT_CELEBRITY_FOLLOWERS)
+
+
+def is_celebrity(user_id):
+    """Does this author have too many followers to fan out to?"""
+
+    num_followers = db.session.scalar(
+        select(User.followers_count).where(User.id == user_id))
+
+    return num_followers >= celebrity_threshold()
+
+
+def followed_celebrity_ids(user_id):
+    """Ids of the celebrity authors that `user_id` follows."""
+
+    stmt = (select(User.id)
+            .join(Follow, Follow.user_being_followed_id == User.id)
+            .where(Follow.user_following_id == user_id)
+            .where(User.followers_count >= celebrity_threshold()))
+
+    return db.session.scalars(stmt).all()
+
+
+def trim_timelines(user_ids):
+    """Drop entries beyond the configured depth for the given users.
+
+    `user_ids` may be a list or a select of ids. Each timeline is ranked in
+    one pass over its index, newest first, and everything past depth goes.
+    """
+
+    ranked = (select(
+                TimelineEntry.user_id,
+                TimelineEntry.message_id,
+                func.row_number().over(
+                    partition_by=TimelineEntry.user_id,
+                    order_by=(TimelineEntry.timestamp.desc(),
+                              TimelineEntry.message_id.desc()),
+                ).label('rank'))
+              .where(TimelineEntry.user_id.in_(user_ids))
+              .cte('ranked'))
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(tuple_(TimelineEntry.user_id, TimelineEntry.message_id).in_(
+            select(ranked.c.user_id, ranked.c.message_id)
+            .where(ranked.c.rank > timeline_depth())))
+        .execution_options(synchronize_session=False))
+
+
+def count_timelines(user_ids):
+    """Set `timeline_size` of the given users to their number of entries.
+
+    `user_ids` may be a list or a select of ids.
+    """
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values(timeline_size=(
+            select(func.count())
+            .select_from(TimelineEntry)
+            .where(TimelineEntry.user_id == User.id)
+            .scalar_subquery()))
+        .execution_options(synchronize_session=False))
+
+
+def fan_out_message(msg):
+    """Copy a newly flushed message into its readers' timelines.
+
+    The author always gets the entry; followers get it unless the author is
+    a celebrity. Runs inside the caller's transaction.
+    """
+
+    author_id = msg.user_id
+    recipients = select(literal(author_id).label('user_id'))
+
+    if not is_celebrity(author_id):
+        followers = (select(Follow.user_following_id.label('user_id'))
+                     .where(Follow.user_being_followed_id == author_id))
+        recipients = union_all(recipients, followers)
+
+    recipients = recipients.subquery()
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(
+            ENTRY_COLUMNS,
+            select(
+                recipients.c.user_id,
+                literal(msg.id),
+                literal(author_id),
+                literal(msg.timestamp, db.DateTime))))
+
+    recipient_ids = select(recipients.c.user_id)
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(recipient_ids))
+        .values(timeline_size=User.timeline_size + 1)
+        .execution_options(synchronize_session=False))
+
+    over_cap = db.session.scalars(
+        select(User.id)
+        .where(User.id.in_(recipient_ids))
+        .where(User.timeline_size > timeline_depth() + trim_slack())).all()
+
+    if over_cap:
+        trim_timelines(over_cap)
+        count_timelines(over_cap)
+
+
+def add_author_to_timeline(user_id, author_id):
+    """Backfill `author_id`'s recent messages after `user_id` follows them."""
+
+    if is_celebrity(author_id):
+        return
+
+    recent = (select(
+                literal(user_id),
+                Message.id,
+                Message.user_id,
+                Message.timestamp)
+              .where(Message.user_id == author_id)
+              .order_by(Message.timestamp.desc())
+              .limit(timeline_depth()))
+
+    db.session.execute(
+        TimelineEntry.__table__.insert().from_select(ENTRY_COLUMNS, recent))
+
+    trim_timelines([user_id])
+    count_timelines([user_id])
+
+
+def remove_author_from_timeline(user_id, author_id):
+    """Remove `author_id`'s messages after `user_id` unfollows them."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(TimelineEntry.author_id == author_id))
+
+    count_timelines([user_id])
+
+
+def get_timeline_page(user, per_page, after=None, before=None,
+                      messages=None):
+    """Return one `Page` of messages from `user`'s home timeline.
+
+    Reads the materialized entries and merges in messages from any followed
+    celebrities, which are not fanned out on write. `after` / `before` are
+    decoded `(timestamp, id)` cursors. `messages` is the query of messages
+    to read from, `Message.query` by default.
+    """
+
+    if messages is None:
+        messages = Message.query
+
+    page = paginate(
+        (messages
+         .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+         .filter(TimelineEntry.user_id == user.id)),
+        [TimelineEntry.timestamp, TimelineEntry.message_id],
+        message_key,
+        per_page,
+        after=after,
+        before=before)
+
+    celebrity_ids = followed_celebrity_ids(user.id)
+
+    if celebrity_ids:
+        celebrity_page = paginate(
+            messages.filter(Message.user_id.in_(celebrity_ids)),
+            [Message.timestamp, Message.id],
+            message_key,
+            per_page,
+            after=after,
+            before=before)
+
+        # an author who recently became a celebrity can appear in both pages
+        page = merge_pages(
+            [page, celebrity_page], per_page, backwards=before is not None)
+
+    return page
+
+
+def rebuild_timelines(batch_size=500, echo=print):
+    """Rebuild every user's timeline from the follows and messages tables.
+
+    Works through users in id order, one INSERT ... SELECT and one commit
+    per batch: each user's own messages and those of the non-celebrities
+    they follow, the newest `TIMELINE_DEPTH` of them ranked per user.
+    """
+
+    depth = timeline_depth()
+    last_id = 0
+    num_done = 0
+
+    while True:
+        user_ids = db.session.scalars(
+            select(User.id)
+            .where(User.id > last_id)
+            .order_by(User.id)
+            .limit(batch_size)).all()
+
+        if not user_ids:
+            break
+
+        db.session.execute(
+            delete(TimelineEntry).where(TimelineEntry.user_id.in_(user_ids)))
+
+        readers = union_all(
+            select(User.id.label('user_id'), User.id.label('author_id'))
+            .where(User.id.in_(user_ids)),
+            select(Follow.user_following_id, Follow.user_being_followed_id)
+            .join(User, User.id == Follow.user_being_followed_id)
+            .where(Follow.user_following_id.in_(user_ids))
+            .where(User.followers_count < celebrity_threshold()),
+        ).subquery()
+
+        ranked = (select(
+                    readers.c.user_id,
+                    Message.id.label('message_id'),
+                    Message.user_id.label('author_id'),
+                    Message.timestamp,
+                    func.row_number().over(
+                        partition_by=readers.c.user_id,
+                        order_by=(Message.timestamp.desc(), Message.id.desc()),
+                    ).label('rank'))
+                  .join(Message, Message.user_id == readers.c.author_id)
+                  .subquery())
+
+        db.session.execute(
+            TimelineEntry.__table__.insert().from_select(
+                ENTRY_COLUMNS,
+                select(ranked.c.user_id, ranked.c.message_id,
+                       ranked.c.author_id, ranked.c.timestamp)
+                .where(ranked.c.rank <= depth)))
+
+        count_timelines(user_ids)
+        db.session.commit()
+
+        last_id = user_ids[-1]
+        num_done += len(user_ids)
+        echo(f"Rebuilt timelines for {num_done} users")
+
+
+@click.command('rebuild-timelines')
+@click.option('--batch-size', default=500, help="Users per transaction.")
+@with_appcontext
+def rebuild_timelines_command(batch_size):
+    """Rebuild the materialized home timelines from scratch."""
+
+    rebuild_timelines(batch_size=batch_size, echo=click.echo)
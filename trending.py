@@ -0,0 +1,278 @@
+"""Trending messages for Warbler.
+
+Likes are counted per message in time buckets of `TRENDING_BUCKET_SECONDS`.
+Likes and unlikes this process commits go into pending counts in memory.
+Every `TRENDING_CHECKPOINT_SECONDS` a background thread adds them to the
+`trending_buckets` table (one row per bucket and message, upserted) and
+re-reads the recent buckets, which by then hold every process's likes.
+
+Each process keeps the buckets of the last day in memory, each as two
+integer arrays (message ids and their counts). A bucket stops changing
+once every process has checkpointed it, so a checkpoint only re-reads the
+last few. From the buckets it ranks each window, a like counting for less
+the older its bucket:
+
+    hour    likes of the last hour, worth half after 15 minutes
+    day     likes of the last day, worth half after 6 hours
+
+/messages/trending reads the ranking from memory; nothing reads the
+`likes` table. A like reaches the ranking within a checkpoint or two, and
+likes still pending when a process is killed are lost from it (not from
+`likes` or the like counts).
+
+Each app gets its own counts (`init_app`, in `app.extensions`);
+`trending_likes` is the current app's.
+"""
+
+import atexit
+import heapq
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import Counter
+
+from flask import current_app
+from sqlalchemy import delete, event, select
+from sqlalchemy.orm import Session
+from werkzeug.local import LocalProxy
+
+from models import db, dialect_insert, TrendingBucket
+
+logger = logging.getLogger('warbler.trending')
+
+CHANGES_KEY = 'trending_changes'
+DEFAULT_BUCKET_SECONDS = 300
+DEFAULT_CHECKPOINT_SECONDS = 60
+DEFAULT_SIZE = 50
+
+# name: (length, half-life), in seconds
+WINDOWS = {
+    'hour': (3600, 900),
+    'day': (86400, 6 * 3600),
+}
+
+LONGEST_WINDOW = max(length for length, half_life in WINDOWS.values())
+
+# message ids and counts are 32-bit integer columns
+TYPECODE = 'i'
+
+
+class TrendingLikes:
+    """Rolling like counts per message, and the rankings made from them."""
+
+    def __init__(self, app=None, bucket_seconds=DEFAULT_BUCKET_SECONDS,
+                 interval=DEFAULT_CHECKPOINT_SECONDS, size=DEFAULT_SIZE):
+        self.app = app
+        self.bucket_seconds = bucket_seconds
+        self.interval = interval
+        self.size = size
+        self.buckets = {}
+        self.rankings = {}
+        self.refreshed_at = None
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread_pid = None
+
+    def bucket_of(self, timestamp):
+        """Start of the bucket holding `timestamp`, in epoch seconds."""
+
+        return int(timestamp // self.bucket_seconds) * self.bucket_seconds
+
+    def changed(self, deltas):
+        """Count `{message_id: delta}` once the current transaction commits."""
+
+        db.session.info.setdefault(CHANGES_KEY, Counter()).update(deltas)
+
+    def add(self, deltas, now=None):
+        """Count committed `{message_id: delta}` in the current bucket."""
+
+        bucket = self.bucket_of(time.time() if now is None else now)
+        self._start()
+
+        with self._lock:
+            for message_id, delta in deltas.items():
+                if delta:
+                    self._pending[(bucket, message_id)] += delta
+
+    def top(self, window):
+        """`[(score, message_id)]` trending in `window`, best first."""
+
+        self._start()
+
+        if self.refreshed_at is None:
+            with self._refresh_lock:
+                if self.refreshed_at is None:
+                    self.refresh()
+
+        return self.rankings.get(window, [])
+
+    ##########################################################################
+    # Checkpoints
+
+    def flush(self, now=None):
+        """Add the pending counts to `trending_buckets` and commit.
+
+        Buckets older than the longest window are deleted on the way.
+        """
+
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+
+        rows = [{'bucket': bucket, 'message_id': message_id, 'likes': likes}
+                for (bucket, message_id), likes in sorted(pending.items())
+                if likes]
+
+        if not rows:
+            return
+
+        now = time.time() if now is None else now
+        insert = dialect_insert(TrendingBucket).values(rows)
+
+        try:
+            db.session.execute(insert.on_conflict_do_update(
+                index_elements=['bucket', 'message_id'],
+                set_={'likes': TrendingBucket.likes + insert.excluded.likes}))
+            db.session.execute(
+                delete(TrendingBucket)
+                .where(TrendingBucket.bucket < self.bucket_of(
+                    now - LONGEST_WINDOW))
+                .execution_options(synchronize_session=False))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+            # keep them for the next checkpoint
+            with self._lock:
+                self._pending.update(pending)
+
+            raise
+
+    def refresh(self, now=None):
+        """Re-read the buckets that may have changed, and re-rank."""
+
+        now = time.time() if now is None else now
+        oldest = self.bucket_of(now - LONGEST_WINDOW)
+
+        # a process checkpoints its counts at most an interval after making
+        # them, so buckets from before that were final at the last refresh
+        if self.refreshed_at is None:
+            since = oldest
+        else:
+            since = max(oldest, self.bucket_of(
+                self.refreshed_at - 2 * self.interval - self.bucket_seconds))
+
+        buckets = {bucket: counts for bucket, counts in self.buckets.items()
+                   if oldest <= bucket < since}
+
+        rows = db.session.execute(
+            select(TrendingBucket.bucket, TrendingBucket.message_id,
+                   TrendingBucket.likes)
+            .where(TrendingBucket.bucket >= since))
+
+        for bucket, message_id, likes in rows:
+            message_ids, counts = buckets.setdefault(
+                bucket, (array(TYPECODE), array(TYPECODE)))
+            message_ids.append(message_id)
+            counts.append(likes)
+
+        self.buckets = buckets
+        self.rankings = {
+            window: self._rank(now, length, half_life)
+            for window, (length, half_life) in WINDOWS.items()}
+        self.refreshed_at = now
+
+    def _rank(self, now, length, half_life):
+        scores = Counter()
+
+        for bucket, (message_ids, counts) in self.buckets.items():
+            if bucket + self.bucket_seconds <= now - length:
+                continue
+
+            age = max(now - bucket - self.bucket_seconds / 2, 0)
+            weight = 0.5 ** (age / half_life)
+
+            for message_id, likes in zip(message_ids, counts):
+                scores[message_id] += likes * weight
+
+        return heapq.nlargest(
+            self.size,
+            ((score, message_id) for message_id, score in scores.items()
+             if score > 0))
+
+    def checkpoint(self):
+        """Write this process's pending counts, then refresh the rankings."""
+
+        self.flush()
+
+        with self._refresh_lock:
+            self.refresh()
+
+    def _start(self):
+        """Start this process's checkpoint thread if it isn't running."""
+
+        # a thread doesn't survive fork(); each worker starts its own
+        if self.interval <= 0 or self._thread_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._thread_pid != os.getpid():
+                self._pending = Counter()
+                threading.Thread(
+                    target=self._run, name="trending-checkpoint",
+                    daemon=True).start()
+                atexit.register(self._flush_at_exit)
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                with self.app.app_context():
+                    self.checkpoint()
+            except Exception:
+                logger.exception("Trending checkpoint failed")
+
+    def _flush_at_exit(self):
+        with self.app.app_context():
+            self.flush()
+
+
+def init_app(app):
+    """Give `app` trending counts, set up from `TRENDING_BUCKET_SECONDS`,
+    `TRENDING_SIZE` and `TRENDING_CHECKPOINT_SECONDS` (0 leaves checkpoints
+    to the caller).
+    """
+
+    app.extensions['trending_likes'] = TrendingLikes(
+        app,
+        bucket_seconds=app.config.get(
+            'TRENDING_BUCKET_SECONDS', DEFAULT_BUCKET_SECONDS),
+        interval=app.config.get(
+            'TRENDING_CHECKPOINT_SECONDS', DEFAULT_CHECKPOINT_SECONDS),
+        size=app.config.get('TRENDING_SIZE', DEFAULT_SIZE))
+
+
+# the current app's `TrendingLikes`
+trending_likes = LocalProxy(lambda: current_app.extensions['trending_likes'])
+
+
+@event.listens_for(Session, "after_commit")
+def _count_committed(session):
+    """Count the likes and unlikes of the committed transaction."""
+
+    deltas = session.info.pop(CHANGES_KEY, None)
+
+    if deltas:
+        trending_likes.add(deltas)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_changes(session, previous_transaction):
+    """Rolled back likes never happened."""
+
+    if not session.in_transaction():
+        session.info.pop(CHANGES_KEY, None)